@@ -1,23 +1,51 @@
 # app.py
+import asyncio
 import secrets
 import re
 import base64
 import json
+import zlib
+import hashlib
 import requests
-from fastapi import FastAPI, Depends, HTTPException, status, Query, Body, File, UploadFile
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Body, File, Form, UploadFile, BackgroundTasks, Header, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from pydantic import BaseModel, EmailStr, field_validator
 
 import gradio as gr
 from .keycloak_utils import verify_token
-from .llm import get_response
+from .llm import get_response_with_stats, open_generation, cancel_on_disconnect, CancelToken
+from .metrics import render_metrics, observe_llm_call, LLM_CANCELLED, LLM_TIMEOUTS
+from .scheduler import resolve_priority
+from .routing import route_model, AUTO_MODEL
 from .email_utils import send_verification_email
-from .settings import keycloak_admin, PUBLIC_BASE_URL, KEYCLOAK_URL, REALM, CLIENT_ID, CLIENT_SECRET, KEYCLOAK_TOKEN_URL
-from .chat_history import get_user_history, save_user_message, clear_history
+from .settings import keycloak_admin, PUBLIC_BASE_URL, KEYCLOAK_URL, REALM, CLIENT_ID, CLIENT_SECRET, KEYCLOAK_TOKEN_URL, MODEL, LLM_TIMEOUT, LLM_MAX_TIMEOUT
+from .settings import BATCH_MAX_ITEMS, BATCH_MAX_CONCURRENCY, HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX, HISTORY_RECENT_TURNS
+from .settings import HISTORY_EXPORT_BATCH_SIZE, HISTORY_ARCHIVE_AFTER_DAYS, HISTORY_ARCHIVE_INTERVAL
+from .idempotency import idempotency_store, fingerprint, IdempotencyConflict
+from .chat_history import get_conversation_summary, write_buffer, search_buffer, export_lines
+from .async_chat_history import get_recent_history, get_history_page, save_turn, save_user_messages, clear_history
+from .async_chat_history import (
+    iter_history_batches, purge_history, pending_purges, pending_thread_purges, search_history, history_version,
+)
+from .retention import message_expiry
+from .conversations import (
+    create_conversation, list_conversations, get_conversation, rename_conversation, save_to_conversation,
+    delete_conversation, purge_conversation, conversation_out,
+)
+from .compaction import compact_history, build_chat_context
+from .db import MONGO_ENSURE_INDEXES, MONGO_REQUIRE_INDEX_SCAN, conversations, search_terms, segments, summaries
+from .indexes import (
+    ensure_indexes, check_history_plan, check_count_plan,
+    CONVERSATION_INDEXES, SEARCH_INDEXES, SEGMENT_INDEXES, SUMMARY_INDEXES,
+)
+from .archive import archive_pass
 from .utils.file_utils import extract_text_from_file
 
 # -------------------------------
@@ -66,6 +94,65 @@ security = HTTPBearer()
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def bootstrap_indexes():
+    """Create the chat_history indexes and check that history reads are index scans"""
+    if not MONGO_ENSURE_INDEXES:
+        return
+    try:
+        names = await run_in_threadpool(ensure_indexes)
+        names += await run_in_threadpool(ensure_indexes, conversations, CONVERSATION_INDEXES)
+        names += await run_in_threadpool(ensure_indexes, search_terms, SEARCH_INDEXES)
+        names += await run_in_threadpool(ensure_indexes, segments, SEGMENT_INDEXES)
+        names += await run_in_threadpool(ensure_indexes, summaries, SUMMARY_INDEXES)
+        stages = await run_in_threadpool(check_history_plan)
+        counted = await run_in_threadpool(check_count_plan)
+        print(f"🗂️ chat_history indexes ready: {', '.join(names)} "
+              f"(plan: {' <- '.join(stages)}; count: {' <- '.join(counted)})")
+    except Exception as e:
+        if MONGO_REQUIRE_INDEX_SCAN:
+            raise
+        print(f"⚠️ Warning: chat_history index check failed: {e}")
+
+
+@app.on_event("startup")
+async def resume_purges():
+    """Finish background purges of cleared histories and deleted threads that a restart interrupted"""
+    try:
+        for username, cutoff in await pending_purges():
+            save_in_background(purge_history(username, cutoff))
+        for username, conversation_id in await pending_thread_purges():
+            save_in_background(purge_conversation(username, conversation_id))
+    except Exception as e:
+        print(f"⚠️ Warning: could not resume history purges: {e}")
+
+
+@app.on_event("startup")
+async def start_archiver():
+    """Move old messages into archive segments every HISTORY_ARCHIVE_INTERVAL seconds (if enabled)"""
+    if HISTORY_ARCHIVE_AFTER_DAYS <= 0:
+        return
+
+    async def run():
+        while True:
+            try:
+                moved = await run_in_threadpool(archive_pass)
+                if moved:
+                    print(f"🧊 Archived {moved} messages")
+            except Exception as e:
+                print(f"⚠️ Warning: history archiving failed: {e}")
+            await asyncio.sleep(HISTORY_ARCHIVE_INTERVAL)
+
+    save_in_background(run())
+
+
+@app.on_event("shutdown")
+async def drain_write_buffer():
+    """Write any messages and search-index entries still queued by the write-behind buffers before exiting"""
+    await run_in_threadpool(write_buffer.close)
+    await run_in_threadpool(search_buffer.close)
+
+
 # -------------------------------
 # Auth dependency
 # -------------------------------
@@ -89,6 +176,114 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
+def get_request_timeout(x_request_timeout: float | None = Header(None)) -> float:
+    """
+    Per-request LLM deadline in seconds from the X-Request-Timeout header.
+    Falls back to LLM_TIMEOUT and is capped at LLM_MAX_TIMEOUT.
+    """
+    if not x_request_timeout or x_request_timeout <= 0:
+        return LLM_TIMEOUT
+    return min(x_request_timeout, LLM_MAX_TIMEOUT)
+
+
+async def call_llm(request: Request, prompt: str, model: str = None, timeout: float = None,
+                   endpoint: str = "generate", priority: str = "interactive", abort_on_disconnect: bool = True):
+    """
+    Run the LLM call off the event loop, abort it if the client disconnects (unless
+    `abort_on_disconnect` is False) and turn a missed deadline into HTTP 504.
+    """
+    model = model or MODEL
+
+    def call(cancel):
+        return get_response_with_stats(prompt, model, timeout=timeout, cancel=cancel, priority=priority)
+
+    try:
+        if not abort_on_disconnect:
+            return await asyncio.to_thread(call, None)
+        return await cancel_on_disconnect(call, request.is_disconnected, model, endpoint)
+    except requests.exceptions.Timeout:
+        raise HTTPException(status_code=504, detail="LLM did not respond within the request deadline")
+
+
+async def save_exchange(username: str, prompt: str, reply: str, model: str = None, stats: dict = None,
+                        route: dict = None, expires_at=None, conversation_id: str = None):
+    """
+    Persist a user prompt and the assistant reply in one write; partial replies are flagged as aborted.
+    Nothing is kept if the thread was deleted while the reply was generated.
+    """
+    aborted = bool(stats and stats.get("aborted"))
+    await save_to_conversation(username, conversation_id, lambda: save_turn(
+        username, prompt, reply, model, stats=stats, aborted=aborted, route=route, expires_at=expires_at,
+        conversation_id=conversation_id,
+    ))
+
+
+async def require_conversation(username: str, conversation_id: str | None):
+    """404 unless `conversation_id` is None or one of the user's threads"""
+    if conversation_id and not await get_conversation(username, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+
+_background_writes = set()
+
+
+def save_in_background(coro):
+    """
+    Schedule work that must outlive the current request, e.g. a history write from the finally
+    block of a cancelled streaming response, where awaiting is no longer possible.
+    """
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+    return task
+
+
+async def run_idempotent(scope: str, key: str, request_fingerprint: str, call):
+    """
+    Run `call()` (a coroutine returning (body, cacheable)) once per Idempotency-Key.
+    Retries with the same key wait for the first request and get its body; aborted or failed
+    requests release the key so the next retry runs normally. Retries usually follow a client
+    that hung up, so with a key the owner runs shielded from its request being cancelled and
+    callers should not abort the LLM call on disconnect either.
+    """
+    if not key:
+        body, _ = await call()
+        return body
+
+    while True:
+        try:
+            future, owner = idempotency_store.claim(scope, key, request_fingerprint)
+        except IdempotencyConflict:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if owner:
+            break
+        body = await asyncio.wrap_future(future)
+        if body is not None:
+            return body
+        # the first request gave up before finishing; run this one instead
+
+    async def finish():
+        try:
+            body, cacheable = await call()
+        except BaseException as e:
+            idempotency_store.release(scope, key, e if isinstance(e, HTTPException) else None)
+            raise
+        if cacheable:
+            idempotency_store.complete(scope, key, body)
+        else:
+            idempotency_store.release(scope, key)
+        return body
+
+    return await asyncio.shield(save_in_background(finish()))
+
+
+def choose_model(requested: str, text: str, user: dict):
+    """Resolve `model: "auto"` through the router; explicit models pass through unchanged"""
+    if requested == AUTO_MODEL:
+        return route_model(text, user)
+    return requested or MODEL, None
+
+
 @app.get("/secure-endpoint")
 def secure_data(user: dict = Depends(get_current_user)):
     return {"message": f"Hello, {user['preferred_username']}"}
@@ -106,14 +301,17 @@ def summarize_text(text: str, max_len: int = 1000):
 class Prompt(BaseModel):
     text: str
     model:str
+    stream: bool = False
 
 @app.post("/upload-file")
-async def upload_file(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+async def upload_file(file: UploadFile = File(...), user: dict = Depends(get_current_user),
+                      conversation_id: str | None = Form(None)):
     """
     Extract full text from PDF, summarize, and store to MongoDB
-    as part of the user’s chat history (role='system').
+    as part of the user’s chat history (role='system'), optionally in one thread.
     """
     username = get_authenticated_username(user)
+    await require_conversation(username, conversation_id)
 
     # 1️⃣ Extract text
     content = await file.read()
@@ -122,15 +320,17 @@ async def upload_file(file: UploadFile = File(...), user: dict = Depends(get_cur
     if not pdf_text:
         return {"status": "error", "message": "❌ No readable text found in PDF."}
 
-    # 2️⃣ Save extracted text as context
+    # 2️⃣ Extracted text is saved as context
     pdf_content_entry = f"[PDF Uploaded: {file.filename}]\n\n{pdf_text[:3000]}"
-    save_user_message(username, "system", pdf_content_entry)
 
     # 3️⃣ Summarize
     summary = summarize_text(pdf_text)
 
-    # 4️⃣ Optional: append summary to DB too
-    save_user_message(username, "assistant", f"📄 Summary of {file.filename}:\n{summary}")
+    # 4️⃣ Save context and summary to DB in one write
+    await save_to_conversation(username, conversation_id, lambda: save_turn(
+        username, pdf_content_entry, f"📄 Summary of {file.filename}:\n{summary}", prompt_role="system",
+        expires_at=message_expiry(user), conversation_id=conversation_id,
+    ))
 
     # 5️⃣ Return success
     return {
@@ -140,18 +340,155 @@ async def upload_file(file: UploadFile = File(...), user: dict = Depends(get_cur
     }
 
 
+async def stream_generation(username: str, text: str, model: str, timeout: float, priority: str,
+                            route: dict = None, expires_at=None):
+    """
+    Relay tokens as NDJSON lines. If the client disconnects, Starlette cancels this
+    generator and the upstream connection is closed so Ollama stops generating; the
+    partial reply is saved flagged as aborted. A missed deadline or an upstream failure
+    ends the stream with an {"error"} line and, like a failed non-streaming call, is not saved.
+    """
+    generation = open_generation(text, model, timeout, priority)
+    finished = failed = False
+    try:
+        async for piece in iterate_in_threadpool(iter(generation)):
+            yield json.dumps({"response": piece}) + "\n"
+        finished = True
+        yield json.dumps({"done": True, "model": model}) + "\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        if not finished:  # the client went away
+            generation.abort()
+            LLM_CANCELLED.inc(model=model or "default", endpoint="generate")
+        raise
+    except requests.exceptions.Timeout:
+        failed = True
+        LLM_TIMEOUTS.inc(model=model or "default")
+        yield json.dumps({"error": "timeout", "model": model}) + "\n"
+    except Exception as e:
+        failed = True
+        print(f"⚠️ Streaming generation failed: {e}")
+        yield json.dumps({"error": str(e), "model": model}) + "\n"
+    finally:
+        if not failed:
+            stats = generation.stats()
+            observe_llm_call(model, stats)
+            # Can't await inside a cancelled response, so write from a separate task
+            save_in_background(save_exchange(username, text, generation.text, model, stats, route, expires_at))
+
+
 @app.post("/generate")
-async def generate_text(prompt: Prompt, user: dict = Depends(get_current_user)):
+async def generate_text(request: Request, prompt: Prompt, user: dict = Depends(get_current_user),
+                        timeout: float = Depends(get_request_timeout),
+                        idempotency_key: str | None = Header(None)):
     username = get_authenticated_username(user)
+    priority = resolve_priority(user, "interactive")
+    model, route = choose_model(prompt.model, prompt.text, user)
+
+    if prompt.stream:
+        if idempotency_key:
+            # A relayed stream can't be replayed to a retry
+            raise HTTPException(status_code=400, detail="Idempotency-Key is not supported with stream: true")
+        return StreamingResponse(
+            stream_generation(username, prompt.text, model, timeout, priority, route, message_expiry(user)),
+            media_type="application/x-ndjson",
+        )
+
+    async def run():
+        # Call LLM kernel (aborted if the client goes away)
+        result, stats = await call_llm(request, prompt.text, model, timeout, priority=priority,
+                                       abort_on_disconnect=not idempotency_key)
 
-    # Call LLM kernel
-    result = get_response(prompt.text, prompt.model)
+        # Save user and assistant messages
+        await save_exchange(username, prompt.text, result, model, stats, route, message_expiry(user))
 
-    # Save user and assistant messages
-    save_user_message(username, "user", prompt.text)
-    save_user_message(username, "assistant", result, prompt.model)
+        return {"response": result, "model": model}, not stats.get("aborted")
 
-    return {"response": result}
+    # Retries carrying the same Idempotency-Key reuse the first result
+    return await run_idempotent(
+        f"generate:{username}", idempotency_key, fingerprint(prompt.text, prompt.model), run
+    )
+
+
+# -------------------------------
+# Batch Endpoint
+# -------------------------------
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="llm-batch")
+
+
+class BatchItem(BaseModel):
+    text: str
+    model: str
+
+
+class BatchPrompt(BaseModel):
+    items: list[BatchItem]
+
+    @field_validator("items")
+    def validate_items(cls, v):
+        if not v:
+            raise ValueError("At least one prompt is required.")
+        if len(v) > BATCH_MAX_ITEMS:
+            raise ValueError(f"At most {BATCH_MAX_ITEMS} prompts per batch.")
+        return v
+
+
+async def stream_batch(username: str, user: dict, items: list, timeout: float):
+    """
+    Fan the prompts out under the scheduler's per-model limits (batch priority) and yield one
+    NDJSON line per prompt in completion order. Completed turns are saved with a single
+    insert_many at the end; a client disconnect cancels the prompts still running or queued.
+    """
+    loop = asyncio.get_running_loop()
+    cancel = CancelToken()
+    priority = resolve_priority(user, "batch")
+
+    async def run(index, item):
+        model, route = choose_model(item.model, item.text, user)
+        try:
+            text, stats = await loop.run_in_executor(
+                _batch_executor,
+                lambda: get_response_with_stats(item.text, model, timeout=timeout, cancel=cancel, priority=priority),
+            )
+            return index, item, model, route, text, stats, None
+        except Exception as e:
+            return index, item, model, route, None, None, e
+
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    finished = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, item, model, route, text, stats, error = await next_done
+            if error is not None:
+                reason = "timeout" if isinstance(error, requests.exceptions.Timeout) else str(error)
+                yield json.dumps({"index": index, "model": model, "error": reason}) + "\n"
+                continue
+            finished.append((item, model, route, text, stats))
+            yield json.dumps({"index": index, "model": model, "response": text}) + "\n"
+    finally:
+        if len(finished) < len(tasks):
+            cancel.cancel()
+        messages = []
+        for item, model, route, text, stats in finished:
+            messages.append({"role": "user", "content": item.text})
+            messages.append({
+                "role": "assistant", "content": text, "model": model, "stats": stats,
+                "aborted": bool(stats.get("aborted")), "route": route,
+            })
+        # Can't await inside a cancelled response, so write from a separate task
+        save_in_background(save_user_messages(username, messages, expires_at=message_expiry(user)))
+
+
+@app.post("/generate/batch")
+async def generate_batch(batch: BatchPrompt, user: dict = Depends(get_current_user),
+                         timeout: float = Depends(get_request_timeout)):
+    """
+    Run many prompts in one authenticated request. Streams NDJSON lines
+    {"index", "model", "response"} (or "error") as each prompt finishes.
+    """
+    username = get_authenticated_username(user)
+    return StreamingResponse(
+        stream_batch(username, user, batch.items, timeout), media_type="application/x-ndjson"
+    )
 
 
 # -------------------------------
@@ -313,6 +650,12 @@ def resend_verification(username: str = Body(..., embed=True)):
     return {"message": f"📧 Verification email resent successfully to {email}!"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus scrape endpoint (per-model LLM timing histograms)
+    return render_metrics()
+
+
 @app.get("/")
 def root():
     return {"message": "Ollama LLM API with Keycloak Auth is running!"}
@@ -349,47 +692,208 @@ from pydantic import BaseModel
 
 class ChatRequest(BaseModel):
     prompt: str
+    model: str | None = None  # None = server default, "auto" = routed by prompt size
+    conversation_id: str | None = None  # None = the unscoped stream
 
 @app.post("/chat")
-def chat(data: ChatRequest, user: dict = Depends(get_current_user)):
+async def chat(request: Request, data: ChatRequest, background_tasks: BackgroundTasks,
+               user: dict = Depends(get_current_user), timeout: float = Depends(get_request_timeout),
+               idempotency_key: str | None = Header(None)):
     username = get_authenticated_username(user)
+
+    # 🔁 Retries carrying the same Idempotency-Key reuse the first reply
+    return await run_idempotent(
+        f"chat:{username}", idempotency_key, fingerprint(data.prompt, data.model, data.conversation_id),
+        lambda: chat_turn(request, data, background_tasks, user, username, timeout, bool(idempotency_key)),
+    )
+
+
+async def chat_turn(request: Request, data: ChatRequest, background_tasks: BackgroundTasks, user: dict,
+                    username: str, timeout: float, keyed: bool = False):
     prompt = data.prompt
+    thread = data.conversation_id
+    await require_conversation(username, thread)
 
-    # 🧠 Load chat history from MongoDB
-    history = get_user_history(username)
+    # 🧠 Load the summary of older turns, then only the recent turns after it
+    # (a thread's context is just its own recent turns)
+    summary = None if thread else await run_in_threadpool(get_conversation_summary, username)
+    history = await get_recent_history(username, HISTORY_RECENT_TURNS, summary["watermark"] if summary else None,
+                                       conversation_id=thread)
 
-    # 🧩 Build context for the model
-    conversation = "\n".join(
-        [f"{msg['role']}: {msg['content']}" for msg in history[-10:]]
-    )
+    # 🧩 Build context for the model: summary + recent turns only
+    conversation = build_chat_context(history, summary)
     full_prompt = f"{conversation}\nUser: {prompt}"
 
     # 🦙 Call LLM to generate response
-    reply = get_response(full_prompt)
+    model, route = choose_model(data.model, full_prompt, user)
+    # (a keyed request finishes even if the client leaves, so its retry gets this reply)
+    reply, stats = await call_llm(
+        request, full_prompt, model, timeout, endpoint="chat", priority=resolve_priority(user, "interactive"),
+        abort_on_disconnect=not keyed,
+    )
 
     # 💾 Save user and assistant messages in MongoDB
-    save_user_message(username, "user", prompt)
-    save_user_message(username, "assistant", reply)
+    await save_exchange(username, prompt, reply, model, stats, route, message_expiry(user), thread)
+
+    # 🗜️ Fold older turns into the summary once the history grows too long
+    if not thread:
+        background_tasks.add_task(compact_history, username)
+
+    return {"response": reply}, not stats.get("aborted")
+
 
-    return {"response": reply}
+def history_etag(version: tuple, *shape) -> str:
+    """Strong ETag from the history version (latest id, count) and the parameters that select the page"""
+    latest, count = version
+    digest = hashlib.sha1(json.dumps(shape).encode()).hexdigest()[:8]
+    return f'"{latest}-{count}-{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
 
 
 @app.get("/history")
-def get_history(user: dict = Depends(get_current_user)):
-    # Fetch chat history for the logged-in user
+async def get_history(response: Response, user: dict = Depends(get_current_user),
+                limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+                before: str | None = Query(None), after: str | None = Query(None),
+                since: str | None = Query(None), conversation_id: str | None = Query(None),
+                if_none_match: str | None = Header(None)):
+    """
+    One page of chat history for the logged-in user (or one of their threads), newest first.
+    The ETag changes whenever a message is added or removed; send it back as If-None-Match
+    to get 304 while nothing changed. `since=<sync_cursor>` returns only newer messages
+    (like `after`), so a client can keep a local copy and fetch deltas; X-History-Count lets
+    it notice removals, which a delta cannot show.
+    """
     username = get_authenticated_username(user)
-    messages = get_user_history(username)
-    return {"messages": messages}
+    if sum(1 for cursor in (before, after, since) if cursor) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of 'before', 'after' or 'since'")
+    await require_conversation(username, conversation_id)
+
+    # 🏷️ Version first: a message saved meanwhile makes the tag stale, never the page
+    # (`after`/`since` are not part of the tag, so a delta request validates against the last sync)
+    version = await history_version(username, conversation_id)
+    etag = history_etag(version, conversation_id, limit, before)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-History-Count": str(version[1])}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        page = await get_history_page(username, limit, before=before, after=after or since,
+                                      conversation_id=conversation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers.update(headers)
+    return page
+
+
+@app.get("/history/search")
+async def search_user_history(user: dict = Depends(get_current_user), q: str = Query(..., min_length=1, max_length=500),
+                              limit: int = Query(20, ge=1, le=HISTORY_PAGE_MAX),
+                              conversation_id: str | None = Query(None)):
+    """
+    Messages containing the words of `q`, best match first. Only messages indexed since the
+    blind index was enabled are found (see SEARCH_INDEX_ENABLED).
+    """
+    username = get_authenticated_username(user)
+    await require_conversation(username, conversation_id)
+    return {"results": await search_history(username, q, limit, conversation_id)}
+
+
+async def stream_export(username: str, since: datetime = None, compress: bool = False):
+    gzip = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip container
+    async for docs in iter_history_batches(username, since, HISTORY_EXPORT_BATCH_SIZE):
+        chunk = await run_in_threadpool(export_lines, docs)  # decrypt off the event loop
+        if gzip:
+            chunk = gzip.compress(chunk)
+        if chunk:
+            yield chunk
+    if gzip:
+        yield gzip.flush()
+
+
+@app.get("/history/export")
+async def export_history(user: dict = Depends(get_current_user), since: datetime | None = Query(None),
+                         gzip: bool = Query(False)):
+    """
+    Stream the full history as NDJSON, oldest first, optionally gzip-compressed.
+    To resume, pass the `timestamp` of the last line received as `since`; messages at exactly
+    that timestamp are sent again, so drop lines whose `id` was already seen.
+    """
+    username = get_authenticated_username(user)
+    if since and since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)  # stored timestamps are naive UTC
+    safe_name = re.sub(r"[^\w.-]", "_", username)
+    filename = f"history-{safe_name}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_export(username, since, gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @app.delete("/history")
-def clear_user_history(user: dict = Depends(get_current_user)):
-    # ✅ Clear chat history for the logged-in user
+async def clear_user_history(user: dict = Depends(get_current_user)):
+    # ✅ Clear chat history for the logged-in user: hidden now, deleted in chunks in the background
     username = get_authenticated_username(user)
-    clear_history(username)
+    cutoff = await clear_history(username)
+    save_in_background(purge_history(username, cutoff))
     return {"message": "Chat history cleared successfully."}
 
 
+# -------------------------------
+# Conversation threads
+# -------------------------------
+class ConversationData(BaseModel):
+    title: str | None = None
+
+
+@app.post("/conversations")
+async def new_conversation(data: ConversationData = Body(ConversationData()), user: dict = Depends(get_current_user)):
+    username = get_authenticated_username(user)
+    return await create_conversation(username, data.title)
+
+
+@app.get("/conversations")
+async def get_conversations(user: dict = Depends(get_current_user)):
+    # Most recently active first
+    username = get_authenticated_username(user)
+    return {"conversations": await list_conversations(username)}
+
+
+@app.get("/conversations/{conversation_id}")
+async def get_conversation_info(conversation_id: str, user: dict = Depends(get_current_user)):
+    username = get_authenticated_username(user)
+    doc = await get_conversation(username, conversation_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation_out(doc)
+
+
+@app.patch("/conversations/{conversation_id}")
+async def rename_conversation_title(conversation_id: str, data: ConversationData,
+                                    user: dict = Depends(get_current_user)):
+    username = get_authenticated_username(user)
+    doc = await rename_conversation(username, conversation_id, data.title or "")
+    if not doc:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation_out(doc)
+
+
+@app.delete("/conversations/{conversation_id}")
+async def remove_conversation(conversation_id: str, user: dict = Depends(get_current_user)):
+    # ✅ The thread goes at once; its messages are deleted in chunks in the background
+    username = get_authenticated_username(user)
+    if not await delete_conversation(username, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    save_in_background(purge_conversation(username, conversation_id))
+    return {"message": "Conversation deleted successfully."}
+
+
 gradio_app = gr.Interface(fn=greet, inputs="text", outputs="text")
 app = gr.mount_gradio_app(app, gradio_app, path="/")
 
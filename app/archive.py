@@ -0,0 +1,230 @@
+# archive.py
+"""
+Hot/cold tiering of chat history.
+
+The archiver moves a user's oldest messages (older than HISTORY_ARCHIVE_AFTER_DAYS) out of
+`chat_history`, HISTORY_SEGMENT_SIZE at a time, into one segment document per batch:
+
+    {"username", "first_ts", "last_ts", "count", "conversation_ids", "meta", "codec", "payload", "expires_at"?}
+
+`payload` is the batch as JSON, compressed as a whole and encrypted with the message cipher.
+`meta` holds each record's [conversation_id, expires_at] in the clear, so live counts per
+thread (see segment_count) need no decryption.
+Archiving always takes the oldest hot messages, so every cold message is older than every
+hot one. Readers merge the two tiers: see async_chat_history (get_recent_history,
+get_history_page, iter_history_batches).
+
+    python -m app.archive --days 30        # one archiving pass
+"""
+import json
+from datetime import datetime, timedelta
+from bson import ObjectId
+from .db import chats, segments
+from .cipher import message_cipher
+from .content_codec import CODECS, resolve_codec
+from .settings import HISTORY_ARCHIVE_AFTER_DAYS, HISTORY_SEGMENT_SIZE
+
+SEGMENT_CODEC = resolve_codec("auto")
+# stats (LLM timings) and route (router decision) are kept for capacity planning, as in hot documents
+_MESSAGE_FIELDS = ("role", "content", "model", "aborted", "conversation_id", "stats", "route")
+
+
+def record_key(record: dict) -> tuple:
+    return record["timestamp"], record["_id"]
+
+
+def pack_segment(username: str, records: list, codec: str = SEGMENT_CODEC) -> dict:
+    """Segment document for cold records (oldest first; see segment_records for their shape)"""
+    rows = []
+    for record in records:
+        row = {"id": str(record["_id"]), "timestamp": record["timestamp"].isoformat()}
+        row.update({field: record[field] for field in _MESSAGE_FIELDS if record.get(field)})
+        if record.get("expires_at"):
+            row["expires_at"] = record["expires_at"].isoformat()
+        rows.append(row)
+    payload = CODECS[codec][0](json.dumps(rows).encode())
+    segment = {
+        "username": username,
+        "first_ts": records[0]["timestamp"],
+        "last_ts": records[-1]["timestamp"],
+        "count": len(records),
+        "conversation_ids": sorted({r["conversation_id"] for r in records if r.get("conversation_id")}),
+        "meta": [[r.get("conversation_id"), r.get("expires_at")] for r in records],
+        "codec": codec,
+        "payload": message_cipher.encrypt_bytes(payload),
+    }
+    expiries = [r.get("expires_at") for r in records]
+    if all(expiries):
+        segment["expires_at"] = max(expiries)  # the TTL index drops the segment with its last message
+    return segment
+
+
+def build_segment(username: str, docs: list, messages: list) -> dict:
+    """Segment for hot documents (oldest first) and their decrypted messages"""
+    records = []
+    for doc, message in zip(docs, messages):
+        record = {field: doc.get(field) for field in _MESSAGE_FIELDS + ("_id", "timestamp", "expires_at")}
+        record.update(role=message["role"], content=message["content"])
+        records.append(record)
+    return pack_segment(username, records)
+
+
+def segment_records(segment: dict, now: datetime = None) -> list:
+    """
+    Decrypted records of a segment, oldest first: dicts shaped like message documents but with
+    plaintext `content` and `archived: True`. Records past their `expires_at` are left out.
+    """
+    data = CODECS[segment["codec"]][1](message_cipher.decrypt_bytes(segment["payload"]))
+    now = now or datetime.utcnow()
+    records = []
+    for row in json.loads(data):
+        expires_at = datetime.fromisoformat(row["expires_at"]) if row.get("expires_at") else None
+        if expires_at and expires_at <= now:
+            continue
+        record = {field: row.get(field) for field in _MESSAGE_FIELDS}
+        record.update(_id=ObjectId(row["id"]), timestamp=datetime.fromisoformat(row["timestamp"]),
+                      expires_at=expires_at, archived=True)
+        records.append(record)
+    return records
+
+
+def segment_count(segment: dict, conversation_id: str = None, hidden: tuple = (), now: datetime = None) -> int:
+    """
+    Unexpired records of a segment in one thread, or in any thread but `hidden`. Segments
+    archived before `meta` existed need their full document and are decrypted instead.
+    """
+    now = now or datetime.utcnow()
+    if "meta" in segment:
+        rows = segment["meta"]
+    else:
+        rows = [[r.get("conversation_id"), r.get("expires_at")] for r in segment_records(segment, now)]
+    return sum(
+        1 for thread, expires_at in rows
+        if (not expires_at or expires_at > now)
+        and (thread == conversation_id if conversation_id else thread not in hidden)
+    )
+
+
+def segment_query(username: str, conversation_id: str = None, cutoff: datetime = None) -> dict:
+    query = {"username": username}
+    if conversation_id:
+        query["conversation_ids"] = conversation_id
+    if cutoff:
+        query["last_ts"] = {"$gt": cutoff}
+    return query
+
+
+def record_filter(conversation_id: str = None, cutoff: datetime = None, since: datetime = None,
+                  inclusive: bool = False, before: tuple = None, after: tuple = None,
+                  unthreaded: bool = False, hidden: tuple = ()):
+    """
+    Predicate applying the hot-query filters to cold records. `since` is exclusive unless
+    `inclusive`; `before`/`after` are (timestamp, _id) page cursor positions. `unthreaded`
+    keeps only records outside every thread; `hidden` lists deleted threads to leave out.
+    """
+    def keep(record: dict) -> bool:
+        if conversation_id and record.get("conversation_id") != conversation_id:
+            return False
+        if unthreaded and record.get("conversation_id"):
+            return False
+        if hidden and record.get("conversation_id") in hidden:
+            return False
+        if cutoff and record["timestamp"] <= cutoff:
+            return False
+        if since and (record["timestamp"] < since if inclusive else record["timestamp"] <= since):
+            return False
+        if before and record_key(record) >= before:
+            return False
+        if after and record_key(record) <= after:
+            return False
+        return True
+    return keep
+
+
+class RecordPicker:
+    """
+    Collects the first `limit` (0 = all) matching records in page order from segments visited
+    in that order: newest first, or oldest first with `oldest_first`. wants() is False once no
+    further segment can improve the result.
+    """
+
+    def __init__(self, limit: int, keep, oldest_first: bool = False):
+        self.limit = limit
+        self.keep = keep
+        self.oldest_first = oldest_first
+        self.records = []
+        self._now = datetime.utcnow()
+
+    def wants(self, segment: dict) -> bool:
+        if not self.limit or len(self.records) < self.limit:
+            return True
+        edge = self.records[-1]["timestamp"]
+        return segment["first_ts"] <= edge if self.oldest_first else segment["last_ts"] >= edge
+
+    def add(self, segment: dict):
+        self.records.extend(r for r in segment_records(segment, self._now) if self.keep(r))
+        self.records.sort(key=record_key, reverse=not self.oldest_first)
+        if self.limit:
+            del self.records[self.limit:]
+
+
+def merge_tiers(hot: list, cold: list, limit: int = 0, newest_first: bool = True) -> list:
+    """Hot documents and cold records in one (timestamp, _id) order; a message in both tiers counts once"""
+    seen = {doc["_id"] for doc in hot}
+    merged = hot + [record for record in cold if record["_id"] not in seen]
+    merged.sort(key=lambda d: (d.get("timestamp") or datetime.min, d["_id"]), reverse=newest_first)
+    return merged[:limit] if limit else merged
+
+
+def page_segments(username: str, before: tuple = None, after: tuple = None, cutoff: datetime = None,
+                  conversation_id: str = None, hidden: tuple = ()):
+    """(segment query, record predicate) for one history page; cursors as decoded (timestamp, _id)"""
+    query = segment_query(username, conversation_id, cutoff)
+    if before:
+        query["first_ts"] = {"$lte": before[0]}
+    if after:
+        query.setdefault("last_ts", {})["$gte"] = after[0]
+    return query, record_filter(conversation_id, cutoff, before=before, after=after, hidden=hidden)
+
+
+# -------------------------------
+# Archiver
+# -------------------------------
+def archive_user(username: str, older_than: datetime, segment_size: int = HISTORY_SEGMENT_SIZE) -> int:
+    """
+    Move the user's messages older than `older_than` into segments of exactly `segment_size`;
+    a smaller remainder stays hot until it fills a segment. Returns the number archived.
+    """
+    from .chat_history import decode_messages, purge_cutoff
+
+    if purge_cutoff(username):
+        return 0  # a clear is being purged; don't archive what it is about to delete
+    archived = 0
+    query = {"username": username, "timestamp": {"$lt": older_than}}
+    while True:
+        docs = list(chats.find(query).sort([("timestamp", 1), ("_id", 1)]).limit(segment_size))
+        if len(docs) < segment_size:
+            return archived
+        # Segment first: a crash in between leaves a message in both tiers, which readers de-duplicate
+        segments.insert_one(build_segment(username, docs, decode_messages(docs)))
+        chats.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        archived += len(docs)
+
+
+def archive_pass(days: float = HISTORY_ARCHIVE_AFTER_DAYS, segment_size: int = HISTORY_SEGMENT_SIZE) -> int:
+    """Archive every user's old messages. Returns the number of messages moved."""
+    if days <= 0:
+        return 0
+    older_than = datetime.utcnow() - timedelta(days=days)
+    users = chats.distinct("username", {"timestamp": {"$lt": older_than}})
+    return sum(archive_user(username, older_than, segment_size) for username in users)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move old chat messages into archive segments")
+    parser.add_argument("--days", type=float, default=HISTORY_ARCHIVE_AFTER_DAYS or 30)
+    parser.add_argument("--segment-size", type=int, default=HISTORY_SEGMENT_SIZE)
+    args = parser.parse_args()
+    print(f"✅ Archived {archive_pass(args.days, args.segment_size)} messages")
@@ -0,0 +1,313 @@
+# async_chat_history.py
+"""
+Chat history operations on the request path (save, tail, paginate, export, search, clear),
+backed by pymongo's AsyncMongoClient so `async def` routes never block the event loop on
+MongoDB. Documents, queries and decryption come from chat_history, which the background
+jobs (compaction, archiving) use directly.
+"""
+import asyncio
+from datetime import datetime
+from .db import async_chats, async_purges, async_search_terms, async_segments, async_summaries
+from .settings import (
+    HISTORY_EXPORT_BATCH_SIZE, HISTORY_PURGE_CHUNK, HISTORY_PURGE_PAUSE, SEARCH_CANDIDATES,
+)
+from .search import normalize_terms, blind_terms, candidate_query, rank_hits
+from .archive import (
+    RecordPicker, segment_records, segment_count, segment_query, record_filter, merge_tiers, pack_segment,
+)
+from .history_cache import history_cache
+from .chat_history import (
+    build_message_doc,
+    buffer_docs,
+    buffer_entries,
+    has_buffered,
+    cache_written,
+    search_entries,
+    decode_messages,
+    hide_purged,
+    count_query,
+    history_key,
+    read_your_writes,
+    turn_messages,
+    recent_query,
+    recent_result,
+    RECENT_PROJECTION,
+    page_query,
+    page_result,
+    cold_tail_plan,
+    cold_page_plan,
+    needs_cold,
+    export_query,
+    purge_query,
+    new_cutoff,
+    clear_marker,
+    thread_marker,
+    hide_threads,
+)
+
+OFFLOAD_DECODE_AT = 500  # pages longer than this are decrypted in a worker thread, off the event loop
+
+
+async def _read_your_writes(username: str):
+    if has_buffered(username):
+        await asyncio.to_thread(read_your_writes, username)
+
+
+async def purge_cutoff(username: str):
+    doc = await async_purges.find_one(clear_marker(username))
+    return doc["before"] if doc else None
+
+
+async def hidden_threads(username: str) -> list:
+    """Deleted threads whose messages are still being purged; all-thread reads leave them out"""
+    return [doc["conversation_id"] async for doc in async_purges.find(thread_marker(username))]
+
+
+async def hide_thread(username: str, conversation_id: str):
+    """Hide a deleted thread's messages at once (one small write); purge_conversation removes the marker"""
+    await async_purges.update_one(thread_marker(username, conversation_id),
+                                  {"$set": {"hidden_at": datetime.utcnow()}}, upsert=True)
+
+
+async def unhide_thread(username: str, conversation_id: str):
+    await async_purges.delete_many(thread_marker(username, conversation_id))
+
+
+async def read_cold(query: dict, keep, limit: int = 0, oldest_first: bool = False) -> list:
+    """Cold records matching `keep` from the segments matching `query`, in page order"""
+    picker = RecordPicker(limit, keep, oldest_first)
+    async for segment in async_segments.find(query).sort("last_ts", 1 if oldest_first else -1).batch_size(4):
+        if not picker.wants(segment):
+            break
+        picker.add(segment)
+    return picker.records
+
+
+async def save_user_messages(username: str, messages: list, expires_at: datetime = None,
+                             conversation_id: str = None):
+    """Encrypt and store several messages with one ordered insert_many"""
+    if not messages:
+        return
+    docs = [build_message_doc(username, **message, expires_at=expires_at, conversation_id=conversation_id)
+            for message in messages]
+    entries = search_entries(docs, messages)
+    if not buffer_docs(docs):
+        await async_chats.insert_many(docs, ordered=True)
+    if entries and not buffer_entries(entries):
+        await async_search_terms.insert_many(entries, ordered=False)
+    cache_written(username, docs, messages, conversation_id)
+
+
+async def save_turn(username: str, prompt: str, reply: str, model: str = None, stats: dict = None,
+                    aborted: bool = False, route: dict = None, prompt_role: str = "user",
+                    expires_at: datetime = None, conversation_id: str = None):
+    """Store one exchange (prompt, then reply) in a single round trip"""
+    messages = turn_messages(prompt, reply, model, stats, aborted, route, prompt_role)
+    await save_user_messages(username, messages, expires_at, conversation_id)
+
+
+async def get_recent_history(username: str, limit: int, since=None, conversation_id: str = None) -> list:
+    """
+    The last `limit` messages of the unscoped stream or one thread (optionally only those
+    newer than `since`), oldest first. Served from the hot-history cache when possible; otherwise sorts descending
+    with a limit and projection so only these documents are read and decrypted.
+    """
+    cached = history_cache.get(history_key(username, conversation_id), limit, since)
+    if cached is not None:
+        return cached
+    token = history_cache.read_token()
+    cutoff = await purge_cutoff(username)
+    query = recent_query(username, since, cutoff, conversation_id)
+    cursor = async_chats.find(query, RECENT_PROJECTION)
+    docs = await cursor.sort([("timestamp", -1), ("_id", -1)]).limit(limit).to_list(None)
+    if len(docs) < limit:  # the rest of the tail may be archived
+        cold = await read_cold(*cold_tail_plan(username, since, cutoff, conversation_id), limit)
+        if cold:
+            docs = merge_tiers(docs, cold, limit)
+    return recent_result(docs, username, limit, since, token, conversation_id)
+
+
+async def get_history_page(username: str, limit: int = 50, before: str = None, after: str = None,
+                           conversation_id: str = None) -> dict:
+    """
+    One page of messages, newest first, ordered by (timestamp, _id).
+    `before` pages towards older messages, `after` towards newer ones; `next_cursor`
+    continues in the same direction and is None once there is nothing left.
+    `conversation_id` limits the page to one thread.
+    """
+    cutoff = await purge_cutoff(username)
+    hidden = [] if conversation_id else await hidden_threads(username)
+    query, sort = page_query(username, before, after, cutoff, conversation_id, hidden)
+    await _read_your_writes(username)
+    docs = await async_chats.find(query).sort(sort).limit(limit + 1).to_list(None)
+    if needs_cold(docs, limit, after):
+        plan = cold_page_plan(username, before, after, cutoff, conversation_id, hidden)
+        cold = await read_cold(*plan, limit + 1, bool(after))
+        if cold:
+            docs = merge_tiers(docs, cold, limit + 1, newest_first=not after)
+    if len(docs) > OFFLOAD_DECODE_AT:
+        return await asyncio.to_thread(page_result, docs, limit, after, before)  # keep bulk decryption off the loop
+    return page_result(docs, limit, after, before)
+
+
+async def history_version(username: str, conversation_id: str = None) -> tuple:
+    """
+    (latest message id, message count) of the user's history or one thread: both change
+    whenever a message is added, removed or expires, so together they validate a client's copy.
+    Hot counts are COUNT_SCANs of the (username[, conversation_id], timestamp) indexes (checked
+    at startup, see indexes.check_count_plan); deleted threads still being purged are counted
+    one thread at a time and subtracted, so the filter never needs a document fetch. Archived
+    messages are counted from segment metadata (only the records of this thread, or of live
+    threads, that have not expired), without decryption.
+    """
+    cutoff = await purge_cutoff(username)
+    hidden = [] if conversation_id else await hidden_threads(username)
+    await _read_your_writes(username)
+    query = count_query(username, conversation_id, cutoff)
+    newest = hide_threads(dict(query), hidden)
+    latest = await async_chats.find(newest, {"_id": 1}).sort([("timestamp", -1), ("_id", -1)]).limit(1).to_list(None)
+    count = await async_chats.count_documents(query)
+    for thread in hidden:
+        count -= await async_chats.count_documents({**query, "conversation_id": thread})
+    projection = {"meta": 1, "last_ts": 1}
+    cold = await async_segments.find(segment_query(username, conversation_id, cutoff), projection).to_list(None)
+    now = datetime.utcnow()
+    for segment in cold:
+        if "meta" not in segment:  # archived before segments carried metadata
+            segment = await async_segments.find_one({"_id": segment["_id"]})
+        count += segment_count(segment, conversation_id, tuple(hidden), now)
+    if latest:
+        return str(latest[0]["_id"]), count
+    if cold:
+        return str(max(cold, key=lambda segment: segment["last_ts"])["_id"]), count
+    return "0", count
+
+
+async def iter_history_batches(username: str, since=None, batch_size: int = HISTORY_EXPORT_BATCH_SIZE):
+    """
+    All of a user's messages oldest first, as lists of up to `batch_size` raw documents
+    (archived records first, one segment at a time, then one cursor over hot documents),
+    so callers can stream a history of any size in constant memory.
+    """
+    await _read_your_writes(username)
+    cutoff = await purge_cutoff(username)
+    hidden = await hidden_threads(username)
+    batch = []
+    cold_query = segment_query(username, cutoff=cutoff)
+    if since:
+        cold_query.setdefault("last_ts", {})["$gte"] = since
+    keep = record_filter(cutoff=cutoff, since=since, inclusive=True, hidden=tuple(hidden))
+    async for segment in async_segments.find(cold_query).sort("last_ts", 1).batch_size(1):
+        for record in await asyncio.to_thread(segment_records, segment):
+            if keep(record):
+                batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    cursor = async_chats.find(export_query(username, since, cutoff, hidden)).sort([("timestamp", 1), ("_id", 1)])
+    async for doc in cursor.batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def search_history(username: str, text: str, limit: int = 20, conversation_id: str = None) -> list:
+    """
+    Messages matching the words of `text`, best first, each with a `score` (share of the words
+    it contains). Candidates come from the blind index; only the returned messages are decrypted.
+    """
+    digests = blind_terms(username, normalize_terms(text))
+    if not digests:
+        return []
+    await _read_your_writes(username)
+    query = hide_purged(candidate_query(username, digests, conversation_id), await purge_cutoff(username))
+    if not conversation_id:
+        query = hide_threads(query, await hidden_threads(username))
+    cursor = async_search_terms.find(query, {"terms": 1, "timestamp": 1})
+    hits = await cursor.sort("timestamp", -1).limit(SEARCH_CANDIDATES).to_list(None)
+    ranked = rank_hits(hits, digests, limit)
+    if not ranked:
+        return []
+    docs = await async_chats.find({"_id": {"$in": [_id for _id, _ in ranked]}, "username": username}).to_list(None)
+    by_id = {doc["_id"]: doc for doc in docs}
+    archived = {_id for _id, _ in ranked if _id not in by_id}
+    if archived:
+        stamps = [hit["timestamp"] for hit in hits if hit["_id"] in archived]
+        query = {"username": username, "first_ts": {"$lte": max(stamps)}, "last_ts": {"$gte": min(stamps)}}
+        by_id.update((r["_id"], r) for r in await read_cold(query, lambda r: r["_id"] in archived, oldest_first=True))
+    found = [(by_id[_id], score) for _id, score in ranked if _id in by_id]  # skips messages deleted since
+    messages = decode_messages([doc for doc, _ in found])
+    return [
+        {"id": str(doc["_id"]), **message, "score": round(score, 3)}
+        for (doc, score), message in zip(found, messages)
+    ]
+
+
+async def clear_history(username: str) -> datetime:
+    """
+    Hide all of the user's messages at once and return the cutoff; the caller deletes them
+    with purge_history in the background.
+    """
+    await _read_your_writes(username)
+    cutoff = new_cutoff()
+    await async_purges.update_one(clear_marker(username), {"$set": {"before": cutoff}}, upsert=True)
+    await async_summaries.delete_many({"_id": username})
+    history_cache.invalidate(username)
+    return cutoff
+
+
+async def purge_history(username: str, cutoff: datetime, chunk_size: int = HISTORY_PURGE_CHUNK,
+                        pause: float = HISTORY_PURGE_PAUSE) -> int:
+    """Delete hidden messages `chunk_size` at a time, then drop the marker. Returns the count deleted."""
+    deleted = await delete_in_chunks(purge_query(username, cutoff), chunk_size, pause)
+    await async_segments.delete_many({"username": username, "last_ts": {"$lte": cutoff}})
+    await async_search_terms.delete_many({"username": username, "timestamp": {"$lte": cutoff}})  # incl. archived
+    await async_purges.delete_many({"username": username, "before": cutoff})
+    return deleted
+
+
+async def delete_in_chunks(query: dict, chunk_size: int = HISTORY_PURGE_CHUNK, pause: float = HISTORY_PURGE_PAUSE) -> int:
+    """Delete every message matching `query`, `chunk_size` at a time. Returns the count deleted."""
+    deleted = 0
+    while True:
+        docs = await async_chats.find(query, {"_id": 1}).limit(chunk_size).to_list(None)
+        if not docs:
+            break
+        ids = [doc["_id"] for doc in docs]
+        result = await async_chats.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+        await async_search_terms.delete_many({"_id": {"$in": ids}})
+        await asyncio.sleep(pause)
+    return deleted
+
+
+async def drop_archived(username: str, conversation_id: str) -> int:
+    """Remove a thread's messages from the user's archive segments. Returns the count removed."""
+    dropped = 0
+    for segment in await async_segments.find(segment_query(username, conversation_id)).to_list(None):
+        records = segment_records(segment)
+        kept = [r for r in records if r.get("conversation_id") != conversation_id]
+        removed = [r["_id"] for r in records if r.get("conversation_id") == conversation_id]
+        dropped += segment["count"] - len(kept)
+        if removed:
+            await async_search_terms.delete_many({"_id": {"$in": removed}})
+        if kept:
+            await async_segments.update_one({"_id": segment["_id"]}, {"$set": pack_segment(username, kept)})
+        else:
+            await async_segments.delete_many({"_id": segment["_id"]})
+    return dropped
+
+
+async def pending_purges() -> list:
+    """(username, cutoff) of purges left unfinished, e.g. by a restart"""
+    return [(doc["username"], doc["before"]) async for doc in async_purges.find({"before": {"$exists": True}})]
+
+
+async def pending_thread_purges() -> list:
+    """(username, conversation_id) of deleted threads whose purge was left unfinished"""
+    cursor = async_purges.find({"conversation_id": {"$exists": True}})
+    return [(doc["username"], doc["conversation_id"]) async for doc in cursor]
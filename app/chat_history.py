@@ -1,19 +1,36 @@
+import base64
+import json
 import pytz
-from datetime import datetime
-from .settings import TIMEZONE, DATE_TIME_FORMAT, fernet
-from .db import chats
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from .settings import (
+    TIMEZONE, DATE_TIME_FORMAT, LLM_STORE_STATS, WRITE_BEHIND_ENABLED, SEARCH_INDEX_ENABLED,
+)
+from .db import chats, purges, search_terms, summaries
+from .cipher import message_cipher
+from .content_codec import compress_content, decompress_content
+from .write_buffer import WriteBehindBuffer
+from .history_cache import history_cache
+from .search import term_docs
+from .archive import segment_query, record_filter, page_segments
 
 
-def encrypt_message(text: str) -> str:
-    """Encrypt message content before saving to MongoDB"""
-    return fernet.encrypt(text.encode()).decode()
+def encrypt_message(text: str):
+    """Encrypt message content before saving to MongoDB (AES-GCM bytes, or a Fernet token)"""
+    return message_cipher.encrypt(text)
 
 
-def decrypt_message(token: str) -> str:
-    """Decrypt message content when reading from MongoDB"""
+def decrypt_message(token, compression: str = None) -> str:
+    """Decrypt message content when reading from MongoDB (`compression` is the document's flag)"""
     try:
-        return fernet.decrypt(token.encode()).decode()
-    except Exception:
+        if compression:
+            return decompress_content(message_cipher.decrypt_bytes(token), compression)
+        return message_cipher.decrypt(token)
+    except Exception as e:
+        if compression or isinstance(token, (bytes, bytearray)):
+            print(f"⚠️ Could not decrypt stored message: {e!r}")
+            return ""
         # Handle backward compatibility with unencrypted records
         return token
 
@@ -38,42 +55,424 @@ def format_message(role, content, timestamp=None, model=None):
     return {"role": role, "content": formatted_content}
 
 
-def save_user_message(username: str, role: str, content: str, model: str = None):
-    """Encrypt and store chat message in MongoDB"""
-    encrypted_content = encrypt_message(content)
-    dict = {
+def build_message_doc(username: str, role: str, content: str, model: str = None, stats: dict = None,
+                      aborted: bool = False, route: dict = None, expires_at: datetime = None,
+                      conversation_id: str = None) -> dict:
+    """
+    Encrypted MongoDB document for one chat message (LLM timing stats only if LLM_STORE_STATS).
+    Long content is compressed first when MESSAGE_COMPRESSION is on, flagged by `compression`.
+    `aborted` marks partial assistant output from a generation cut short by the client;
+    `route` records why the model router picked `model` for a `model: "auto"` request.
+    `expires_at` (see retention.message_expiry) lets the TTL index delete the message.
+    `conversation_id` files the message under a thread (see conversations.py).
+    """
+    payload, codec = compress_content(content)
+    doc = {
         "username": username,
         "role": role,
-        "content": encrypted_content,
+        "content": message_cipher.encrypt_bytes(payload),
         "timestamp": datetime.utcnow(),
     }
+    if codec:
+        doc["compression"] = codec
     if model:
-        dict["model"] = model
-    chats.insert_one(dict)
+        doc["model"] = model
+    if stats and LLM_STORE_STATS:
+        doc["stats"] = stats
+    if aborted:
+        doc["aborted"] = True
+    if route:
+        doc["route"] = route
+    if expires_at:
+        doc["expires_at"] = expires_at
+    if conversation_id:
+        doc["conversation_id"] = conversation_id
+    return doc
 
 
-def get_user_history(username):
-    messages = chats.find({"username": username}).sort("timestamp", 1)
-    results = []
+def _insert_docs(docs: list):
+    chats.insert_many(docs, ordered=False)
 
-    for msg in messages:
-        content = msg.get("content") or msg.get("message", "")
-        # Try decrypting, but fall back to plaintext for legacy docs
+
+def _insert_entries(entries: list):
+    search_terms.insert_many(entries, ordered=False)
+
+
+# Optional write-behind: requests return once messages are queued (see WRITE_BEHIND_ENABLED).
+# Blind-index entries have a buffer of their own, so a turn waits for neither insert.
+write_buffer = WriteBehindBuffer(_insert_docs)
+search_buffer = WriteBehindBuffer(_insert_entries, name="search_terms")
+
+
+def buffer_docs(docs: list) -> bool:
+    """Hand documents to the write-behind buffer; False means the caller must write them itself"""
+    if not WRITE_BEHIND_ENABLED:
+        return False
+    for doc in docs:
+        doc.setdefault("_id", ObjectId())  # client-side ids keep retries idempotent and reads mergeable
+    return write_buffer.offer(docs)
+
+
+def buffer_entries(entries: list) -> bool:
+    """Hand blind-index entries to their write-behind buffer; False means the caller must write them"""
+    return WRITE_BEHIND_ENABLED and search_buffer.offer(entries)
+
+
+def has_buffered(username: str) -> bool:
+    return WRITE_BEHIND_ENABLED and bool(write_buffer.pending(username) or search_buffer.pending(username))
+
+
+def read_your_writes(username: str):
+    """Block until this user's buffered messages and index entries are stored, so full reads see them"""
+    if has_buffered(username):
+        write_buffer.flush(username)
+        search_buffer.flush(username)
+
+
+def history_key(username: str, conversation_id: str = None):
+    """Hot-history cache key: the user's unscoped stream, or one of their threads"""
+    return (username, conversation_id) if conversation_id else username
+
+
+def search_entries(docs: list, messages: list) -> list:
+    """
+    Blind-index entries for new messages (empty when SEARCH_INDEX_ENABLED is off). Message ids
+    are assigned here, client-side, so the entries can reference them before the insert.
+    """
+    if not SEARCH_INDEX_ENABLED:
+        return []
+    for doc in docs:
+        doc.setdefault("_id", ObjectId())
+    return term_docs(docs, messages)
+
+
+def cache_written(username: str, docs: list, messages: list, conversation_id: str = None):
+    """Write-through to the hot-history cache from the plaintext, so nothing is decrypted again"""
+    items = [
+        (doc["timestamp"], doc.get("_id"), _message_fields(doc, message["content"]))
+        for doc, message in zip(docs, messages)
+    ]
+    history_cache.append(history_key(username, conversation_id), items)
+
+
+def _message_out(msg: dict) -> dict:
+    if msg.get("archived"):
+        return _message_fields(msg, msg["content"])  # cold record, decrypted with its segment
+    # decrypt_message falls back to plaintext for legacy docs
+    content = decrypt_message(msg.get("content") or msg.get("message", ""), msg.get("compression"))
+    return _message_fields(msg, content)
+
+
+def _message_fields(msg: dict, content: str) -> dict:
+    timestamp = msg.get("timestamp") or datetime.utcnow()
+    out = {
+        "role": msg.get("role", "user"),
+        "content": content,
+        "model": msg.get("model"),
+        "timestamp": timestamp.isoformat(),
+    }
+    if msg.get("aborted"):
+        out["aborted"] = True
+    return out
+
+
+def decode_messages(docs: list) -> list:
+    """
+    _message_out for many documents, in order. When all of them are plain AES-GCM messages (the
+    usual page or export batch) the contents are decrypted in one AESGCMCipher.decrypt_many pass
+    instead of through decrypt_message per row; anything else, or a batch that fails to decrypt,
+    goes row by row. Compare with python -m app.cipher --bulk.
+    """
+    if docs and all(type(doc.get("content")) is bytes and not doc.get("compression") and not doc.get("archived")
+                    for doc in docs):
         try:
-            content = decrypt_message(content)
+            texts = message_cipher.aesgcm.decrypt_many([doc["content"] for doc in docs])
         except Exception:
-            pass  # legacy message, not encrypted
+            texts = None  # the row-by-row path reports the document that fails
+        if texts is not None:
+            return [_message_fields(doc, text) for doc, text in zip(docs, texts)]
+    return [_message_out(doc) for doc in docs]
+
+
+def turn_messages(prompt: str, reply: str, model: str = None, stats: dict = None, aborted: bool = False,
+                  route: dict = None, prompt_role: str = "user") -> list:
+    return [
+        {"role": prompt_role, "content": prompt},
+        {"role": "assistant", "content": reply, "model": model, "stats": stats, "aborted": aborted, "route": route},
+    ]
+
+
+RECENT_PROJECTION = {"role": 1, "content": 1, "message": 1, "model": 1, "timestamp": 1, "aborted": 1, "compression": 1}
+
+
+def scoped_query(username: str, conversation_id: str = None) -> dict:
+    """A user's messages: all of them, or only one thread (username_conversation_timestamp_id)"""
+    query = {"username": username}
+    if conversation_id:
+        query["conversation_id"] = conversation_id
+    return query
+
+
+def count_query(username: str, conversation_id: str = None, cutoff: datetime = None) -> dict:
+    """
+    Messages counted for a history version: equality on username (and thread) plus a timestamp
+    range, so MongoDB answers count_documents from the index alone (COUNT_SCAN)
+    """
+    return hide_purged(scoped_query(username, conversation_id), cutoff)
+
+
+def context_query(username: str, conversation_id: str = None) -> dict:
+    """
+    Messages a /chat turn builds on: one thread, or the unscoped stream (messages outside every
+    thread, conversation_id null on the same index). Only /history's "All messages" view mixes threads.
+    """
+    query = scoped_query(username, conversation_id)
+    query.setdefault("conversation_id", None)
+    return query
+
+
+def recent_query(username: str, since=None, cutoff=None, conversation_id: str = None) -> dict:
+    query = context_query(username, conversation_id)
+    if since:
+        query["timestamp"] = {"$gt": since}
+    return hide_purged(query, cutoff)
+
+
+def cold_tail_plan(username: str, since=None, cutoff=None, conversation_id: str = None):
+    """(segment query, record predicate) for archived messages a tail read may need"""
+    newer_than = max((t for t in (since, cutoff) if t), default=None)
+    keep = record_filter(conversation_id, cutoff, since, unthreaded=not conversation_id)
+    return segment_query(username, conversation_id, newer_than), keep
+
+
+def recent_result(docs: list, username: str = None, limit: int = 0, since=None, token: int = None,
+                  conversation_id: str = None) -> list:
+    """
+    Newest-first tail documents -> decrypted messages, oldest first. With write-behind on,
+    the user's still-buffered messages are merged in so a turn sees the previous one.
+    The result primes the hot-history cache (`token` from history_cache.read_token()).
+    """
+    if WRITE_BEHIND_ENABLED and username:
+        pending = [
+            d for d in write_buffer.pending(username)
+            if (not since or d["timestamp"] > since)
+            and d.get("conversation_id") == conversation_id
+        ]
+        if pending:
+            seen = {d["_id"] for d in docs}
+            docs = docs + [d for d in pending if d["_id"] not in seen]
+            docs.sort(key=lambda d: (d["timestamp"], d["_id"]), reverse=True)
+            docs = docs[:limit] if limit else docs
+    items = [(doc.get("timestamp"), doc.get("_id"), _message_out(doc)) for doc in reversed(docs)]
+    if username and all(timestamp for timestamp, _, _ in items):
+        history_cache.prime(history_key(username, conversation_id), items, limit, since, token)
+    return [message for _, _, message in items]
+
+
+# -------------------------------
+# Cursor pagination
+# -------------------------------
+def encode_cursor(timestamp: datetime, _id) -> str:
+    """Opaque page cursor for a message position (timestamp, _id)"""
+    raw = f"{timestamp.isoformat()}|{_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-        results.append({
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, _id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), ObjectId(_id)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def page_query(username: str, before: str = None, after: str = None, cutoff=None, conversation_id: str = None,
+               hidden: list = ()):
+    """(query, sort) for one history page; raises ValueError for malformed cursors"""
+    query = hide_threads(hide_purged(scoped_query(username, conversation_id), cutoff), hidden)
+    direction = -1
+    cursor = before or after
+    if cursor:
+        timestamp, _id = decode_cursor(cursor)
+        op = "$lt" if before else "$gt"
+        query["$or"] = [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: _id}},
+        ]
+        if after:
+            direction = 1
+    return query, [("timestamp", direction), ("_id", direction)]
+
+
+def cold_page_plan(username: str, before: str = None, after: str = None, cutoff=None, conversation_id: str = None,
+                   hidden: list = ()):
+    """(segment query, record predicate) for the archived part of a history page"""
+    return page_segments(
+        username, decode_cursor(before) if before else None, decode_cursor(after) if after else None,
+        cutoff, conversation_id, tuple(hidden),
+    )
+
+
+def needs_cold(docs: list, limit: int, after: str = None) -> bool:
+    """Archived messages are older than hot ones, so only a short page or an `after` page can reach them"""
+    return bool(after) or len(docs) <= limit
+
+
+def page_result(docs: list, limit: int, after: str = None, before: str = None) -> dict:
+    """
+    Turn up to limit + 1 fetched documents into {"messages", "next_cursor", "sync_cursor"}.
+    `sync_cursor` is the newest message seen so far (None on `before` pages): pass it as
+    `since` later to fetch only what is newer.
+    """
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(docs[-1]["timestamp"], docs[-1]["_id"]) if has_more else None
+    if after:
+        docs.reverse()  # always newest first
+
+    sync_cursor = None
+    if not before:
+        sync_cursor = encode_cursor(docs[0]["timestamp"], docs[0]["_id"]) if docs else after
+    messages = [{"id": str(doc["_id"]), **message} for doc, message in zip(docs, decode_messages(docs))]
+    return {"messages": messages, "next_cursor": next_cursor, "sync_cursor": sync_cursor}
+
+
+def export_query(username: str, since: datetime = None, cutoff: datetime = None, hidden: list = ()) -> dict:
+    """Messages for /history/export; `since` is inclusive so a resumed export never skips a tie"""
+    query = {"username": username}
+    if since:
+        query["timestamp"] = {"$gte": since}
+    return hide_threads(hide_purged(query, cutoff), hidden)
+
+
+def export_lines(docs: list) -> bytes:
+    """One NDJSON line per document: {"id", "role", "content", "model", "timestamp"}"""
+    return "".join(
+        json.dumps({"id": str(doc["_id"]), **message}) + "\n"
+        for doc, message in zip(docs, decode_messages(docs))
+    ).encode()
+
+
+# -------------------------------
+# Clearing (hide now, purge in chunks)
+# -------------------------------
+def hide_purged(query: dict, cutoff: datetime = None) -> dict:
+    """Restrict a history query to messages newer than a pending purge's cutoff"""
+    if cutoff:
+        condition = dict(query.get("timestamp") or {})
+        condition["$gt"] = max(condition["$gt"], cutoff) if "$gt" in condition else cutoff
+        query["timestamp"] = condition
+    return query
+
+
+def clear_marker(username: str) -> dict:
+    """The user's pending-clear document in `purges` (deleted threads have their own markers)"""
+    return {"username": username, "before": {"$exists": True}}
+
+
+def purge_cutoff(username: str):
+    """Timestamp up to which this user's messages are being purged, or None"""
+    doc = purges.find_one(clear_marker(username))
+    return doc["before"] if doc else None
+
+
+def thread_marker(username: str, conversation_id: str = None) -> dict:
+    """Markers of deleted threads whose messages are still being purged (one thread, or all)"""
+    return {"username": username, "conversation_id": conversation_id or {"$exists": True}}
+
+
+def hide_threads(query: dict, hidden: list) -> dict:
+    """Leave deleted threads out of a query over all of the user's threads"""
+    if hidden and "conversation_id" not in query:
+        query["conversation_id"] = {"$nin": list(hidden)}
+    return query
+
+
+def purge_query(username: str, cutoff: datetime) -> dict:
+    # Legacy documents without a timestamp are invisible once a cutoff applies, so purge them too
+    return {"username": username, "$or": [{"timestamp": {"$lte": cutoff}}, {"timestamp": None}]}
+
+
+def new_cutoff() -> datetime:
+    """Now, rounded up to the millisecond BSON dates keep, so it covers every message written so far"""
+    now = datetime.utcnow()
+    cutoff = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    return cutoff + timedelta(milliseconds=1) if cutoff < now else cutoff
+
+
+# -------------------------------
+# Compaction (rolling summary + watermark)
+# -------------------------------
+def _unsummarized_query(username: str, since=None):
+    query = context_query(username)  # threads are never summarised
+    if since:
+        query["timestamp"] = {"$gt": since}
+    return hide_purged(query, purge_cutoff(username))
+
+
+def count_unsummarized(username: str, since=None) -> int:
+    """Count regular messages newer than the summary watermark"""
+    return chats.count_documents(_unsummarized_query(username, since))
+
+
+def get_unsummarized_messages(username: str, since=None, limit: int = 0):
+    """Oldest-first messages newer than the watermark, with raw datetime timestamps"""
+    cursor = chats.find(_unsummarized_query(username, since)).sort("timestamp", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [
+        {
             "role": msg.get("role", "user"),
-            "content": content,
-            "model": msg.get("model"),
-            "timestamp": msg.get("timestamp", datetime.utcnow()).isoformat(),
-        })
+            "content": decrypt_message(msg.get("content") or msg.get("message", ""), msg.get("compression")),
+            "timestamp": msg["timestamp"],
+            "expires_at": msg.get("expires_at"),
+        }
+        for msg in cursor
+    ]
 
-    return results
+
+def get_conversation_summary(username: str):
+    """Return the user's summary of older turns, or None if never compacted (or expired)"""
+    doc = summaries.find_one({"_id": username})
+    if not doc or (doc.get("expires_at") and doc["expires_at"] <= datetime.utcnow()):
+        return None  # the TTL monitor deletes expired summaries within a minute or so
+    return {
+        "role": "system",
+        "content": decrypt_message(doc["content"]),
+        "watermark": doc["watermark"],
+        "model": doc.get("model"),
+        "expires_at": doc.get("expires_at"),
+    }
+
+
+def save_conversation_summary(username: str, content: str, watermark, model: str = None,
+                              expires_at: datetime = None):
+    """
+    Upsert the user's summary; `watermark` is the timestamp of the last folded message and
+    `expires_at` (None = keep) lets the TTL index delete the summary with its source messages
+    """
+    fields = {"content": encrypt_message(content), "watermark": watermark, "model": model}
+    if expires_at:
+        update = {"$set": {**fields, "expires_at": expires_at}}
+    else:
+        update = {"$set": fields, "$unset": {"expires_at": ""}}
+    summaries.update_one({"_id": username}, update, upsert=True)
 
 
-def clear_history(username: str):
-    """Delete all chat messages for a given user"""
-    chats.delete_many({"username": username})
+def move_legacy_summaries() -> int:
+    """
+    Move summaries that older releases kept in chat_history (flagged `pinned`) into their own
+    collection. One-off after upgrading: it scans chat_history. Returns the number moved.
+    """
+    moved = 0
+    for doc in chats.find({"pinned": True}):
+        summaries.update_one(
+            {"_id": doc["username"]},
+            {"$setOnInsert": {"content": doc["content"], "watermark": doc["watermark"], "model": doc.get("model")}},
+            upsert=True,
+        )
+        chats.delete_many({"_id": doc["_id"]})
+        moved += 1
+    return moved
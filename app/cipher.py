@@ -0,0 +1,236 @@
+# cipher.py
+"""
+Message ciphers for stored chat content.
+
+New messages are AES-256-GCM encrypted and stored as raw bytes (BSON binary):
+
+    0x01 | len(key id) | key id | 12-byte nonce | ciphertext + 16-byte tag
+
+The key id makes rotation a config change: add a key to MESSAGE_KEYS, point MESSAGE_KEY_ID
+at it, and documents written under older ids stay readable. Fernet tokens (base64 text) from
+earlier releases are still decrypted, and MESSAGE_CIPHER=fernet keeps writing them.
+
+    python -m app.cipher --messages 20000 --size 400   # throughput benchmark
+    python -m app.cipher --bulk --messages 10000        # decode_messages vs a per-row loop, 10k messages
+"""
+import base64
+import os
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from .settings import ENCRYPTION_KEY, MESSAGE_CIPHER, MESSAGE_KEYS, MESSAGE_KEY_ID, fernet
+
+AESGCM_V1 = 1
+NONCE_SIZE = 12
+
+
+def derive_key(secret: str, key_id: str = "k0") -> bytes:
+    """AES-256 key derived from ENCRYPTION_KEY, so upgrading needs no new secret"""
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=f"chat-history aes-gcm {key_id}".encode())
+    return hkdf.derive(secret.encode())
+
+
+def parse_keys(value: str) -> dict:
+    """"id:base64key,..." -> {id: key bytes}; raises ValueError for malformed entries"""
+    keys = {}
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        key_id, sep, encoded = pair.strip().partition(":")
+        try:
+            key = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except ValueError as e:
+            raise ValueError(f"MESSAGE_KEYS: key '{key_id}' is not base64") from e
+        if not sep or not key_id or len(key_id.encode()) > 255 or len(key) not in (16, 24, 32):
+            raise ValueError(f"MESSAGE_KEYS: expected id:base64 of a 16/24/32-byte key, got '{key_id}'")
+        keys[key_id] = key
+    return keys
+
+
+class FernetCipher:
+    """Legacy format: base64 text tokens (AES-CBC + HMAC)"""
+
+    name = "fernet"
+
+    def __init__(self, fernet_key=fernet):
+        self._fernet = fernet_key
+
+    def encrypt(self, text: str) -> str:
+        return self.encrypt_bytes(text.encode())
+
+    def decrypt(self, token: str) -> str:
+        return self.decrypt_bytes(token).decode()
+
+    def encrypt_bytes(self, data: bytes) -> str:
+        return self._fernet.encrypt(data).decode()
+
+    def decrypt_bytes(self, token: str) -> bytes:
+        return self._fernet.decrypt(token.encode())
+
+
+class AESGCMCipher:
+    """AES-GCM with a key id per message; `keys` maps id -> key, `active` is used for writes"""
+
+    name = "aesgcm"
+
+    def __init__(self, keys: dict, active: str):
+        if active not in keys:
+            raise ValueError(f"MESSAGE_KEY_ID '{active}' is not a configured key")
+        self._aead = {key_id: AESGCM(key) for key_id, key in keys.items()}
+        self._active = self._aead[active]
+        self._header = bytes([AESGCM_V1, len(active.encode())]) + active.encode()
+
+    def encrypt(self, text: str) -> bytes:
+        return self.encrypt_bytes(text.encode())
+
+    def decrypt(self, blob: bytes) -> str:
+        return self.decrypt_bytes(blob).decode()
+
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return self._header + nonce + self._active.encrypt(nonce, data, None)
+
+    def decrypt_bytes(self, blob: bytes) -> bytes:
+        if not blob or blob[0] != AESGCM_V1:
+            raise ValueError("Unknown message format")
+        start = 2 + blob[1]
+        key_id = blob[2:start].decode()
+        aead = self._aead.get(key_id)
+        if aead is None:
+            raise KeyError(f"No key '{key_id}' in MESSAGE_KEYS")
+        return aead.decrypt(blob[start:start + NONCE_SIZE], blob[start + NONCE_SIZE:], None)
+
+    def decrypt_many(self, blobs: list) -> list:
+        """decrypt() for many blobs in one loop, looking each key id up once; raises like decrypt_bytes"""
+        aeads = {}
+        texts = []
+        for blob in blobs:
+            if not blob or blob[0] != AESGCM_V1:
+                raise ValueError("Unknown message format")
+            start = 2 + blob[1]
+            key_id = blob[2:start]
+            aead = aeads.get(key_id)
+            if aead is None:
+                aead = self._aead.get(key_id.decode())
+                if aead is None:
+                    raise KeyError(f"No key '{key_id.decode()}' in MESSAGE_KEYS")
+                aeads[key_id] = aead
+            texts.append(aead.decrypt(blob[start:start + NONCE_SIZE], blob[start + NONCE_SIZE:], None).decode())
+        return texts
+
+
+class MessageCipher:
+    """Writes with the configured cipher; reads AES-GCM bytes, Fernet text and legacy plaintext"""
+
+    def __init__(self, writer, aesgcm: AESGCMCipher, legacy: FernetCipher):
+        self.writer = writer
+        self.aesgcm = aesgcm
+        self.legacy = legacy
+
+    def encrypt(self, text: str):
+        return self.writer.encrypt(text)
+
+    def decrypt(self, stored) -> str:
+        if isinstance(stored, (bytes, bytearray)):
+            return self.aesgcm.decrypt(bytes(stored))
+        try:
+            return self.legacy.decrypt(stored)
+        except InvalidToken:
+            return stored  # unencrypted record from before encryption was added
+
+    def encrypt_bytes(self, data: bytes):
+        return self.writer.encrypt_bytes(data)
+
+    def decrypt_bytes(self, stored) -> bytes:
+        """For payloads that were never plaintext (compressed content), so no legacy fallback"""
+        if isinstance(stored, (bytes, bytearray)):
+            return self.aesgcm.decrypt_bytes(bytes(stored))
+        return self.legacy.decrypt_bytes(stored)
+
+
+def build_cipher(name: str = MESSAGE_CIPHER, keys: str = MESSAGE_KEYS, active: str = MESSAGE_KEY_ID) -> MessageCipher:
+    keyring = {"k0": derive_key(ENCRYPTION_KEY), **parse_keys(keys)}
+    aesgcm = AESGCMCipher(keyring, active)
+    legacy = FernetCipher()
+    writers = {"aesgcm": aesgcm, "fernet": legacy}
+    if name not in writers:
+        raise ValueError(f"MESSAGE_CIPHER must be one of {', '.join(writers)}, got '{name}'")
+    return MessageCipher(writers[name], aesgcm, legacy)
+
+
+message_cipher = build_cipher()
+
+
+# -------------------------------
+# Benchmark
+# -------------------------------
+def benchmark(messages: int = 10000, size: int = 400) -> dict:
+    """Encrypt and decrypt `messages` texts of `size` characters with each cipher"""
+    import time
+
+    text = ("lorem ipsum dolor sit amet " * (size // 27 + 1))[:size]
+    results = {}
+    for cipher in (message_cipher.legacy, message_cipher.aesgcm):
+        started = time.perf_counter()
+        stored = [cipher.encrypt(text) for _ in range(messages)]
+        encrypted = time.perf_counter() - started
+        started = time.perf_counter()
+        for value in stored:
+            cipher.decrypt(value)
+        decrypted = time.perf_counter() - started
+        results[cipher.name] = {
+            "encrypt_per_s": messages / encrypted,
+            "decrypt_per_s": messages / decrypted,
+            "stored_bytes": len(stored[0]),
+        }
+    return results
+
+
+def bulk_benchmark(messages: int = 10000, size: int = 400, rounds: int = 5) -> dict:
+    """
+    Best-of-`rounds` seconds to decode a `messages`-long history, per cipher: one _message_out
+    call per document ("loop", the per-row path) against decode_messages ("bulk")
+    """
+    import time
+    from datetime import datetime
+    from .chat_history import decode_messages, _message_out
+
+    def best(decode, docs):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            decode(docs)
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    text = ("lorem ipsum dolor sit amet " * (size // 27 + 1))[:size]
+    results = {}
+    for cipher in (message_cipher.legacy, message_cipher.aesgcm):
+        docs = [{"role": "user", "content": cipher.encrypt(text), "timestamp": datetime.utcnow(), "model": "llama3.2"}
+                for _ in range(messages)]
+        results[cipher.name] = {
+            "loop": best(lambda d: [_message_out(doc) for doc in d], docs),
+            "bulk": best(decode_messages, docs),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare Fernet and AES-GCM message throughput")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=400, help="characters per message")
+    parser.add_argument("--bulk", action="store_true", help="benchmark decode_messages instead")
+    args = parser.parse_args()
+
+    if args.bulk:
+        print(f"{'cipher':<10}{'loop ms':>10}{'bulk ms':>10}{'speedup':>10}")
+        for name, row in bulk_benchmark(args.messages, args.size).items():
+            print(f"{name:<10}{row['loop'] * 1000:>10.1f}{row['bulk'] * 1000:>10.1f}{row['loop'] / row['bulk']:>9.2f}x")
+        raise SystemExit(0)
+
+    print(f"{'cipher':<10}{'encrypt/s':>14}{'decrypt/s':>14}{'stored bytes':>14}")
+    for name, row in benchmark(args.messages, args.size).items():
+        print(f"{name:<10}{row['encrypt_per_s']:>14,.0f}{row['decrypt_per_s']:>14,.0f}{row['stored_bytes']:>14}")
@@ -0,0 +1,102 @@
+# compaction.py
+import threading
+from .settings import HISTORY_COMPACT_THRESHOLD, HISTORY_RECENT_TURNS, MODEL
+from .llm import get_response
+from .chat_history import (
+    count_unsummarized,
+    get_unsummarized_messages,
+    get_conversation_summary,
+    save_conversation_summary,
+    move_legacy_summaries,
+)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a chat between a user and an assistant.\n"
+    "Update the summary with the new messages below. Keep facts, names, decisions "
+    "and open questions; drop small talk. Answer with the summary only.\n\n"
+    "Current summary:\n{previous}\n\n"
+    "New messages:\n{transcript}"
+)
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def compact_history(username: str, model: str = MODEL) -> bool:
+    """
+    Fold the user's older messages into their summary once more than
+    HISTORY_COMPACT_THRESHOLD messages sit above the watermark.
+    Keeps the last HISTORY_RECENT_TURNS messages verbatim. Returns True if compacted.
+    """
+    if HISTORY_COMPACT_THRESHOLD <= 0:
+        return False
+
+    with _running_lock:
+        if username in _running:
+            return False  # another request is already compacting this user
+        _running.add(username)
+
+    try:
+        summary = get_conversation_summary(username)
+        watermark = summary["watermark"] if summary else None
+
+        pending = count_unsummarized(username, since=watermark)
+        if pending <= HISTORY_COMPACT_THRESHOLD:
+            return False
+        foldable = pending - HISTORY_RECENT_TURNS
+        if foldable <= 0:
+            return False  # HISTORY_RECENT_TURNS >= threshold: everything pending stays verbatim
+
+        older = get_unsummarized_messages(username, since=watermark, limit=foldable)
+        if not older:
+            return False
+
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in older)
+        prompt = SUMMARY_PROMPT.format(
+            previous=summary["content"] if summary else "(none)",
+            transcript=transcript,
+        )
+        # Background class: waits behind interactive chat turns for an Ollama slot
+        text = get_response(prompt, model, priority="background")
+        if not text:
+            return False
+
+        save_conversation_summary(username, text, older[-1]["timestamp"], model, summary_expiry(summary, older))
+        return True
+    except Exception as e:
+        print(f"⚠️ History compaction failed for {username}: {e}")
+        return False
+    finally:
+        with _running_lock:
+            _running.discard(username)
+
+
+def summary_expiry(summary, folded: list):
+    """
+    When a new summary must be deleted under retention: with the last-expiring of the messages
+    folded into it (the previous summary counts as one). None if any of them is kept forever.
+    """
+    dates = [message.get("expires_at") for message in folded]
+    if summary:
+        dates.append(summary.get("expires_at"))
+    if not dates or None in dates:
+        return None
+    return max(dates)
+
+
+def build_chat_context(history, summary=None, limit: int = HISTORY_RECENT_TURNS) -> str:
+    """Render the summary (if any) plus the last `limit` messages after its watermark"""
+    recent = history
+    lines = []
+    if summary:
+        cutoff = summary["watermark"].isoformat()
+        recent = [m for m in history if (m.get("timestamp") or "") > cutoff]
+        lines.append(f"system: Summary of earlier conversation: {summary['content']}")
+
+    lines.extend(f"{m['role']}: {m['content']}" for m in recent[-limit:])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m app.compaction — run once after upgrading from a release that kept summaries in chat_history
+    print(f"✅ Moved {move_legacy_summaries()} summaries into history_summaries")
@@ -0,0 +1,118 @@
+# content_codec.py
+"""
+Optional compression of message content before encryption. Compressed documents carry
+`compression: "<codec>"` so reads know to decompress; documents without it are plain text.
+
+    python -m app.content_codec            # savings report on a sample corpus
+"""
+import zlib
+from .settings import MESSAGE_COMPRESSION, MESSAGE_COMPRESS_MIN_BYTES
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {"zlib": (lambda data: zlib.compress(data, 6), zlib.decompress)}
+if zstandard is not None:
+    CODECS["zstd"] = (_zstd_compress, _zstd_decompress)
+
+
+def resolve_codec(name: str = MESSAGE_COMPRESSION):
+    """Codec name to write with, or None when compression is off"""
+    if name in ("", "none"):
+        return None
+    if name == "auto":
+        return "zstd" if "zstd" in CODECS else "zlib"
+    if name == "zstd" and zstandard is None:
+        print("⚠️ Warning: MESSAGE_COMPRESSION=zstd but zstandard is not installed. Using zlib.")
+        return "zlib"
+    if name not in CODECS:
+        raise ValueError(f"MESSAGE_COMPRESSION must be none, zlib, zstd or auto, got '{name}'")
+    return name
+
+
+WRITE_CODEC = resolve_codec()
+
+
+def compress_content(text: str, codec: str = WRITE_CODEC, min_bytes: int = MESSAGE_COMPRESS_MIN_BYTES):
+    """(payload bytes, codec or None); small or incompressible text is returned as UTF-8"""
+    data = text.encode()
+    if codec is None or len(data) < min_bytes:
+        return data, None
+    packed = CODECS[codec][0](data)
+    if len(packed) >= len(data):
+        return data, None
+    return packed, codec
+
+
+def decompress_content(data: bytes, codec: str) -> str:
+    if codec not in CODECS:
+        raise ValueError(f"Cannot read '{codec}'-compressed message; is zstandard installed?")
+    return CODECS[codec][1](data).decode()
+
+
+# -------------------------------
+# Savings report
+# -------------------------------
+def sample_corpus(size: int = 400, seed: int = 0) -> list:
+    """Message mix resembling stored history: short prompts, multi-paragraph answers, document chunks"""
+    import random
+
+    rng = random.Random(seed)
+    prompts = ["Hi there!", "What is the capital of Australia?", "Explain the difference between a process and a thread.",
+               "Summarise the attached contract.", "Can you rewrite this paragraph in plain English?"]
+    sentences = [
+        "A process is an independent program in execution with its own memory space.",
+        "Threads share the memory of the process that owns them, which makes communication cheap.",
+        "Creating a thread is usually faster than starting a new process.",
+        "A data race happens when two threads access the same variable and at least one of them writes.",
+        "Canberra was chosen as a compromise between Sydney and Melbourne in 1908.",
+        "The contract renews automatically unless either party gives ninety days' notice.",
+        "Late payments accrue interest at 1.5% per month or the maximum rate permitted by law.",
+        "In short, use processes for isolation and threads for shared-memory concurrency.",
+        "Here is a step-by-step breakdown of the main points you asked about.",
+        "Let me know if you would like a shorter version or more detail on any section.",
+    ]
+    corpus = []
+    for i in range(size):
+        corpus.append(rng.choice(prompts))
+        corpus.append(" ".join(rng.choice(sentences) for _ in range(rng.randint(3, 25))))
+        if i % 5 == 0:  # uploaded files are stored in 3000-char chunks
+            words = " ".join(f"{rng.choice(sentences)} (clause {rng.randint(1, 999)})" for _ in range(40))
+            corpus.append(words[:3000])
+    return corpus
+
+
+def savings_report(corpus: list = None, codecs: list = None) -> dict:
+    """Content bytes per codec before and after encryption; the latter is what MongoDB stores and caches"""
+    from .cipher import message_cipher
+
+    corpus = corpus or sample_corpus()
+    report = {}
+    for codec in [None] + (codecs or list(CODECS)):
+        stored = payload = 0
+        for text in corpus:
+            data, _ = compress_content(text, codec)
+            payload += len(data)
+            stored += len(message_cipher.encrypt_bytes(data))
+        report[codec or "none"] = {"messages": len(corpus), "payload_bytes": payload, "stored_bytes": stored}
+    plain = report["none"]["stored_bytes"]
+    for row in report.values():
+        row["saved"] = 1 - row["stored_bytes"] / plain
+    return report
+
+
+if __name__ == "__main__":
+    print(f"{'codec':<8}{'messages':>10}{'payload':>12}{'stored':>12}{'saved':>8}")
+    for name, row in savings_report().items():
+        print(f"{name:<8}{row['messages']:>10}{row['payload_bytes']:>12,}{row['stored_bytes']:>12,}{row['saved']:>8.0%}")
@@ -0,0 +1,125 @@
+# conversations.py
+"""
+Conversation threads. A thread is a small metadata document in `conversations`
+(title, last activity, message count); its messages stay in chat_history tagged with
+`conversation_id`, so loading a thread's context is one range of the
+username_conversation_timestamp_id index. Messages saved without a conversation_id
+form the user's unscoped stream, as before threads existed; /chat without a thread
+builds on that stream only, and just /history's "All messages" view mixes threads.
+
+Deleting a thread removes its document and writes a hide marker at once (see
+async_chat_history.hide_thread); its messages are then purged in the background.
+A turn that is still running when its thread goes is not saved into it (see save_to_conversation).
+"""
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from .db import async_conversations
+from .async_chat_history import delete_in_chunks, drop_archived, hide_thread, unhide_thread, _read_your_writes
+from .chat_history import scoped_query
+from .history_cache import history_cache
+
+DEFAULT_TITLE = "New conversation"
+
+
+def _object_id(conversation_id: str):
+    try:
+        return ObjectId(conversation_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def conversation_out(doc: dict) -> dict:
+    return {
+        "id": str(doc["_id"]),
+        "title": doc.get("title") or DEFAULT_TITLE,
+        "created_at": doc["created_at"].isoformat(),
+        "last_activity": doc["last_activity"].isoformat(),
+        "message_count": doc.get("message_count", 0),
+    }
+
+
+async def create_conversation(username: str, title: str = None) -> dict:
+    now = datetime.utcnow()
+    doc = {
+        "username": username,
+        "title": (title or "").strip() or DEFAULT_TITLE,
+        "created_at": now,
+        "last_activity": now,
+        "message_count": 0,
+    }
+    await async_conversations.insert_one(doc)
+    return conversation_out(doc)
+
+
+async def list_conversations(username: str, limit: int = 100) -> list:
+    """The user's threads, most recently active first (username_last_activity index)"""
+    cursor = async_conversations.find({"username": username}).sort("last_activity", -1).limit(limit)
+    return [conversation_out(doc) for doc in await cursor.to_list(None)]
+
+
+async def get_conversation(username: str, conversation_id: str):
+    """The thread's metadata document, or None if it does not exist or belongs to someone else"""
+    _id = _object_id(conversation_id)
+    if _id is None:
+        return None
+    return await async_conversations.find_one({"_id": _id, "username": username})
+
+
+async def rename_conversation(username: str, conversation_id: str, title: str):
+    _id = _object_id(conversation_id)
+    if _id is None:
+        return None
+    title = title.strip() or DEFAULT_TITLE
+    result = await async_conversations.update_one({"_id": _id, "username": username}, {"$set": {"title": title}})
+    if not result.matched_count:
+        return None
+    return await get_conversation(username, conversation_id)
+
+
+async def touch_conversation(username: str, conversation_id: str, messages: int = 2) -> bool:
+    """Bump last activity and the message count after a turn is saved; False if the thread is gone"""
+    result = await async_conversations.update_one(
+        {"_id": ObjectId(conversation_id), "username": username},
+        {"$set": {"last_activity": datetime.utcnow()}, "$inc": {"message_count": messages}},
+    )
+    return bool(result.matched_count)
+
+
+async def save_to_conversation(username: str, conversation_id: str, save, messages: int = 2) -> bool:
+    """
+    Await `save()` (which writes a turn tagged with `conversation_id`) and bump the thread, unless
+    the thread was deleted while the turn ran: then nothing is written. A delete that lands during
+    the write shows up in touch_conversation, and the turn is purged with the rest of the thread.
+    Returns whether the turn was kept. Without a thread, just saves.
+    """
+    if conversation_id and not await get_conversation(username, conversation_id):
+        return False
+    await save()
+    if conversation_id and not await touch_conversation(username, conversation_id, messages):
+        await purge_conversation(username, conversation_id)
+        return False
+    return True
+
+
+async def delete_conversation(username: str, conversation_id: str) -> bool:
+    """Remove the thread and hide its messages; they are deleted afterwards with purge_conversation"""
+    _id = _object_id(conversation_id)
+    if _id is None:
+        return False
+    result = await async_conversations.delete_many({"_id": _id, "username": username})
+    if not result.deleted_count:
+        return False
+    await hide_thread(username, conversation_id)
+    history_cache.invalidate(username)
+    return True
+
+
+async def purge_conversation(username: str, conversation_id: str) -> int:
+    """Delete a removed thread's messages in chunks. Returns the count deleted."""
+    await _read_your_writes(username)  # a buffered turn must not land after the purge
+    deleted = await delete_in_chunks(scoped_query(username, conversation_id))
+    deleted += await drop_archived(username, conversation_id)
+    await unhide_thread(username, conversation_id)
+    history_cache.invalidate(username)
+    return deleted
@@ -1,5 +1,5 @@
 # db.py
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 import os
 
 MONGO_USER = os.getenv("MONGO_USER")
@@ -7,8 +7,51 @@ MONGO_PASS = os.getenv("MONGO_PASS")
 MONGO_HOST = os.getenv("MONGO_HOST")  # Docker service name
 MONGO_DB   = os.getenv("MONGO_DB")
 MONGO_DB_PORT = os.getenv("MONGO_DB_PORT", "27017")
+# Create/verify chat_history indexes on startup; optionally refuse to start without an index scan
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "True").lower() in ("true", "1", "yes")
+MONGO_REQUIRE_INDEX_SCAN = os.getenv("MONGO_REQUIRE_INDEX_SCAN", "False").lower() in ("true", "1", "yes")
 MONGO_URI = f"mongodb://{MONGO_USER}:{MONGO_PASS}@{MONGO_HOST}:27017/{MONGO_DB}?authSource=admin"
 
-client = MongoClient(MONGO_URI)
+
+def _optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Connection pool and timeouts (milliseconds), shared by the sync and async clients;
+# unset values keep pymongo's defaults
+MONGO_CLIENT_OPTIONS = {
+    key: value for key, value in {
+        "maxPoolSize": _optional_int("MONGO_MAX_POOL_SIZE"),
+        "minPoolSize": _optional_int("MONGO_MIN_POOL_SIZE"),
+        "maxIdleTimeMS": _optional_int("MONGO_MAX_IDLE_TIME_MS"),
+        "waitQueueTimeoutMS": _optional_int("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "connectTimeoutMS": _optional_int("MONGO_CONNECT_TIMEOUT_MS"),
+        "socketTimeoutMS": _optional_int("MONGO_SOCKET_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _optional_int("MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+    }.items() if value is not None
+}
+
+client = MongoClient(MONGO_URI, **MONGO_CLIENT_OPTIONS)
 db = client[MONGO_DB]
-chats = db["chat_history"]
\ No newline at end of file
+chats = db["chat_history"]
+# One document per user whose history is being purged: {"username", "before"}
+purges = db["history_purges"]
+# Conversation threads with cached metadata: {"username", "title", "created_at", "last_activity", "message_count"}
+conversations = db["conversations"]
+# Blind search index, one document per message: {"_id": message id, "username", "timestamp", "terms"}
+search_terms = db["search_terms"]
+# Archived (cold) history: one compressed, encrypted batch of a user's oldest messages per document
+segments = db["history_segments"]
+# Rolling /chat summary of each user's older turns (see compaction.py): {"_id": username, "content", "watermark", "model"}
+summaries = db["history_summaries"]
+
+# Async client for `async def` routes (connects lazily on the running event loop)
+async_client = AsyncMongoClient(MONGO_URI, **MONGO_CLIENT_OPTIONS)
+async_db = async_client[MONGO_DB]
+async_chats = async_db["chat_history"]
+async_purges = async_db["history_purges"]
+async_conversations = async_db["conversations"]
+async_search_terms = async_db["search_terms"]
+async_segments = async_db["history_segments"]
+async_summaries = async_db["history_summaries"]
@@ -0,0 +1,181 @@
+# history_cache.py
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from .settings import HISTORY_CACHE_USERS, HISTORY_CACHE_MESSAGES, HISTORY_CACHE_IDLE_TTL
+from .metrics import HISTORY_CACHE_HITS, HISTORY_CACHE_MISSES, HISTORY_CACHE_USERS_GAUGE, HISTORY_CACHE_BYTES
+
+
+class _Entry:
+    __slots__ = ("items", "cover_from", "touched", "size")
+
+    def __init__(self, cover_from: datetime):
+        self.items = []  # (timestamp, _id, message) oldest first
+        self.cover_from = cover_from  # every message with timestamp > cover_from is in `items`
+        self.touched = time.monotonic()
+        self.size = 0
+
+
+def _owner(key) -> str:
+    return key[0] if isinstance(key, tuple) else key
+
+
+def _message_size(message: dict) -> int:
+    return sys.getsizeof(message) + sum(sys.getsizeof(v) for v in message.values())
+
+
+class HotHistoryCache:
+    """
+    Per-process LRU of the last `per_user` decrypted messages of active users. It is primed
+    from tail reads and updated write-through by saves, so steady-state /chat turns build
+    their context without a MongoDB read or any decryption. Entries idle for `idle_ttl`
+    seconds are dropped; clear_history must call invalidate().
+
+    Keys are a username (the user's whole stream) or (username, conversation_id) for a thread.
+    """
+
+    def __init__(self, max_users: int = HISTORY_CACHE_USERS, per_user: int = HISTORY_CACHE_MESSAGES,
+                 idle_ttl: float = HISTORY_CACHE_IDLE_TTL):
+        self.max_users = max_users
+        self.per_user = per_user
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Write sequence numbers let prime() detect writes that raced with its database read
+        self._seq = 0
+        self._last_write = {}
+        self._forgotten_before = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_users > 0 and self.per_user > 0
+
+    def get(self, key, limit: int, since: datetime = None):
+        """The last `limit` messages newer than `since` (oldest first), or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                newer = [m for ts, _, m in entry.items if since is None or ts > since]
+                if len(newer) >= limit or (since or datetime.min) >= entry.cover_from:
+                    entry.touched = time.monotonic()
+                    self._entries.move_to_end(key)
+                    HISTORY_CACHE_HITS.inc()
+                    return newer[-limit:] if limit else newer
+        HISTORY_CACHE_MISSES.inc()
+        return None
+
+    def read_token(self) -> int:
+        """Call before the database read whose result will be passed to prime()"""
+        with self._lock:
+            return self._seq
+
+    def prime(self, key, items: list, limit: int, since: datetime = None, token: int = None):
+        """
+        Seed from a tail read: `items` are (timestamp, _id, message) oldest first, as returned
+        by a query for the last `limit` messages newer than `since`. Skipped when the user
+        wrote or cleared history after `token` was taken, since the read may be stale.
+        """
+        if not self.enabled:
+            return
+        complete = not limit or len(items) < limit  # the read returned everything after `since`
+        cover_from = (since or datetime.min) if complete else items[0][0]
+        with self._lock:
+            if token is not None and (token < self._forgotten_before or self._last_write.get(_owner(key), -1) > token):
+                return
+            entry = _Entry(cover_from)
+            self._replace(key, entry)
+            self._extend(entry, items)
+            self._evict()
+            self._report()
+
+    def append(self, key, items: list):
+        """Write-through for new messages; keys without an entry are left alone"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._note_write(_owner(key))
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self._extend(entry, items)
+            entry.touched = time.monotonic()
+            self._entries.move_to_end(key)
+            self._report()
+
+    def invalidate(self, username: str):
+        """Drop the user's stream and all of their threads"""
+        with self._lock:
+            self._note_write(username)
+            for key in [k for k in self._entries if _owner(k) == username]:
+                self._replace(key, None)
+            self._report()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._report()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._entries), "bytes": self._bytes}
+
+    # -------------------------------
+    # Internals (lock held)
+    # -------------------------------
+    def _note_write(self, username: str):
+        self._seq += 1
+        self._last_write[username] = self._seq
+        if len(self._last_write) > 4 * max(self.max_users, 1):
+            self._last_write.clear()  # bound memory; tokens older than this are treated as stale
+            self._forgotten_before = self._seq
+
+    def _extend(self, entry: _Entry, items: list):
+        for item in items:
+            entry.items.append(item)
+            size = _message_size(item[2])
+            entry.size += size
+            self._bytes += size
+        entry.items.sort(key=lambda item: (item[0], str(item[1])))
+        while len(entry.items) > self.per_user:
+            dropped = entry.items.pop(0)
+            entry.cover_from = max(entry.cover_from, dropped[0])
+            size = _message_size(dropped[2])
+            entry.size -= size
+            self._bytes -= size
+
+    def _replace(self, username: str, entry):
+        old = self._entries.pop(username, None)
+        if old is not None:
+            self._bytes -= old.size
+        if entry is not None:
+            self._entries[username] = entry
+
+    def _expire(self):
+        if self.idle_ttl <= 0:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._entries:
+            username, entry = next(iter(self._entries.items()))
+            if entry.touched > cutoff:
+                break
+            self._replace(username, None)
+        self._report()
+
+    def _evict(self):
+        self._expire()
+        while len(self._entries) > self.max_users:
+            self._replace(next(iter(self._entries)), None)
+
+    def _report(self):
+        HISTORY_CACHE_USERS_GAUGE.set(len(self._entries))
+        HISTORY_CACHE_BYTES.set(self._bytes)
+
+
+history_cache = HotHistoryCache()
@@ -0,0 +1,95 @@
+# idempotency.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from .settings import IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request body"""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future = Future()
+        self.expires = None  # set once the result is stored; in-flight entries never expire
+
+
+def fingerprint(*parts) -> str:
+    """Stable hash of the request fields that must match when a key is reused"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    In-process TTL store of request results keyed by (scope, Idempotency-Key).
+    The first request claims the key and runs; duplicates get the same Future and wait for
+    its result, so a retry never starts a second generation or writes history twice.
+    Failed or aborted requests release the key so the client can retry for real.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float):
+        for key in [k for k, e in self._entries.items() if e.expires is not None and e.expires <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_keys:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires is None:
+                break  # never evict in-flight requests
+            del self._entries[key]
+
+    def claim(self, scope: str, key: str, request_fingerprint: str = ""):
+        """
+        Returns (future, owner). The owner must call complete() or release();
+        everyone else waits on the future. Raises IdempotencyConflict on a body mismatch.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get((scope, key))
+            if entry is not None:
+                if entry.fingerprint != request_fingerprint:
+                    raise IdempotencyConflict(key)
+                return entry.future, False
+            entry = _Entry(request_fingerprint)
+            self._entries[(scope, key)] = entry
+            return entry.future, True
+
+    def complete(self, scope: str, key: str, result):
+        """Store the owner's result for `ttl` seconds and wake any waiting duplicates"""
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                return
+            entry.expires = time.monotonic() + self.ttl
+            self._entries.move_to_end((scope, key))
+        entry.future.set_result(result)
+
+    def release(self, scope: str, key: str, error: BaseException = None):
+        """Forget the key; waiting duplicates get `error` (or None when the owner gave up)"""
+        with self._lock:
+            entry = self._entries.pop((scope, key), None)
+        if entry is None or entry.future.done():
+            return
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+idempotency_store = IdempotencyStore()
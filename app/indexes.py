@@ -0,0 +1,161 @@
+# indexes.py
+import sys
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from .db import chats, conversations, search_terms, segments, summaries
+from .chat_history import count_query, recent_query, page_query, encode_cursor, RECENT_PROJECTION
+
+# Every chat_history query filters on username and orders by timestamp; _id breaks ties
+# for /history page cursors
+HISTORY_INDEXES = [
+    {"keys": [("username", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)], "name": "username_timestamp_id"},
+    # Thread-scoped /chat context and /history pages
+    {"keys": [("username", ASCENDING), ("conversation_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+     "name": "username_conversation_timestamp_id"},
+    # Retention: MongoDB's TTL monitor deletes messages once `expires_at` passes; messages
+    # written without a retention period have no `expires_at` and stay out of this index
+    {"keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0,
+     "partialFilterExpression": {"expires_at": {"$exists": True}}},
+]
+
+# The thread list is ordered by last activity
+CONVERSATION_INDEXES = [
+    {"keys": [("username", ASCENDING), ("last_activity", DESCENDING)], "name": "username_last_activity"},
+]
+
+
+# /history/search: candidates by (username, hashed word), newest first; entries expire with their message
+SEARCH_INDEXES = [
+    {"keys": [("username", ASCENDING), ("terms", ASCENDING), ("timestamp", DESCENDING)], "name": "username_terms_timestamp"},
+    {"keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0,
+     "partialFilterExpression": {"expires_at": {"$exists": True}}},
+]
+
+
+# Archive segments are read newest or oldest first per user; a segment expires with its last message
+SEGMENT_INDEXES = [
+    {"keys": [("username", ASCENDING), ("last_ts", ASCENDING)], "name": "username_last_ts"},
+    {"keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0,
+     "partialFilterExpression": {"expires_at": {"$exists": True}}},
+]
+
+
+# Summaries are read by _id; under retention one expires with the messages folded into it
+SUMMARY_INDEXES = [
+    {"keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0,
+     "partialFilterExpression": {"expires_at": {"$exists": True}}},
+]
+
+
+class IndexCheckError(RuntimeError):
+    """A required index is missing or a history query does not use it"""
+
+
+def ensure_indexes(collection=chats, specs=HISTORY_INDEXES) -> list:
+    """
+    Create the chat_history indexes (a no-op when they already exist) and verify
+    each one is present with the expected key pattern. Returns the index names.
+    """
+    for spec in specs:
+        options = {k: v for k, v in spec.items() if k != "keys"}
+        collection.create_index(spec["keys"], **options)
+
+    existing = collection.index_information()
+    for spec in specs:
+        info = existing.get(spec["name"])
+        if info is None or [tuple(k) for k in info["key"]] != [tuple(k) for k in spec["keys"]]:
+            raise IndexCheckError(f"Index {spec['name']} missing or has unexpected keys: {info}")
+    return [spec["name"] for spec in specs]
+
+
+def plan_stages(plan: dict) -> list:
+    """Flatten an explain() winning plan into its stage names, root first"""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop(0)
+        if "queryPlan" in node:  # slot-based engine wraps the classic plan
+            node = node["queryPlan"]
+        stages.append(node.get("stage"))
+        if "inputStage" in node:
+            pending.append(node["inputStage"])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+
+def find_stages(query: dict, sort: list, projection: dict = None, collection=chats, limit: int = 50) -> list:
+    """Stage names of the plan MongoDB picks for find(query, projection).sort(sort).limit(limit)"""
+    explain = collection.find(query, projection).sort(sort).limit(limit).explain()
+    return plan_stages(explain["queryPlanner"]["winningPlan"])
+
+
+def history_plans(username: str) -> list:
+    """(name, query, sort, projection) of the /chat tail and /history page reads, unscoped and per thread"""
+    thread = "__index_check__"
+    cursor = encode_cursor(datetime(2000, 1, 1), ObjectId())
+    newest_first = [("timestamp", -1), ("_id", -1)]
+    plans = [
+        ("recent history", recent_query(username), newest_first, RECENT_PROJECTION),
+        ("thread recent history", recent_query(username, conversation_id=thread), newest_first, RECENT_PROJECTION),
+    ]
+    for name, conversation_id, hidden in (("history page", None, [thread]), ("thread history page", thread, [])):
+        query, sort = page_query(username, before=cursor, conversation_id=conversation_id, hidden=hidden)
+        plans.append((name, query, sort, None))
+    return plans
+
+
+def check_history_plan(username: str = "__index_check__") -> list:
+    """
+    Explain the queries behind the /chat context tail and /history pages (see history_plans)
+    and raise IndexCheckError unless each is answered by an index scan without a blocking
+    in-memory SORT. Returns the stage names of the unscoped tail.
+    """
+    plans = []
+    for name, query, sort, projection in history_plans(username):
+        stages = find_stages(query, sort, projection, chats)
+        if "COLLSCAN" in stages or "IXSCAN" not in stages:
+            raise IndexCheckError(f"{name} is not an index scan: {stages}")
+        if "SORT" in stages:
+            raise IndexCheckError(f"{name} sorts in memory: {stages}")
+        plans.append(stages)
+    return plans[0]
+
+
+def count_stages(query: dict, collection=chats) -> list:
+    """Stage names of the plan MongoDB picks for count_documents(query)"""
+    explain = collection.database.command(
+        "explain", {"count": collection.name, "query": query}, verbosity="queryPlanner"
+    )
+    return plan_stages(explain["queryPlanner"]["winningPlan"])
+
+
+def check_count_plan(username: str = "__index_check__") -> list:
+    """
+    Explain history_version's counts (all messages, one thread, and both under a pending clear)
+    and raise IndexCheckError unless each is a COUNT_SCAN, i.e. never fetches a document.
+    Returns the stage names of the whole-history count.
+    """
+    cutoff = datetime(2000, 1, 1)
+    plans = []
+    for conversation_id in (None, "__index_check__"):
+        for since in (None, cutoff):
+            stages = count_stages(count_query(username, conversation_id, since), chats)
+            if "COUNT_SCAN" not in stages or "FETCH" in stages:
+                raise IndexCheckError(f"history_version count is not a COUNT_SCAN: {stages}")
+            plans.append(stages)
+    return plans[0]
+
+
+if __name__ == "__main__":
+    # python -m app.indexes — create the indexes and fail (exit 1) if the history plan regresses
+    try:
+        names = ensure_indexes() + ensure_indexes(conversations, CONVERSATION_INDEXES)
+        names += ensure_indexes(search_terms, SEARCH_INDEXES) + ensure_indexes(segments, SEGMENT_INDEXES)
+        names += ensure_indexes(summaries, SUMMARY_INDEXES)
+        print(f"✅ Indexes: {', '.join(names)}")
+        print(f"✅ history plan: {' <- '.join(check_history_plan())}")
+        print(f"✅ history_version count plan: {' <- '.join(check_count_plan())}")
+    except IndexCheckError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
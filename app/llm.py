@@ -1,15 +1,364 @@
 #llm.py
+import asyncio
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from .settings import OLLAMA_API_URL, MODEL
+from .settings import (
+    OLLAMA_API_URL, MODEL, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT,
+    OLLAMA_BACKENDS, LLM_HEDGE_ENABLED, LLM_HEDGE_DELAY, LLM_HEDGE_MIN_SAMPLES, LLM_DISCONNECT_POLL,
+)
+from .scheduler import llm_scheduler, QueueCancelled, DEFAULT_PRIORITY
+from .metrics import (
+    observe_llm_call, LLM_TTFT_SECONDS, LLM_HEDGED_REQUESTS, LLM_HEDGE_WINS, LLM_TIMEOUTS, LLM_CANCELLED,
+)
 
+NS_PER_SECOND = 1e9
 
-def get_response(prompt: str, model: str = MODEL) -> str:
+# Worker threads for hedged calls (two streaming attempts per request at most)
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+def extract_stats(data: dict, ttft: float, e2e: float) -> dict:
+    """
+    Convert Ollama's eval counters (nanoseconds) to seconds and add client-side timings.
+    Counters missing from the response are left out.
+    """
+    stats = {"ttft": ttft, "e2e": e2e}
+    for key in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration"):
+        if isinstance(data.get(key), (int, float)):
+            stats[key] = data[key] / NS_PER_SECOND
+    for key in ("prompt_eval_count", "eval_count"):
+        if isinstance(data.get(key), (int, float)):
+            stats[key] = data[key]
+    if stats.get("eval_count") and stats.get("eval_duration"):
+        stats["tokens_per_second"] = stats["eval_count"] / stats["eval_duration"]
+    return stats
+
+
+class CancelToken:
+    """
+    Thread-safe cancellation flag for an LLM call.
+    In-flight generations register abort callbacks so cancel() closes them immediately.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def register(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class StreamingGeneration:
+    """
+    One streaming /api/generate call. Iterating yields text pieces as Ollama produces them;
+    abort() may be called from any thread and closes the connection so Ollama stops generating.
+    `timeout` is a deadline for the whole call: requests only bounds each gap between chunks,
+    so a timer aborts the stream at the deadline and requests.exceptions.Timeout is raised.
+    """
+
+    def __init__(self, url: str, payload: dict, timeout: float, priority: str = None):
+        self.url = url
+        self.priority = priority
+        self.payload = {**payload, "stream": True}
+        self.timeout = timeout
+        self.response = None
+        self.parts = []
+        self.final = {}
+        self.ttft = None
+        self.aborted = False
+        self.timed_out = False
+        self._started = None
+
+    def __iter__(self):
+        if self.priority is None:
+            yield from self._stream()
+            return
+        # Standalone streams (not wrapped by get_response_with_stats) queue for a slot themselves
+        with llm_scheduler.slot(self.payload.get("model"), self.priority, self.timeout) as waited:
+            self.timeout = max(self.timeout - waited, 0.001)
+            yield from self._stream()
+
+    def _stream(self):
+        self._started = time.perf_counter()
+        timer = threading.Timer(self.timeout, self._expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            self.response = requests.post(
+                self.url, json=self.payload, stream=True, timeout=(LLM_CONNECT_TIMEOUT, self.timeout)
+            )
+            if self._stopped():
+                return
+            for line in self.response.iter_lines():
+                if self._stopped():
+                    return
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - self._started
+                piece = chunk.get("response", "")
+                self.parts.append(piece)
+                yield piece
+                if chunk.get("done"):
+                    self.final = chunk
+                    return
+            self._stopped()
+        except requests.exceptions.Timeout:
+            raise
+        except Exception:
+            if self.timed_out:
+                raise requests.exceptions.Timeout(f"LLM did not finish within {self.timeout}s") from None
+            if self.aborted:
+                return  # the connection was closed on purpose
+            raise
+        finally:
+            timer.cancel()
+            if self.response is not None:
+                self.response.close()
+
+    def _expire(self):
+        self.timed_out = True
+        self.abort()
+
+    def _stopped(self) -> bool:
+        """True once aborted; raises requests.exceptions.Timeout if the deadline did it"""
+        if self.timed_out:
+            raise requests.exceptions.Timeout(f"LLM did not finish within {self.timeout}s")
+        return self.aborted
+
+    def consume(self):
+        for _ in self:
+            pass
+        return self
+
+    def abort(self):
+        self.aborted = True
+        if self.response is not None:
+            self.response.close()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def stats(self) -> dict:
+        e2e = time.perf_counter() - self._started if self._started else 0.0
+        stats = extract_stats(self.final, self.ttft, e2e)
+        if self.aborted:
+            stats["aborted"] = True
+        return stats
+
+
+def get_response_with_stats(prompt: str, model: str = MODEL, timeout: float = None, cancel: CancelToken = None,
+                            priority: str = DEFAULT_PRIORITY):
+    """
+    Call Ollama and return (response text, timing stats); stats are also recorded per model.
+    `timeout` is the request deadline in seconds (LLM_TIMEOUT by default), including time spent
+    queued in the scheduler under `priority`; requests.exceptions.Timeout is raised when it is missed.
+    With a `cancel` token the call streams so it can be aborted mid-generation; an aborted
+    call returns the partial text with stats["aborted"] set.
+    """
+    timeout = timeout or LLM_TIMEOUT
+    try:
+        with llm_scheduler.slot(model, priority, timeout, cancel) as waited:
+            return _generate(prompt, model, max(timeout - waited, 0.001), cancel)
+    except QueueCancelled:
+        return "", {"aborted": True}
+    except requests.exceptions.Timeout:
+        LLM_TIMEOUTS.inc(model=model or "default")
+        raise
+
+
+def _generate(prompt: str, model: str, timeout: float, cancel: CancelToken = None):
     payload = {
         "model": model,
         "prompt": prompt,
         "stream": False  # stream=True if you want streaming responses
     }
-    response = requests.post(OLLAMA_API_URL, json=payload)
-    print("calling LLM: response = ", response)
+    if LLM_HEDGE_ENABLED and len(OLLAMA_BACKENDS) > 1:
+        return _hedged_generate(payload, timeout, cancel)
+    if cancel is not None:
+        generation = StreamingGeneration(OLLAMA_API_URL, payload, timeout)
+        cancel.register(generation.abort)
+        generation.consume()
+        stats = generation.stats()
+        observe_llm_call(model, stats)
+        return generation.text, stats
+
+    started = time.perf_counter()
+    response = requests.post(OLLAMA_API_URL, json=payload, timeout=(LLM_CONNECT_TIMEOUT, timeout))
     data = response.json()
-    return data.get("response", "")
+    # A non-streaming reply arrives all at once, so there is no time to first token to report
+    stats = extract_stats(data, None, time.perf_counter() - started)
+    observe_llm_call(model, stats)
+    return data.get("response", ""), stats
+
+
+def get_response(prompt: str, model: str = MODEL, timeout: float = None, priority: str = DEFAULT_PRIORITY) -> str:
+    text, _ = get_response_with_stats(prompt, model, timeout, priority=priority)
+    return text
+
+
+def open_generation(prompt: str, model: str = MODEL, timeout: float = None,
+                    priority: str = DEFAULT_PRIORITY) -> StreamingGeneration:
+    """Streaming call against OLLAMA_API_URL for routes that relay tokens to the client"""
+    return StreamingGeneration(OLLAMA_API_URL, {"model": model, "prompt": prompt}, timeout or LLM_TIMEOUT, priority)
+
+
+async def cancel_on_disconnect(call, is_disconnected, model: str = None, endpoint: str = "generate"):
+    """
+    Run `call(cancel_token)` in a worker thread and poll `is_disconnected()`
+    (e.g. Request.is_disconnected) while it runs. When the client goes away the token
+    is cancelled, which closes the upstream connection so Ollama stops generating.
+    Returns whatever `call` returns.
+    """
+    cancel = CancelToken()
+    task = asyncio.ensure_future(asyncio.to_thread(call, cancel))
+    while not task.done():
+        done, _ = await asyncio.wait({task}, timeout=LLM_DISCONNECT_POLL)
+        if not done and await is_disconnected():
+            cancel.cancel()
+            LLM_CANCELLED.inc(model=model or "default", endpoint=endpoint)
+            break
+    return await task
+
+
+# -------------------------------
+# Hedged requests
+# -------------------------------
+def hedge_delay(model: str) -> float:
+    """p95 time-to-first-token for the model, or LLM_HEDGE_DELAY until enough samples exist"""
+    p95 = LLM_TTFT_SECONDS.quantile(0.95, min_samples=LLM_HEDGE_MIN_SAMPLES, model=model or "default")
+    return p95 if p95 is not None else LLM_HEDGE_DELAY
+
+
+class _Attempt:
+    """One streaming generation in a hedged call; the first to produce a token wins."""
+
+    def __init__(self, url: str, payload: dict, timeout: float, race: "_Race", events: queue.Queue):
+        self.generation = StreamingGeneration(url, payload, timeout)
+        self.url = url
+        self.race = race
+        self.events = events
+
+    def run(self):
+        try:
+            for _ in self.generation:
+                if not self.race.claim(self):
+                    self.generation.abort()  # lost the race
+                    return
+        except Exception as e:
+            if self.race.winner is self:
+                raise  # surfaces through the winner's future
+            self.events.put(("failed", e))
+
+    def abort(self):
+        self.generation.abort()
+
+
+class _Race:
+    def __init__(self, events: queue.Queue):
+        self.events = events
+        self.winner = None
+        self._lock = threading.Lock()
+
+    def claim(self, attempt: _Attempt) -> bool:
+        with self._lock:
+            if self.winner is attempt:
+                return True
+            if self.winner is not None:
+                return False
+            self.winner = attempt
+        self.events.put(("won", attempt))
+        return True
+
+
+def _hedged_generate(payload: dict, timeout: float, cancel: CancelToken = None):
+    model = payload["model"]
+    deadline = time.monotonic() + timeout
+    started = time.perf_counter()
+    events = queue.Queue()
+    race = _Race(events)
+    attempts = {}
+
+    def launch(url):
+        attempt = _Attempt(url, payload, timeout, race, events)
+        attempts[attempt] = _executor.submit(attempt.run)
+
+    def abort_all():
+        for attempt in list(attempts):
+            attempt.abort()
+        events.put(("cancelled", None))
+
+    launch(OLLAMA_BACKENDS[0])
+    if cancel is not None:
+        cancel.register(abort_all)
+    hedge_at = time.monotonic() + hedge_delay(model)
+    failures = []
+
+    while race.winner is None and not (cancel and cancel.cancelled):
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wait_for = deadline - now
+        if len(attempts) == 1:
+            wait_for = min(wait_for, max(hedge_at - now, 0))
+        try:
+            kind, value = events.get(timeout=wait_for)
+        except queue.Empty:
+            if len(attempts) == 1 and time.monotonic() >= hedge_at:
+                launch(OLLAMA_BACKENDS[1])
+                LLM_HEDGED_REQUESTS.inc(model=model or "default")
+            continue
+        if kind == "failed":
+            failures.append(value)
+            if len(attempts) == 1:
+                launch(OLLAMA_BACKENDS[1])  # fail over right away instead of waiting for the hedge delay
+            elif len(failures) == len(attempts):
+                raise failures[0]
+
+    winner = race.winner
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.abort()
+
+    if winner is not None:
+        try:
+            attempts[winner].result(timeout=max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            winner.abort()
+            winner = None
+    if cancel and cancel.cancelled:
+        if winner is None:
+            return "", {"aborted": True}
+        return winner.generation.text, winner.generation.stats()
+    if winner is None:
+        raise requests.exceptions.Timeout(f"LLM did not answer within {timeout}s")
+
+    if winner.url != OLLAMA_BACKENDS[0]:
+        LLM_HEDGE_WINS.inc(model=model or "default")
+    generation = winner.generation
+    stats = extract_stats(generation.final, generation.ttft, time.perf_counter() - started)
+    stats["backend"] = winner.url
+    observe_llm_call(model, stats)
+    return generation.text, stats
@@ -0,0 +1,2 @@
+# Local load-test harness: fake Ollama and Keycloak servers, an in-memory Mongo stand-in
+# and a load generator. Run `python -m app.loadtest --help`.
@@ -0,0 +1,123 @@
+# fake_keycloak.py
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeKeycloak"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        base = f"/realms/{self.server.realm}/protocol/openid-connect"
+        if self.path == f"{base}/certs":
+            self._send_json({"keys": [self.server.public_jwk]})
+        elif self.path == f"{base}/userinfo":
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+            claims = jwt.get_unverified_claims(token)
+            self._send_json({"sub": claims["sub"], "preferred_username": claims["preferred_username"],
+                             "email_verified": True})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self.path != f"/realms/{self.server.realm}/protocol/openid-connect/token":
+            self._send_json({"error": "not found"}, status=404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        username = form.get("username")
+        if not username or not form.get("password"):
+            self._send_json({"error": "invalid_grant"}, status=401)
+            return
+        self._send_json({
+            "access_token": self.server.issue_token(username),
+            "refresh_token": uuid.uuid4().hex,
+            "token_type": "Bearer",
+            "expires_in": self.server.token_lifetime,
+        })
+
+    def _send_json(self, data: dict, status: int = 200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeKeycloak(ThreadingHTTPServer):
+    """
+    Keycloak stand-in for load tests: serves the realm JWKS, a password-grant token endpoint
+    (any username/password is accepted) and userinfo. Tokens are RS256-signed with a throwaway
+    key, so the app's real verify_token path runs unchanged.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, realm: str = "llm", audience: str = "account", host: str = "127.0.0.1", port: int = 0,
+                 token_lifetime: int = 3600):
+        super().__init__((host, port), _Handler)
+        self.realm = realm
+        self.audience = audience
+        self.token_lifetime = token_lifetime
+        self.kid = uuid.uuid4().hex
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._private_pem = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        public_pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        self.public_jwk = {**jwk.construct(public_pem, "RS256").to_dict(), "kid": self.kid, "use": "sig"}
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def issuer(self) -> str:
+        return f"{self.url}/realms/{self.realm}"
+
+    def issue_token(self, username: str, **claims) -> str:
+        now = int(time.time())
+        payload = {
+            "iss": self.issuer,
+            "aud": self.audience,
+            "sub": str(uuid.uuid5(uuid.NAMESPACE_DNS, username)),
+            "preferred_username": username,
+            "email_verified": True,
+            "iat": now,
+            "exp": now + self.token_lifetime,
+            **claims,
+        }
+        return jwt.encode(payload, self._private_pem, algorithm="RS256", headers={"kid": self.kid})
+
+    def handle_error(self, request, client_address):
+        pass  # clients dropping keep-alive connections at shutdown are expected
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name="fake-keycloak")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,187 @@
+# fake_ollama.py
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NS_PER_SECOND = 1_000_000_000
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")
+
+
+class FakeOllamaConfig:
+    """
+    Knobs for the fake server. `latency` is the time before the first token (reported as
+    load + prompt eval), `tokens_per_second` paces generation and `tokens` is the reply length.
+    """
+
+    def __init__(self, latency: float = 0.05, tokens_per_second: float = 100.0, tokens: int = 32,
+                 embedding_dims: int = 768, chunk_tokens: int = 1):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.embedding_dims = embedding_dims
+        self.chunk_tokens = max(chunk_tokens, 1)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeOllama"
+
+    def log_message(self, *args):
+        pass  # keep load-test output readable
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        routes = {
+            "/api/generate": self._generate,
+            "/api/chat": self._chat,
+            "/api/embeddings": self._embeddings,
+        }
+        handler = routes.get(self.path)
+        if handler is None:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+            return
+        self.server.count("requests")
+        handler(body)
+
+    # -------------------------------
+    # Endpoints
+    # -------------------------------
+    def _generate(self, body: dict):
+        self._reply(body, lambda piece: {"response": piece}, lambda text: {"response": text})
+
+    def _chat(self, body: dict):
+        self._reply(
+            body,
+            lambda piece: {"message": {"role": "assistant", "content": piece}},
+            lambda text: {"message": {"role": "assistant", "content": text}},
+        )
+
+    def _embeddings(self, body: dict):
+        time.sleep(self.server.config.latency)
+        seed = hashlib.sha256(str(body.get("prompt", "")).encode()).digest()
+        dims = self.server.config.embedding_dims
+        embedding = [(seed[i % len(seed)] - 128) / 128 for i in range(dims)]
+        self._send_json({"embedding": embedding})
+
+    # -------------------------------
+    # Helpers
+    # -------------------------------
+    def _reply(self, body: dict, chunk, final):
+        config = self.server.config
+        started = time.perf_counter()
+        time.sleep(config.latency)
+        prompt_eval = time.perf_counter() - started
+        pieces = [f"{WORDS[i % len(WORDS)]} " for i in range(config.tokens)]
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+        base = {"model": body.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+        if not body.get("stream", True):  # Ollama streams unless told otherwise
+            time.sleep(per_token * len(pieces))
+            self._send_json({**base, **final("".join(pieces)), "done": True,
+                             **self._counters(body, started, prompt_eval, len(pieces))})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(0, len(pieces), config.chunk_tokens):
+                group = pieces[i:i + config.chunk_tokens]
+                time.sleep(per_token * len(group))
+                self._write_chunk({**base, **chunk("".join(group)), "done": False})
+            self._write_chunk({**base, **chunk(""), "done": True,
+                               **self._counters(body, started, prompt_eval, len(pieces))})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.count("aborted")  # the client closed the stream mid-generation
+            self.close_connection = True
+
+    def _counters(self, body: dict, started: float, prompt_eval: float, eval_count: int) -> dict:
+        total = time.perf_counter() - started
+        prompt = body.get("prompt") or json.dumps(body.get("messages", []))
+        return {
+            "total_duration": int(total * NS_PER_SECOND),
+            "load_duration": 0,
+            "prompt_eval_count": max(len(prompt) // 4, 1),
+            "prompt_eval_duration": int(prompt_eval * NS_PER_SECOND),
+            "eval_count": eval_count,
+            "eval_duration": int(max(total - prompt_eval, 1e-9) * NS_PER_SECOND),
+        }
+
+    def _write_chunk(self, data: dict):
+        line = (json.dumps(data) + "\n").encode()
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, data: dict, status: int = 200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """
+    Ollama stand-in serving /api/generate, /api/chat and /api/embeddings with synthetic
+    text, Ollama's eval counters and configurable pacing. Use as a context manager:
+
+        with FakeOllama(FakeOllamaConfig(latency=0.2)) as ollama:
+            requests.post(f"{ollama.url}/api/generate", json={...})
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: FakeOllamaConfig = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeOllamaConfig()
+        self.counts = {"requests": 0, "aborted": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def handle_error(self, request, client_address):
+        pass  # clients dropping keep-alive connections at shutdown are expected
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name="fake-ollama")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fake Ollama server for local load tests")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per reply")
+    args = parser.parse_args()
+
+    server = FakeOllama(FakeOllamaConfig(args.latency, args.tokens_per_second, args.tokens), "0.0.0.0", args.port)
+    print(f"🦙 Fake Ollama listening on {server.url}")
+    server.serve_forever()
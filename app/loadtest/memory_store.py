@@ -0,0 +1,233 @@
+# memory_store.py
+import copy
+import importlib
+import threading
+from contextlib import contextmanager
+from bson import ObjectId
+
+ASCENDING, DESCENDING = 1, -1
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for field, cond in query.items():
+        if field == "$or":
+            if not any(_matches(doc, branch) for branch in cond):
+                return False
+            continue
+        value = doc.get(field)
+        values = value if isinstance(value, list) else [value]  # array fields match element-wise
+        if not isinstance(cond, dict):
+            if value != cond and cond not in values:
+                return False
+            continue
+        for op, arg in cond.items():
+            if op == "$ne" and value == arg:
+                return False
+            if op == "$in" and not any(v in arg for v in values):
+                return False
+            if op == "$nin" and any(v in arg for v in values):
+                return False
+            if op == "$exists" and (field in doc) != bool(arg):
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if op == "$gt" and not value > arg:
+                    return False
+                if op == "$gte" and not value >= arg:
+                    return False
+                if op == "$lt" and not value < arg:
+                    return False
+                if op == "$lte" and not value <= arg:
+                    return False
+    return True
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MemoryCursor:
+    def __init__(self, docs: list):
+        self._docs = docs
+        self._limit = 0
+
+    def sort(self, key, direction=ASCENDING):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (d.get(field) is not None, d.get(field)), reverse=order == DESCENDING)
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def __iter__(self):
+        docs = self._docs[:self._limit] if self._limit else self._docs
+        return iter(docs)
+
+
+class MemoryCollection:
+    """
+    Thread-safe in-memory stand-in for the pymongo collection methods chat_history uses.
+    Only for load tests: it removes Mongo from the measurement so the app's own overhead shows.
+    """
+
+    def __init__(self):
+        self._docs = []
+        self._lock = threading.Lock()
+
+    def insert_one(self, doc: dict):
+        doc.setdefault("_id", ObjectId())
+        with self._lock:
+            self._docs.append(copy.copy(doc))
+        return _Result(inserted_id=doc["_id"])
+
+    def insert_many(self, docs: list, ordered: bool = True):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        with self._lock:
+            self._docs.extend(copy.copy(d) for d in docs)
+        return _Result(inserted_ids=[d["_id"] for d in docs])
+
+    def find(self, query: dict = None, projection: dict = None):
+        with self._lock:
+            docs = [copy.copy(d) for d in self._docs if _matches(d, query or {})]
+        if projection:
+            keep = {k for k, v in projection.items() if v} | {"_id"}
+            docs = [{k: v for k, v in d.items() if k in keep} for d in docs]
+        return MemoryCursor(docs)
+
+    def find_one(self, query: dict = None, projection: dict = None):
+        return next(iter(self.find(query, projection)), None)
+
+    def distinct(self, field: str, query: dict = None) -> list:
+        with self._lock:
+            return list(dict.fromkeys(d.get(field) for d in self._docs if _matches(d, query or {})))
+
+    def count_documents(self, query: dict) -> int:
+        with self._lock:
+            return sum(1 for d in self._docs if _matches(d, query))
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        with self._lock:
+            doc = next((d for d in self._docs if _matches(d, query)), None)
+            if doc is None:
+                if not upsert:
+                    return _Result(matched_count=0, modified_count=0, upserted_id=None)
+                doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+                doc.setdefault("_id", ObjectId())
+                doc.update(update.get("$setOnInsert", {}))
+                self._docs.append(doc)
+            doc.update(update.get("$set", {}))
+            for field in update.get("$unset", {}):
+                doc.pop(field, None)
+            for field, amount in update.get("$inc", {}).items():
+                doc[field] = doc.get(field, 0) + amount
+            return _Result(matched_count=1, modified_count=1, upserted_id=doc["_id"])
+
+    def delete_many(self, query: dict):
+        with self._lock:
+            before = len(self._docs)
+            self._docs = [d for d in self._docs if not _matches(d, query)]
+            return _Result(deleted_count=before - len(self._docs))
+
+    def create_index(self, keys, **kwargs):
+        keys = keys if isinstance(keys, list) else [(keys, ASCENDING)]
+        return "_".join(f"{k}_{v}" for k, v in keys)
+
+
+class AsyncMemoryCursor:
+    def __init__(self, cursor: MemoryCursor):
+        self._cursor = cursor
+
+    def sort(self, key, direction=ASCENDING):
+        self._cursor.sort(key, direction)
+        return self
+
+    def limit(self, n: int):
+        self._cursor.limit(n)
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    async def to_list(self, length=None):
+        docs = list(self._cursor)
+        return docs[:length] if length else docs
+
+    async def __aiter__(self):
+        for doc in self._cursor:
+            yield doc
+
+
+class AsyncMemoryCollection:
+    """Async view (AsyncCollection-style awaitables) over the same in-memory documents"""
+
+    def __init__(self, collection: MemoryCollection):
+        self.sync = collection
+
+    async def insert_one(self, doc: dict):
+        return self.sync.insert_one(doc)
+
+    async def insert_many(self, docs: list, ordered: bool = True):
+        return self.sync.insert_many(docs, ordered)
+
+    def find(self, query: dict = None, projection: dict = None):
+        return AsyncMemoryCursor(self.sync.find(query, projection))
+
+    async def find_one(self, query: dict = None, projection: dict = None):
+        return self.sync.find_one(query, projection)
+
+    async def count_documents(self, query: dict) -> int:
+        return self.sync.count_documents(query)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        return self.sync.update_one(query, update, upsert)
+
+    async def delete_many(self, query: dict):
+        return self.sync.delete_many(query)
+
+
+# Where the app binds each MongoDB collection at import time: (sync names, async names).
+# A new collection is registered here once; the test suite (app/tests/conftest.py) and the
+# load-test server both swap collections through memory_collections().
+BINDINGS = {
+    "chats": (["app.chat_history.chats", "app.archive.chats", "app.search.chats"],
+              ["app.async_chat_history.async_chats"]),
+    "purges": (["app.chat_history.purges"], ["app.async_chat_history.async_purges"]),
+    "conversations": ([], ["app.conversations.async_conversations"]),
+    "search_terms": (["app.chat_history.search_terms", "app.search.search_terms"],
+                     ["app.async_chat_history.async_search_terms"]),
+    "segments": (["app.archive.segments"], ["app.async_chat_history.async_segments"]),
+    "summaries": (["app.chat_history.summaries"], ["app.async_chat_history.async_summaries"]),
+}
+
+
+@contextmanager
+def memory_collections(*names):
+    """
+    Bind a fresh in-memory store for each named collection (all of BINDINGS by default)
+    everywhere the app imported it. Yields {name: MemoryCollection}; the originals are
+    restored on exit.
+    """
+    stores = {name: MemoryCollection() for name in names or BINDINGS}
+    saved = []
+    try:
+        for name, store in stores.items():
+            sync_names, async_names = BINDINGS[name]
+            values = [(target, store) for target in sync_names]
+            values += [(target, AsyncMemoryCollection(store)) for target in async_names]
+            for target, value in values:
+                module_name, attribute = target.rsplit(".", 1)
+                module = importlib.import_module(module_name)
+                saved.append((module, attribute, getattr(module, attribute)))
+                setattr(module, attribute, value)
+        yield stores
+    finally:
+        for module, attribute, value in reversed(saved):
+            setattr(module, attribute, value)
@@ -0,0 +1,236 @@
+# run.py
+"""
+Load generator for the FastAPI app. By default it starts a fake Ollama, a fake Keycloak and
+the app itself (history kept in memory) and drives /login, /chat, /generate and /history with
+concurrent virtual users, then reports throughput and p50/p95/p99 latency per endpoint.
+
+    python -m app.loadtest --users 50 --duration 30 --ollama-latency 0.2 --tokens 64
+    python -m app.loadtest --target http://localhost:8000   # existing deployment
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import httpx
+from .fake_keycloak import FakeKeycloak
+from .fake_ollama import FakeOllama, FakeOllamaConfig
+
+DEFAULT_MIX = {"chat": 4, "generate": 4, "history": 2}
+PROMPTS = (
+    "Hi there!",
+    "Summarise the plot of Hamlet in two sentences.",
+    "What is the capital of Australia?",
+    "Explain the difference between a process and a thread.",
+)
+
+
+def percentile(samples: list, q: float):
+    """Nearest-rank percentile of `samples` (q in 0..100), or None when empty"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class LoadReport:
+    """Per-endpoint latencies and error counts collected during a run"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, endpoint: str, seconds: float, ok: bool = True):
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            endpoint: {
+                "requests": len(samples),
+                "errors": self.errors[endpoint],
+                "rps": len(samples) / elapsed if elapsed > 0 else 0.0,
+                "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95),
+                "p99": percentile(samples, 99),
+            }
+            for endpoint, samples in sorted(self.latencies.items())
+        }
+
+    def render(self) -> str:
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.1f}"
+
+        lines = [f"{'endpoint':<20}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for endpoint, row in self.summary().items():
+            lines.append(
+                f"{endpoint:<20}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9.1f}"
+                f"{ms(row['p50']):>10}{ms(row['p95']):>10}{ms(row['p99']):>10}"
+            )
+        return "\n".join(lines)
+
+
+async def _timed(report: LoadReport, endpoint: str, request):
+    started = time.perf_counter()
+    try:
+        response = await request()
+        ok = response.status_code < 400
+        return response if ok else None
+    except httpx.HTTPError:
+        ok = False
+        return None
+    finally:
+        report.record(endpoint, time.perf_counter() - started, ok)
+
+
+async def _stream(client: httpx.AsyncClient, url: str, **kwargs):
+    async with client.stream("POST", url, **kwargs) as response:
+        async for _ in response.aiter_lines():
+            pass
+        return response
+
+
+async def virtual_user(client: httpx.AsyncClient, name: str, deadline: float, report: LoadReport,
+                       mix: dict = None, model: str = None, stream_ratio: float = 0.0, seed: int = None):
+    """Log in once, then issue a weighted mix of requests until `deadline` (perf_counter)"""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    login = await _timed(report, "/login", lambda: client.post("/login", json={"username": name, "password": "x"}))
+    if login is None:
+        return
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    endpoints, weights = zip(*mix.items())
+
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        prompt = rng.choice(PROMPTS)
+        if endpoint == "chat":
+            body = {"prompt": prompt, "model": model}
+            await _timed(report, "/chat", lambda: client.post("/chat", json=body, headers=headers))
+        elif endpoint == "generate" and rng.random() < stream_ratio:
+            body = {"text": prompt, "model": model, "stream": True}
+            await _timed(report, "/generate (stream)",
+                         lambda: _stream(client, "/generate", json=body, headers=headers))
+        elif endpoint == "generate":
+            body = {"text": prompt, "model": model}
+            await _timed(report, "/generate", lambda: client.post("/generate", json=body, headers=headers))
+        elif endpoint == "history":
+            await _timed(report, "/history", lambda: client.get("/history", headers=headers))
+
+
+async def run_load(base_url: str, users: int = 10, duration: float = 10.0, mix: dict = None, model: str = None,
+                   stream_ratio: float = 0.0, timeout: float = 120.0) -> LoadReport:
+    report = LoadReport()
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        await asyncio.gather(*(
+            virtual_user(client, f"load_user_{i}", deadline, report, mix, model, stream_ratio, seed=i)
+            for i in range(users)
+        ))
+    report.finished = time.perf_counter()
+    return report
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def local_stack(ollama_config: FakeOllamaConfig = None, model: str = "llama3.2", startup_timeout: float = 60.0):
+    """Fake Ollama + fake Keycloak in this process, the app in a subprocess; yields the app URL"""
+    with FakeOllama(ollama_config) as ollama, FakeKeycloak() as keycloak:
+        host, port = keycloak.server_address[:2]
+        app_port = _free_port()
+        env = {
+            **os.environ,
+            "OLLAMA_API_URL": f"{ollama.url}/api/generate",
+            "KEYCLOAK_HOST": host,
+            "KEYCLOAK_PORT": str(port),
+            "KEYCLOAK_REALM": keycloak.realm,
+            "AUDIENCE": keycloak.audience,
+            "CLIENT_ID": "loadtest",
+            "CLIENT_SECRET": "loadtest",
+            "MONGO_HOST": os.getenv("MONGO_HOST") or "127.0.0.1",  # never contacted, history is in memory
+            "MONGO_DB": os.getenv("MONGO_DB") or "loadtest",
+            "MODEL": model,
+            "MONGO_ENSURE_INDEXES": "false",
+        }
+        process = subprocess.Popen(
+            [sys.executable, "-m", "app.loadtest.server", "--port", str(app_port)], env=env
+        )
+        base_url = f"http://127.0.0.1:{app_port}"
+        try:
+            started = time.monotonic()
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("App exited during startup")
+                try:
+                    if httpx.get(f"{base_url}/secure-endpoint", timeout=1).status_code in (401, 403):
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() - started > startup_timeout:
+                    raise RuntimeError(f"App did not start within {startup_timeout}s")
+                time.sleep(0.2)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+def parse_mix(value: str) -> dict:
+    """"chat=4,generate=4,history=2" -> weights per endpoint"""
+    mix = {}
+    for pair in value.split(","):
+        name, _, weight = pair.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}'")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test /login, /chat, /generate and /history")
+    parser.add_argument("--target", help="base URL of a running app (default: start a local stack with fakes)")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="weights, e.g. chat=4,generate=4,history=2")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="share of /generate calls that stream")
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--ollama-latency", type=float, default=0.05, help="fake Ollama seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per fake reply")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    def run(base_url):
+        return asyncio.run(run_load(base_url, args.users, args.duration, args.mix, args.model, args.stream_ratio))
+
+    if args.target:
+        report = run(args.target)
+    else:
+        config = FakeOllamaConfig(args.ollama_latency, args.tokens_per_second, args.tokens)
+        with local_stack(config, args.model) as base_url:
+            report = run(base_url)
+
+    print(json.dumps(report.summary(), indent=2) if args.json else report.render())
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+# server.py
+"""
+Runs the real FastAPI app under uvicorn with chat history kept in memory.
+Started by the load generator in its own process; point OLLAMA_API_URL and
+KEYCLOAK_HOST/KEYCLOAK_PORT at the fake servers before launching.
+"""
+import argparse
+import uvicorn
+from .memory_store import memory_collections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastAPI app with an in-memory Mongo stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    with memory_collections():
+        from ..app import app
+
+        uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
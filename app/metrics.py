@@ -0,0 +1,173 @@
+# metrics.py
+import threading
+from collections import defaultdict, deque
+
+# Seconds buckets cover sub-second cache hits up to multi-minute generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+REGISTRY = []
+
+
+def _label_str(labels: tuple) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class Histogram:
+    """
+    Minimal Prometheus-style histogram keyed by label values.
+    Also keeps a short window of raw samples so callers can ask for quantiles.
+    """
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, window: int = 512):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._sums = defaultdict(float)
+        self._recent = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._counts[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] += value
+            self._recent[key].append(value)
+
+    def quantile(self, q: float, min_samples: int = 1, **labels):
+        """Quantile over the recent window, or None if there are fewer than min_samples"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = sorted(self._recent.get(key, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = _label_str(key)
+                sep = "," if labels else ""
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+                cumulative += counts[-1]
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {self._sums[key]}")
+                lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{{{_label_str(key)}}} {value}")
+        return lines
+
+
+class Gauge:
+    """Point-in-time value keyed by label values"""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{{{_label_str(key)}}} {value}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition of every registered metric"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------
+# LLM metrics (per model)
+# -------------------------------
+LLM_TTFT_SECONDS = Histogram("llm_ttft_seconds", "Client-side time to first token from Ollama (streaming calls only)")
+LLM_E2E_SECONDS = Histogram("llm_e2e_seconds", "Client-side end-to-end LLM call time")
+LLM_LOAD_SECONDS = Histogram("llm_load_seconds", "Ollama model load time (load_duration)")
+LLM_PROMPT_EVAL_SECONDS = Histogram("llm_prompt_eval_seconds", "Ollama prompt evaluation time (prompt_eval_duration)")
+LLM_PROMPT_TOKENS = Histogram("llm_prompt_tokens", "Prompt tokens evaluated (prompt_eval_count)", TOKEN_BUCKETS)
+LLM_TOKENS_PER_SECOND = Histogram("llm_tokens_per_second", "Generation speed (eval_count / eval_duration)", RATE_BUCKETS)
+LLM_HEDGED_REQUESTS = Counter("llm_hedged_requests_total", "Duplicate requests sent to a second backend")
+LLM_HEDGE_WINS = Counter("llm_hedge_wins_total", "Hedged calls won by the duplicate request")
+LLM_TIMEOUTS = Counter("llm_timeouts_total", "LLM calls that missed their deadline")
+LLM_QUEUE_WAIT_SECONDS = Histogram("llm_queue_wait_seconds", "Time spent waiting for a generation slot")
+LLM_ROUTED = Counter("llm_routed_total", "Requests with model \"auto\" by chosen model and routing reason")
+LLM_CANCELLED = Counter("llm_cancelled_total", "LLM generations aborted because the client disconnected")
+
+
+# -------------------------------
+# Chat history metrics
+# -------------------------------
+HISTORY_WRITE_BEHIND_FLUSHED = Counter("history_write_behind_flushed_total", "Documents written by a write-behind buffer (chat_history messages or search_terms entries)")
+HISTORY_WRITE_BEHIND_FALLBACKS = Counter("history_write_behind_fallbacks_total", "Writes done synchronously because a write-behind buffer was full")
+HISTORY_WRITE_BEHIND_DROPPED = Counter("history_write_behind_dropped_total", "Buffered documents never written: rejected by MongoDB or still unwritten when the buffer was closed")
+HISTORY_CACHE_HITS = Counter("history_cache_hits_total", "Recent-history reads served from the hot cache")
+HISTORY_CACHE_MISSES = Counter("history_cache_misses_total", "Recent-history reads that went to MongoDB")
+HISTORY_CACHE_USERS_GAUGE = Gauge("history_cache_users", "Users held in the hot-history cache")
+HISTORY_CACHE_BYTES = Gauge("history_cache_bytes", "Approximate memory held by the hot-history cache")
+
+
+def observe_llm_call(model: str, stats: dict):
+    """Record one LLM call's timings; missing Ollama counters are skipped"""
+    model = model or "default"
+    for histogram, key in (
+        (LLM_TTFT_SECONDS, "ttft"),
+        (LLM_E2E_SECONDS, "e2e"),
+        (LLM_LOAD_SECONDS, "load_duration"),
+        (LLM_PROMPT_EVAL_SECONDS, "prompt_eval_duration"),
+        (LLM_PROMPT_TOKENS, "prompt_eval_count"),
+        (LLM_TOKENS_PER_SECOND, "tokens_per_second"),
+    ):
+        if stats.get(key) is not None:
+            histogram.observe(stats[key], model=model)
@@ -0,0 +1,29 @@
+# retention.py
+from datetime import datetime, timedelta
+from .settings import HISTORY_RETENTION_DAYS, HISTORY_RETENTION_ROLES, HISTORY_RETENTION_USERS
+
+
+def retention_days(user: dict, default: float = None, roles: dict = None, users: dict = None) -> float:
+    """
+    Days to keep this user's messages (0 = forever): a per-user override wins, then the
+    first configured role the token carries, then HISTORY_RETENTION_DAYS.
+    """
+    users = HISTORY_RETENTION_USERS if users is None else users
+    roles = HISTORY_RETENTION_ROLES if roles is None else roles
+    username = (user or {}).get("preferred_username")
+    if username in users:
+        return users[username]
+
+    granted = set(((user or {}).get("realm_access") or {}).get("roles", []))
+    for role, days in roles.items():
+        if role in granted:
+            return days
+    return HISTORY_RETENTION_DAYS if default is None else default
+
+
+def message_expiry(user: dict, now: datetime = None, **overrides):
+    """`expires_at` for messages written now (naive UTC like `timestamp`), or None to keep forever"""
+    days = retention_days(user, **overrides)
+    if days <= 0:
+        return None
+    return (now or datetime.utcnow()) + timedelta(days=days)
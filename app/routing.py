@@ -0,0 +1,46 @@
+# routing.py
+from .settings import (
+    ROUTER_SMALL_MODEL, ROUTER_LARGE_MODEL, ROUTER_TOKEN_THRESHOLD,
+    ROUTER_COMPLEX_MARKERS, ROUTER_USER_MODELS,
+)
+from .metrics import LLM_ROUTED
+
+AUTO_MODEL = "auto"
+
+# Markers the UI and /upload-file put in front of extracted document text
+ATTACHMENT_MARKERS = ("📄 [Attached File:", "[PDF Uploaded:")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def route_model(text: str, user: dict = None, has_file: bool = None):
+    """
+    Pick a model for `model: "auto"`. Returns (model, route) where `route` records
+    the decision (reason and estimated prompt tokens) for history and metrics.
+    Rules, first match wins: per-user override (`llm_model` token claim or
+    ROUTER_USER_MODELS), attached document, prompt longer than ROUTER_TOKEN_THRESHOLD,
+    complexity marker, otherwise the small model.
+    """
+    tokens = estimate_tokens(text)
+    if has_file is None:
+        has_file = any(marker in text for marker in ATTACHMENT_MARKERS)
+    lowered = text.lower()
+
+    user = user or {}
+    override = user.get("llm_model") or ROUTER_USER_MODELS.get(user.get("preferred_username"))
+    if override:
+        model, reason = override, "user_override"
+    elif has_file:
+        model, reason = ROUTER_LARGE_MODEL, "attachment"
+    elif tokens > ROUTER_TOKEN_THRESHOLD:
+        model, reason = ROUTER_LARGE_MODEL, "long_prompt"
+    elif any(marker in lowered for marker in ROUTER_COMPLEX_MARKERS):
+        model, reason = ROUTER_LARGE_MODEL, "complex_prompt"
+    else:
+        model, reason = ROUTER_SMALL_MODEL, "short_prompt"
+
+    LLM_ROUTED.inc(model=model or "default", reason=reason)
+    return model, {"requested": AUTO_MODEL, "reason": reason, "estimated_tokens": tokens}
@@ -0,0 +1,131 @@
+# scheduler.py
+import itertools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import requests
+from .settings import LLM_MAX_CONCURRENCY, LLM_PRIORITY_AGING, LLM_PRIORITY_ROLES
+from .metrics import LLM_QUEUE_WAIT_SECONDS
+
+# Lower value = served first
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1, "background": 2}
+DEFAULT_PRIORITY = "interactive"
+
+
+class QueueCancelled(Exception):
+    """The caller cancelled while still waiting for an LLM slot"""
+
+
+class _Ticket:
+    __slots__ = ("priority", "enqueued", "seq")
+
+    def __init__(self, priority: str, seq: int):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.seq = seq
+
+
+class LLMScheduler:
+    """
+    Per-model admission control for Ollama. At most `max_concurrency` generations run per
+    model; waiting callers are admitted by priority class, and every `aging_seconds` spent
+    in the queue promotes a waiter by one class so background work is never starved.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, aging_seconds: float = LLM_PRIORITY_AGING):
+        self.max_concurrency = max_concurrency
+        self.aging_seconds = aging_seconds
+        self._cond = threading.Condition()
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(list)
+        self._seq = itertools.count()
+
+    def _rank(self, ticket: _Ticket, now: float):
+        waited = now - ticket.enqueued
+        aged = waited / self.aging_seconds if self.aging_seconds > 0 else 0
+        return (PRIORITY_CLASSES[ticket.priority] - aged, ticket.seq)
+
+    def _is_next(self, model: str, ticket: _Ticket) -> bool:
+        if self._running[model] >= self.max_concurrency:
+            return False
+        now = time.monotonic()
+        return min(self._waiting[model], key=lambda t: self._rank(t, now)) is ticket
+
+    @contextmanager
+    def slot(self, model: str, priority: str = DEFAULT_PRIORITY, timeout: float = None, cancel=None):
+        """
+        Hold one generation slot for `model`; yields the seconds spent queueing.
+        Raises requests.exceptions.Timeout if no slot frees up within `timeout`,
+        or QueueCancelled if `cancel` (a llm.CancelToken) fires while waiting.
+        """
+        model = model or "default"
+        priority = priority if priority in PRIORITY_CLASSES else DEFAULT_PRIORITY
+        if self.max_concurrency <= 0:
+            yield 0.0
+            return
+
+        ticket = _Ticket(priority, next(self._seq))
+        deadline = ticket.enqueued + timeout if timeout else None
+        if cancel is not None:
+            cancel.register(self._wake)
+
+        with self._cond:
+            self._waiting[model].append(ticket)
+            try:
+                while not self._is_next(model, ticket):
+                    if cancel is not None and cancel.cancelled:
+                        raise QueueCancelled()
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        raise requests.exceptions.Timeout(f"No {model} slot within {timeout}s")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiting[model].remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._waiting[model].remove(ticket)
+            self._running[model] += 1
+            self._cond.notify_all()  # let the next waiter claim any other free slot
+
+        waited = time.monotonic() - ticket.enqueued
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, model=model, priority=priority)
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._running[model] -= 1
+                self._cond.notify_all()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        """Running and queued generations per model"""
+        with self._cond:
+            models = set(self._running) | set(self._waiting)
+            return {
+                model: {"running": self._running[model], "queued": len(self._waiting[model])}
+                for model in models
+            }
+
+
+llm_scheduler = LLMScheduler()
+
+
+def resolve_priority(user: dict, declared: str = DEFAULT_PRIORITY, role_overrides: dict = None) -> str:
+    """
+    Priority class for a request. Endpoints declare their class; Keycloak admins can override it
+    per user with an `llm_priority` attribute mapped into the token, or per realm role through
+    LLM_PRIORITY_ROLES (first matching role wins, in configured order).
+    """
+    claim = (user or {}).get("llm_priority")
+    if claim in PRIORITY_CLASSES:
+        return claim
+
+    roles = set(((user or {}).get("realm_access") or {}).get("roles", []))
+    for role, priority in (role_overrides if role_overrides is not None else LLM_PRIORITY_ROLES).items():
+        if role in roles and priority in PRIORITY_CLASSES:
+            return priority
+    return declared
@@ -0,0 +1,137 @@
+# search.py
+"""
+Blind keyword index for encrypted chat history.
+
+Each message's words are normalised (case-folded, accents stripped) and HMAC'd with a
+per-deployment key and the owner's username. The truncated digests are stored in
+`search_terms`, one document per message:
+
+    {"_id": <message id>, "username", "timestamp", "terms": [16-byte digests], "conversation_id"?}
+
+A search hashes the query words the same way and finds candidates with one indexed query
+on (username, terms, timestamp); the database never sees a word. Only the best-ranked
+candidates are decrypted. Messages saved before the index existed are added with
+
+    python -m app.search [--username alice]
+"""
+import base64
+import hashlib
+import hmac
+import re
+import unicodedata
+from pymongo import ReplaceOne
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from .settings import ENCRYPTION_KEY, SEARCH_INDEX_KEY, SEARCH_MAX_TERMS
+from .db import chats, search_terms
+
+DIGEST_SIZE = 16
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it me my of on or so that the this to was "
+    "we were what with you your".split()
+)
+_WORD = re.compile(r"\w+")
+
+
+def index_key(secret: str = SEARCH_INDEX_KEY) -> bytes:
+    """HMAC key: SEARCH_INDEX_KEY, or one derived from ENCRYPTION_KEY (independent of the cipher keys)"""
+    if secret:
+        return base64.urlsafe_b64decode(secret + "=" * (-len(secret) % 4))
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"chat-history blind index")
+    return hkdf.derive(ENCRYPTION_KEY.encode())
+
+
+_KEY = index_key()
+
+
+def normalize_terms(text: str, max_terms: int = SEARCH_MAX_TERMS) -> list:
+    """Distinct searchable words in first-seen order: case-folded, accents stripped, stopwords dropped"""
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    terms = {}
+    for word in _WORD.findall(folded):
+        if len(word) > 1 and word not in STOPWORDS:
+            terms.setdefault(word, None)
+            if len(terms) >= max_terms:
+                break
+    return list(terms)
+
+
+def blind_terms(username: str, terms: list, key: bytes = None) -> list:
+    """Keyed digests of `terms`; the username is mixed in so equal words differ between users"""
+    key = key or _KEY
+    prefix = username.encode() + b"\x00"
+    return [hmac.new(key, prefix + term.encode(), hashlib.sha256).digest()[:DIGEST_SIZE] for term in terms]
+
+
+def term_docs(docs: list, messages: list) -> list:
+    """search_terms documents for freshly built message documents (which need their `_id` set)"""
+    out = []
+    for doc, message in zip(docs, messages):
+        terms = normalize_terms(message["content"])
+        if not terms:
+            continue
+        entry = {"_id": doc["_id"], "username": doc["username"], "timestamp": doc["timestamp"],
+                 "terms": blind_terms(doc["username"], terms)}
+        for field in ("conversation_id", "expires_at"):
+            if doc.get(field):
+                entry[field] = doc[field]
+        out.append(entry)
+    return out
+
+
+def candidate_query(username: str, digests: list, conversation_id: str = None) -> dict:
+    query = {"username": username, "terms": {"$in": digests}}
+    if conversation_id:
+        query["conversation_id"] = conversation_id
+    return query
+
+
+def rank_hits(hits: list, digests: list, limit: int) -> list:
+    """
+    [(message id, score)] for the best `limit` hits: the share of query words a message
+    contains, newest first among equal scores.
+    """
+    wanted = set(digests)
+    scored = [(len(wanted.intersection(hit["terms"])) / len(wanted), hit["timestamp"], hit["_id"]) for hit in hits]
+    scored.sort(key=lambda s: (s[0], s[1]), reverse=True)
+    return [(_id, score) for score, _, _id in scored[:limit]]
+
+
+# -------------------------------
+# Backfill
+# -------------------------------
+def backfill(username: str = None, batch_size: int = 500) -> int:
+    """Index messages stored before the blind index was enabled (idempotent). Returns the count indexed."""
+    from .chat_history import decode_messages
+
+    query = {"timestamp": {"$ne": None}}
+    if username:
+        query["username"] = username
+    indexed = 0
+    batch = []
+    for doc in chats.find(query).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            indexed += upsert_entries(batch, decode_messages(batch))
+            batch = []
+    if batch:
+        indexed += upsert_entries(batch, decode_messages(batch))
+    return indexed
+
+
+def upsert_entries(docs: list, messages: list) -> int:
+    entries = term_docs(docs, messages)
+    if entries:
+        search_terms.bulk_write([ReplaceOne({"_id": e["_id"]}, e, upsert=True) for e in entries], ordered=False)
+    return len(entries)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Add existing messages to the /history/search blind index")
+    parser.add_argument("--username", help="only this user's messages")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    print(f"✅ Indexed {backfill(args.username, args.batch_size)} messages")
@@ -59,6 +59,52 @@ RESEND_URL = RESEND_VERIFY_URL  # alias
 # LLM
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL")
 MODEL = os.getenv("MODEL")
+# Store Ollama timing counters (ttft, eval_count, ...) with assistant messages
+LLM_STORE_STATS = os.getenv("LLM_STORE_STATS", "False").lower() in ("true", "1", "yes")
+
+# Per-request LLM deadline in seconds; clients may ask for another value with the
+# X-Request-Timeout header, capped at LLM_MAX_TIMEOUT
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+LLM_MAX_TIMEOUT = float(os.getenv("LLM_MAX_TIMEOUT", 300))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+# How often (seconds) async routes check whether the client is still connected
+LLM_DISCONNECT_POLL = float(os.getenv("LLM_DISCONNECT_POLL", 0.25))
+
+# Hedged requests: with 2+ backends, send a duplicate to the second one when the
+# first has not produced a token within the model's p95 TTFT (LLM_HEDGE_DELAY until
+# LLM_HEDGE_MIN_SAMPLES calls have been observed)
+OLLAMA_BACKENDS = [u.strip() for u in os.getenv("OLLAMA_BACKENDS", "").split(",") if u.strip()]
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "False").lower() in ("true", "1", "yes")
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 2.0))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+
+# Scheduler: concurrent generations per model (0 = unlimited) and seconds of queueing
+# that promote a waiting request by one priority class (interactive > batch > background)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+LLM_PRIORITY_AGING = float(os.getenv("LLM_PRIORITY_AGING", 10))
+# Realm role -> priority class overrides, e.g. "bulk_user=background,premium=interactive"
+LLM_PRIORITY_ROLES = dict(
+    pair.strip().split("=", 1) for pair in os.getenv("LLM_PRIORITY_ROLES", "").split(",") if "=" in pair
+)
+
+# /generate/batch: prompts per request and worker threads shared by all batches
+# (per-model limits still come from LLM_MAX_CONCURRENCY)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+
+# Model routing for `model: "auto"`: short prompts go to the small model, long prompts,
+# attachments and prompts with complexity markers go to the large one
+ROUTER_SMALL_MODEL = os.getenv("ROUTER_SMALL_MODEL") or MODEL
+ROUTER_LARGE_MODEL = os.getenv("ROUTER_LARGE_MODEL") or MODEL
+ROUTER_TOKEN_THRESHOLD = int(os.getenv("ROUTER_TOKEN_THRESHOLD", 512))
+ROUTER_COMPLEX_MARKERS = [
+    m.strip().lower() for m in os.getenv("ROUTER_COMPLEX_MARKERS", "```,step by step,prove,refactor,debug").split(",")
+    if m.strip()
+]
+# Per-user model pinned for "auto", e.g. "alice=llama3.1:70b,bob=phi3"
+ROUTER_USER_MODELS = dict(
+    pair.strip().split("=", 1) for pair in os.getenv("ROUTER_USER_MODELS", "").split(",") if "=" in pair
+)
 
 # MongoDB Collection encryption
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
@@ -68,3 +114,91 @@ if not ENCRYPTION_KEY:
     ENCRYPTION_KEY = Fernet.generate_key().decode()
 
 fernet = Fernet(ENCRYPTION_KEY)
+
+# Cipher for new messages: "aesgcm" (raw binary, default) or "fernet" (base64 text, readable by
+# older releases). Reads accept both, so switching needs no migration.
+MESSAGE_CIPHER = os.getenv("MESSAGE_CIPHER", "aesgcm").lower()
+# Extra AES-GCM keys as "id:base64key,..." (32-byte keys) and the id used for new writes.
+# Key "k0" is always derived from ENCRYPTION_KEY; keep retired keys listed until nothing uses them.
+MESSAGE_KEYS = os.getenv("MESSAGE_KEYS", "")
+MESSAGE_KEY_ID = os.getenv("MESSAGE_KEY_ID", "k0")
+
+# --- Chat history compaction ---
+# Once a user has more than HISTORY_COMPACT_THRESHOLD unsummarised messages, the
+# older ones are folded into a per-user summary; /chat sends the summary plus the
+# last HISTORY_RECENT_TURNS messages.
+HISTORY_COMPACT_THRESHOLD = int(os.getenv("HISTORY_COMPACT_THRESHOLD", 40))
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", 10))
+# /history page size (default and upper bound for ?limit=)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", 200))
+
+# --- Idempotency keys ---
+# Replies to requests carrying an Idempotency-Key header are kept this many seconds,
+# so client/proxy retries of /generate and /chat reuse the first result
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 3600))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000))
+
+# --- Write-behind history buffer (optional) ---
+# Messages are acknowledged once queued in memory and written by a background thread
+# in batches of WRITE_BEHIND_BATCH_SIZE or every WRITE_BEHIND_FLUSH_INTERVAL seconds.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "False").lower() in ("true", "1", "yes")
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", 10000))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 200))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 0.1))
+
+# --- Hot-history cache ---
+# Last HISTORY_CACHE_MESSAGES decrypted messages for up to HISTORY_CACHE_USERS active users,
+# kept per process; entries idle for HISTORY_CACHE_IDLE_TTL seconds are dropped. 0 users disables it.
+HISTORY_CACHE_USERS = int(os.getenv("HISTORY_CACHE_USERS", 1000))
+HISTORY_CACHE_MESSAGES = int(os.getenv("HISTORY_CACHE_MESSAGES", 50))
+HISTORY_CACHE_IDLE_TTL = float(os.getenv("HISTORY_CACHE_IDLE_TTL", 900))
+
+# --- Message compression ---
+# Compress message content before encryption: "none" (default), "zlib", "zstd" (needs the
+# zstandard package) or "auto" (zstd when installed, else zlib). Only messages of at least
+# MESSAGE_COMPRESS_MIN_BYTES UTF-8 bytes are compressed, and only when it makes them smaller.
+MESSAGE_COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "none").lower()
+MESSAGE_COMPRESS_MIN_BYTES = int(os.getenv("MESSAGE_COMPRESS_MIN_BYTES", 512))
+
+# --- History export ---
+# Documents fetched per MongoDB batch (and decrypted per step) by /history/export
+HISTORY_EXPORT_BATCH_SIZE = int(os.getenv("HISTORY_EXPORT_BATCH_SIZE", 500))
+
+# --- Retention ---
+# Days to keep chat messages (0 keeps them forever). Overrides: per role "role=days,..." (first
+# matching role in the order listed) and per user "alice=days,..." (wins over roles).
+# MongoDB's TTL monitor deletes expired messages; the expiry is fixed when a message is written.
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", 0))
+HISTORY_RETENTION_ROLES = {
+    role.strip(): float(days) for role, days in (
+        pair.split("=", 1) for pair in os.getenv("HISTORY_RETENTION_ROLES", "").split(",") if "=" in pair
+    )
+}
+HISTORY_RETENTION_USERS = {
+    name.strip(): float(days) for name, days in (
+        pair.split("=", 1) for pair in os.getenv("HISTORY_RETENTION_USERS", "").split(",") if "=" in pair
+    )
+}
+# DELETE /history hides messages at once and deletes them in the background, this many per
+# delete_many with a pause in between, so large histories don't stall other requests
+HISTORY_PURGE_CHUNK = int(os.getenv("HISTORY_PURGE_CHUNK", 1000))
+HISTORY_PURGE_PAUSE = float(os.getenv("HISTORY_PURGE_PAUSE", 0.05))
+
+# --- History search (blind index) ---
+# Normalised words of each new message are HMAC'd and stored in `search_terms`, so /history/search
+# is an indexed lookup and only matching messages are decrypted. The HMAC key is derived from
+# ENCRYPTION_KEY unless SEARCH_INDEX_KEY (base64, 32 bytes) is set; changing it orphans the index.
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "True").lower() in ("true", "1", "yes")
+SEARCH_INDEX_KEY = os.getenv("SEARCH_INDEX_KEY", "")
+# Newest index entries ranked per search, and distinct words indexed per message
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 500))
+SEARCH_MAX_TERMS = int(os.getenv("SEARCH_MAX_TERMS", 1000))
+
+# --- Archive (hot/cold tiering) ---
+# Messages older than HISTORY_ARCHIVE_AFTER_DAYS (0 = never) are moved, oldest first and
+# HISTORY_SEGMENT_SIZE at a time, into compressed, encrypted segment documents in
+# `history_segments`. The in-app archiver runs every HISTORY_ARCHIVE_INTERVAL seconds.
+HISTORY_ARCHIVE_AFTER_DAYS = float(os.getenv("HISTORY_ARCHIVE_AFTER_DAYS", 0))
+HISTORY_SEGMENT_SIZE = int(os.getenv("HISTORY_SEGMENT_SIZE", 500))
+HISTORY_ARCHIVE_INTERVAL = float(os.getenv("HISTORY_ARCHIVE_INTERVAL", 3600))
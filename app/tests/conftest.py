@@ -1 +1,48 @@
 # Shared test fixtures (like client, fake token generator, etc.).
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def empty_history_cache():
+    """Tests swap the history collection freely, so never serve a previous test's cached messages"""
+    from app.history_cache import history_cache
+
+    history_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def memory_db():
+    """
+    Every collection except chat_history (which tests set up themselves) in memory, so
+    purge-marker, thread, search-index and archive lookups never reach MongoDB
+    """
+    from app.loadtest.memory_store import BINDINGS, memory_collections
+
+    with memory_collections(*(name for name in BINDINGS if name != "chats")) as stores:
+        yield stores
+
+
+@pytest.fixture
+def purge_markers(memory_db):
+    return memory_db["purges"]
+
+
+@pytest.fixture
+def conversation_store(memory_db):
+    return memory_db["conversations"]
+
+
+@pytest.fixture
+def search_index(memory_db):
+    return memory_db["search_terms"]
+
+
+@pytest.fixture
+def archive_segments(memory_db):
+    return memory_db["segments"]
+
+
+@pytest.fixture
+def summary_store(memory_db):
+    return memory_db["summaries"]
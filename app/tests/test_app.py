@@ -7,6 +7,8 @@ from fastapi import HTTPException
 from app.app import app, decode_jwt, greet, get_authenticated_username  # import FastAPI instance and functions from app/app.py
 from unittest.mock import patch, MagicMock
 from app.ui import send_message_or_pdf
+from app.app import get_request_timeout
+from app.settings import LLM_TIMEOUT, LLM_MAX_TIMEOUT
 
 client = TestClient(app)
 
@@ -292,4 +294,175 @@ def test_send_message_positional_no_pdf(mock_post, fake_history, fake_token):
     assert history[-1]["content"] == "reply from LLM"
 
     # Called `/generate`
-    assert mock_post.called
\ No newline at end of file
+    assert mock_post.called
+
+# -----------------------------
+# Request deadlines
+# -----------------------------
+
+
+def test_request_timeout_defaults_and_cap():
+    assert get_request_timeout(None) == LLM_TIMEOUT
+    assert get_request_timeout(5) == 5
+    assert get_request_timeout(LLM_MAX_TIMEOUT * 10) == LLM_MAX_TIMEOUT
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats")
+def test_generate_passes_header_deadline_and_maps_timeout(mock_llm, mock_save):
+    import requests as real_requests
+    from app.app import get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        mock_llm.side_effect = real_requests.exceptions.Timeout()
+        resp = client.post(
+            "/generate",
+            json={"text": "hi", "model": "llama3.2"},
+            headers={"Authorization": "Bearer x", "X-Request-Timeout": "3"},
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert resp.status_code == 504
+    assert mock_llm.call_args[1]["timeout"] == 3
+    mock_save.assert_not_called()
+
+
+# -----------------------------
+# Streaming /generate
+# -----------------------------
+class FakeGeneration:
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.text = "".join(pieces)
+        self.aborted = False
+
+    def __iter__(self):
+        return iter(self.pieces)
+
+    def abort(self):
+        self.aborted = True
+
+    def stats(self):
+        return {"aborted": True} if self.aborted else {"ttft": 0.1}
+
+
+@patch("app.app.save_turn")
+@patch("app.app.open_generation")
+def test_generate_stream_relays_ndjson_and_saves(mock_open, mock_save):
+    from app.app import get_current_user
+
+    mock_open.return_value = FakeGeneration(["Hel", "lo"])
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        resp = client.post(
+            "/generate",
+            json={"text": "hi", "model": "llama3.2", "stream": True},
+            headers={"Authorization": "Bearer x"},
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert [l.get("response") for l in lines[:2]] == ["Hel", "lo"]
+    assert lines[-1] == {"done": True, "model": "llama3.2"}
+
+    import time
+    for _ in range(50):  # history is written from a worker thread
+        if mock_save.call_count == 1:
+            break
+        time.sleep(0.02)
+    assert mock_save.call_args[0][:3] == ("alice", "hi", "Hello")
+    assert mock_save.call_args[1]["aborted"] is False
+
+
+@patch("app.app.save_turn")
+def test_save_exchange_flags_aborted_reply(mock_save):
+    from app.app import save_exchange
+
+    import asyncio
+    asyncio.run(save_exchange("alice", "hi", "part", "llama3.2", {"aborted": True}))
+    mock_save.assert_called_once()
+    assert mock_save.call_args[1]["aborted"] is True
+
+
+class FailingGeneration(FakeGeneration):
+    def __init__(self, pieces, error):
+        super().__init__(pieces)
+        self.error = error
+
+    def __iter__(self):
+        yield from self.pieces
+        raise self.error
+
+
+@patch("app.app.save_turn")
+@patch("app.app.open_generation")
+def test_generate_stream_reports_timeout_instead_of_a_cancellation(mock_open, mock_save):
+    import requests as real_requests
+    from app.app import get_current_user
+    from app.metrics import LLM_CANCELLED, LLM_TIMEOUTS
+
+    mock_open.return_value = FailingGeneration(["Hel"], real_requests.exceptions.Timeout())
+    cancelled = LLM_CANCELLED.value(model="llama3.2", endpoint="generate")
+    timeouts = LLM_TIMEOUTS.value(model="llama3.2")
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        resp = client.post(
+            "/generate",
+            json={"text": "hi", "model": "llama3.2", "stream": True},
+            headers={"Authorization": "Bearer x"},
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert lines == [{"response": "Hel"}, {"error": "timeout", "model": "llama3.2"}]
+    assert LLM_TIMEOUTS.value(model="llama3.2") == timeouts + 1
+    assert LLM_CANCELLED.value(model="llama3.2", endpoint="generate") == cancelled
+    mock_save.assert_not_called()
+
+
+@patch("app.app.save_turn")
+@patch("app.app.open_generation")
+def test_generate_stream_reports_upstream_errors(mock_open, mock_save):
+    from app.app import get_current_user
+
+    mock_open.return_value = FailingGeneration([], ConnectionError("ollama down"))
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        resp = client.post(
+            "/generate",
+            json={"text": "hi", "model": "llama3.2", "stream": True},
+            headers={"Authorization": "Bearer x"},
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert [json.loads(line) for line in resp.text.splitlines()] == [{"error": "ollama down", "model": "llama3.2"}]
+    mock_save.assert_not_called()
+
+
+def test_stream_disconnect_counts_a_cancellation_and_saves_the_partial_reply():
+    import asyncio
+    from app.app import stream_generation
+    from app.metrics import LLM_CANCELLED
+
+    generation = FakeGeneration(["Hel", "lo"])
+    before = LLM_CANCELLED.value(model="llama3.2", endpoint="generate")
+
+    async def disconnect_after_first_piece():
+        stream = stream_generation("alice", "hi", "llama3.2", 5, "interactive")
+        await stream.__anext__()
+        await stream.aclose()  # what Starlette does when the client goes away
+
+    with patch("app.app.open_generation", return_value=generation), \
+            patch("app.app.save_in_background") as mock_save:
+        asyncio.run(disconnect_after_first_piece())
+
+    assert generation.aborted
+    assert LLM_CANCELLED.value(model="llama3.2", endpoint="generate") == before + 1
+    mock_save.assert_called_once()
+    mock_save.call_args[0][0].close()  # the un-awaited save_exchange coroutine
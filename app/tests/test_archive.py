@@ -0,0 +1,203 @@
+# app/tests/test_archive.py
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from app import chat_history, async_chat_history
+from app.archive import archive_user, archive_pass, segment_records
+from app.chat_history import build_message_doc
+
+OLD = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def memory_chats():
+    from app.loadtest.memory_store import MemoryCollection, AsyncMemoryCollection
+
+    collection = MemoryCollection()
+    with patch("app.chat_history.chats", collection), patch("app.archive.chats", collection), \
+            patch("app.async_chat_history.async_chats", AsyncMemoryCollection(collection)):
+        yield collection
+
+
+def _seed(collection, count, start=OLD, username="alice", **fields):
+    for i in range(count):
+        doc = build_message_doc(username, "user" if i % 2 == 0 else "assistant", f"message {i}", **fields)
+        doc["timestamp"] = start + timedelta(minutes=i)
+        collection.insert_one(doc)
+        chat_history.search_terms.insert_many(chat_history.search_entries([doc], [{"content": f"message {i}"}]))
+
+
+def _contents(messages):
+    return [m["content"] for m in messages]
+
+
+def _history(username="alice"):
+    async def export():
+        return [m async for batch in async_chat_history.iter_history_batches(username, batch_size=3)
+                for m in chat_history.decode_messages(batch)]
+    return asyncio.run(export())
+
+
+def _page(*args, **kwargs):
+    return asyncio.run(async_chat_history.get_history_page(*args, **kwargs))
+
+
+def _all_pages(limit=3):
+    contents, cursor = [], None
+    while True:
+        result = _page("alice", limit, before=cursor)
+        contents += _contents(result["messages"])
+        cursor = result["next_cursor"]
+        if not cursor:
+            return contents
+
+
+def test_archives_oldest_full_segments_only(memory_chats, archive_segments):
+    _seed(memory_chats, 11)
+
+    moved = archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    assert moved == 8
+    assert memory_chats.count_documents({}) == 3
+    segments = list(archive_segments.find({}).sort("last_ts", 1))
+    assert [s["count"] for s in segments] == [4, 4]
+    assert segments[0]["first_ts"] == OLD
+    assert b"message" not in segments[0]["payload"]  # compressed and encrypted
+    assert _contents(segment_records(segments[1])) == ["message 4", "message 5", "message 6", "message 7"]
+
+
+@patch("app.chat_history.LLM_STORE_STATS", True)
+def test_segments_keep_llm_stats_and_route(memory_chats, archive_segments):
+    stats = {"ttft": 0.2, "e2e": 1.5, "eval_count": 42}
+    route = {"reason": "long prompt", "prompt_chars": 4000}
+    _seed(memory_chats, 2, stats=stats, route=route, conversation_id="A")
+    _seed(memory_chats, 2, start=OLD + timedelta(hours=1), stats=stats, route=route, conversation_id="B")
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+    asyncio.run(async_chat_history.drop_archived("alice", "A"))  # repacks the remaining records
+
+    [segment] = archive_segments.find({})
+    records = segment_records(segment)
+    assert [r["conversation_id"] for r in records] == ["B", "B"]
+    assert all(r["stats"] == stats and r["route"] == route for r in records)
+
+
+def test_reads_are_the_same_across_tiers(memory_chats):
+    _seed(memory_chats, 11)
+    history = _contents(_history())
+    pages = _all_pages()
+
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    assert _contents(_history()) == history
+    assert _all_pages() == pages
+
+
+def test_newer_pages_cross_from_cold_to_hot(memory_chats):
+    _seed(memory_chats, 6)
+    first_id = _page("alice", 6)["messages"][-1]["id"]
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    page = _page("alice", 4, after=chat_history.encode_cursor(OLD, first_id))
+
+    assert _contents(page["messages"]) == ["message 4", "message 3", "message 2", "message 1"]
+    assert page["next_cursor"]
+
+
+def test_recent_history_falls_back_to_the_archive(memory_chats):
+    _seed(memory_chats, 6)
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    recent = asyncio.run(async_chat_history.get_recent_history("alice", 4))
+
+    assert _contents(recent) == ["message 2", "message 3", "message 4", "message 5"]
+
+
+def test_expired_records_are_hidden(memory_chats, archive_segments):
+    _seed(memory_chats, 2, expires_at=datetime(2000, 1, 1))
+    _seed(memory_chats, 2, start=OLD + timedelta(hours=1))
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    assert _contents(_history()) == ["message 0", "message 1"]
+    assert "expires_at" not in archive_segments.find_one({})  # unexpiring messages keep the segment
+
+
+def test_clear_purges_segments_and_archived_index_entries(memory_chats, archive_segments, search_index):
+    _seed(memory_chats, 8)
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    async def clear():
+        await async_chat_history.purge_history("alice", await async_chat_history.clear_history("alice"))
+
+    asyncio.run(clear())
+
+    assert memory_chats.count_documents({}) == archive_segments.count_documents({}) == 0
+    assert search_index.count_documents({}) == 0  # no digests of archived words survive the clear
+    assert _history() == []
+
+
+def test_deleting_a_thread_rewrites_its_segments(memory_chats, archive_segments, search_index):
+    _seed(memory_chats, 2, conversation_id="t1")
+    _seed(memory_chats, 2, start=OLD + timedelta(hours=1), conversation_id="t2")
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+
+    dropped = asyncio.run(async_chat_history.drop_archived("alice", "t1"))
+
+    segment = archive_segments.find_one({})
+    assert dropped == 2
+    assert segment["conversation_ids"] == ["t2"]
+    assert [r["conversation_id"] for r in segment_records(segment)] == ["t2", "t2"]
+    assert search_index.distinct("conversation_id") == ["t2"]  # t1's index entries went with it
+
+
+def test_export_and_search_include_archived_messages(memory_chats):
+    _seed(memory_chats, 4)
+    archive_user("alice", datetime(2025, 1, 1), segment_size=2)
+
+    assert _contents(_history()) == ["message 0", "message 1", "message 2", "message 3"]
+    results = asyncio.run(async_chat_history.search_history("alice", "message"))
+    assert _contents(results) == ["message 3", "message 2", "message 1", "message 0"]
+
+
+def test_archive_pass_is_off_by_default(memory_chats):
+    _seed(memory_chats, 4)
+
+    assert archive_pass(days=0) == 0
+    assert archive_pass(days=1, segment_size=2) == 4
+
+
+def test_history_version_counts_only_live_archived_records_of_the_thread(memory_chats):
+    _seed(memory_chats, 4, conversation_id="A")
+    _seed(memory_chats, 4, start=OLD + timedelta(hours=1), conversation_id="B")
+    archive_user("alice", datetime(2025, 1, 1), segment_size=8)
+
+    assert asyncio.run(async_chat_history.history_version("alice", "A"))[1] == 4
+    assert asyncio.run(async_chat_history.history_version("alice"))[1] == 8
+
+
+def test_history_version_changes_when_an_archived_record_expires(memory_chats, archive_segments):
+    _seed(memory_chats, 2, expires_at=datetime.utcnow() + timedelta(hours=1))
+    _seed(memory_chats, 2, start=OLD + timedelta(hours=1))
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+    before = asyncio.run(async_chat_history.history_version("alice"))
+
+    with patch("app.async_chat_history.datetime") as clock:
+        clock.utcnow.return_value = datetime.utcnow() + timedelta(hours=2)
+        after = asyncio.run(async_chat_history.history_version("alice"))
+
+    assert before[1] == 4
+    assert after[1] == 2  # so the ETag changes and clients don't get a stale 304
+
+
+def test_history_version_decrypts_segments_without_metadata(memory_chats, archive_segments):
+    _seed(memory_chats, 2, conversation_id="A")
+    _seed(memory_chats, 2, start=OLD + timedelta(hours=1), conversation_id="B")
+    archive_user("alice", datetime(2025, 1, 1), segment_size=4)
+    segment = archive_segments.find_one({})
+    del segment["meta"]
+    archive_segments.delete_many({})
+    archive_segments.insert_one(segment)
+
+    assert asyncio.run(async_chat_history.history_version("alice", "B"))[1] == 2
@@ -0,0 +1,91 @@
+# app/tests/test_async_chat_history.py
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from app import async_chat_history
+from app.chat_history import encrypt_message, decrypt_message
+from app.loadtest.memory_store import MemoryCollection, AsyncMemoryCollection
+
+
+@pytest.fixture
+def store():
+    collection = MemoryCollection()
+    with patch("app.async_chat_history.async_chats", AsyncMemoryCollection(collection)):
+        yield collection
+
+
+def test_save_turn_inserts_prompt_then_reply(store):
+    asyncio.run(async_chat_history.save_turn("alice", "Q", "A", model="gemma3"))
+
+    docs = list(store.find({"username": "alice"}))
+    assert [d["role"] for d in docs] == ["user", "assistant"]
+    assert decrypt_message(docs[1]["content"]) == "A"
+    assert docs[1]["model"] == "gemma3"
+
+
+def test_tail_and_pages_read_newest_messages(store):
+    base = datetime(2025, 11, 7, 12, 0, 0)
+    for i in range(4):
+        store.insert_one({"username": "alice", "role": "user", "content": encrypt_message(f"m{i}"),
+                          "timestamp": base + timedelta(minutes=i)})
+
+    recent = asyncio.run(async_chat_history.get_recent_history("alice", 2))
+    first = asyncio.run(async_chat_history.get_history_page("alice", limit=3))
+    rest = asyncio.run(async_chat_history.get_history_page("alice", limit=3, before=first["next_cursor"]))
+
+    assert [m["content"] for m in recent] == ["m2", "m3"]
+    assert [m["content"] for m in first["messages"]] == ["m3", "m2", "m1"]
+    assert [m["content"] for m in rest["messages"]] == ["m0"]
+    assert rest["next_cursor"] is None
+
+
+def test_clear_history_only_touches_user(store):
+    store.insert_one({"username": "alice", "content": "x", "timestamp": datetime(2025, 1, 1)})
+    store.insert_one({"username": "bob", "content": "y", "timestamp": datetime(2025, 1, 1)})
+
+    cutoff = asyncio.run(async_chat_history.clear_history("alice"))
+
+    assert asyncio.run(async_chat_history.get_history_page("alice"))["messages"] == []  # hidden at once
+    assert store.count_documents({}) == 2
+    assert asyncio.run(async_chat_history.purge_history("alice", cutoff, pause=0)) == 1
+    assert store.count_documents({}) == 1
+
+
+def test_history_version_changes_with_every_write(store):
+    empty = asyncio.run(async_chat_history.history_version("alice"))
+    asyncio.run(async_chat_history.save_turn("alice", "Q", "A"))
+    saved = asyncio.run(async_chat_history.history_version("alice"))
+
+    assert empty == ("0", 0)
+    assert saved[1] == 2
+    assert saved == asyncio.run(async_chat_history.history_version("alice"))
+    assert asyncio.run(async_chat_history.history_version("bob")) == empty
+
+
+def test_history_version_counts_by_equality_and_subtracts_hidden_threads(store):
+    asyncio.run(async_chat_history.save_turn("alice", "Q", "A"))
+    asyncio.run(async_chat_history.save_turn("alice", "Q", "A", conversation_id="t1"))
+    asyncio.run(async_chat_history.hide_thread("alice", "t1"))
+
+    with patch.object(store, "count_documents", wraps=store.count_documents) as count:
+        version = asyncio.run(async_chat_history.history_version("alice"))
+
+    assert version[1] == 2
+    queries = [call[0][0] for call in count.call_args_list]
+    assert queries == [{"username": "alice"}, {"username": "alice", "conversation_id": "t1"}]  # COUNT_SCAN shapes
+
+
+def test_since_cursor_returns_only_newer_messages(store):
+    asyncio.run(async_chat_history.save_turn("alice", "Q1", "A1"))
+    first = asyncio.run(async_chat_history.get_history_page("alice"))
+    asyncio.run(async_chat_history.save_turn("alice", "Q2", "A2"))
+
+    delta = asyncio.run(async_chat_history.get_history_page("alice", after=first["sync_cursor"]))
+    idle = asyncio.run(async_chat_history.get_history_page("alice", after=delta["sync_cursor"]))
+
+    assert [m["content"] for m in delta["messages"]] == ["A2", "Q2"]
+    assert idle["messages"] == []
+    assert idle["sync_cursor"] == delta["sync_cursor"]
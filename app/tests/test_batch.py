@@ -0,0 +1,80 @@
+# app/tests/test_batch.py
+import json
+import time
+from unittest.mock import patch
+
+import requests
+from fastapi.testclient import TestClient
+
+from app.app import app, get_current_user
+
+client = TestClient(app)
+
+
+def _post_batch(items):
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        return client.post("/generate/batch", json={"items": items}, headers={"Authorization": "Bearer x"})
+    finally:
+        app.dependency_overrides.clear()
+
+
+def _wait_for(mock, calls=1):
+    for _ in range(100):  # history is written from a worker thread after the stream ends
+        if mock.call_count >= calls:
+            return
+        time.sleep(0.02)
+
+
+@patch("app.app.save_user_messages")
+@patch("app.app.get_response_with_stats")
+def test_batch_streams_results_in_completion_order(mock_llm, mock_save):
+    def fake_llm(text, model, **kwargs):
+        if text == "slow":
+            time.sleep(0.2)
+        assert kwargs["priority"] == "batch"
+        return f"answer to {text}", {"ttft": 0.1}
+
+    mock_llm.side_effect = fake_llm
+
+    resp = _post_batch([
+        {"text": "slow", "model": "llama3.2"},
+        {"text": "fast", "model": "gemma3"},
+    ])
+
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert [line["index"] for line in lines] == [1, 0]
+    assert lines[0] == {"index": 1, "model": "gemma3", "response": "answer to fast"}
+
+    _wait_for(mock_save)
+    mock_save.assert_called_once()
+    username, messages = mock_save.call_args[0]
+    assert username == "alice"
+    assert len(messages) == 4
+    assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant"]
+
+
+@patch("app.app.save_user_messages")
+@patch("app.app.get_response_with_stats")
+def test_batch_reports_per_item_errors(mock_llm, mock_save):
+    def fake_llm(text, model, **kwargs):
+        if text == "bad":
+            raise requests.exceptions.Timeout()
+        return "ok", {}
+
+    mock_llm.side_effect = fake_llm
+
+    resp = _post_batch([{"text": "bad", "model": "m"}, {"text": "good", "model": "m"}])
+
+    lines = {line["index"]: line for line in map(json.loads, resp.text.splitlines())}
+    assert lines[0]["error"] == "timeout"
+    assert lines[1]["response"] == "ok"
+
+    _wait_for(mock_save)
+    assert len(mock_save.call_args[0][1]) == 2  # only the successful turn is stored
+
+
+def test_batch_rejects_empty_list():
+    resp = _post_batch([])
+    assert resp.status_code == 422
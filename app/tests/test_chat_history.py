@@ -1,4 +1,5 @@
 import pytest
+from datetime import datetime
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from app.app import app
@@ -38,23 +39,34 @@ def override_get_current_user(mock_user):
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def history_version():
+    # /history computes its ETag from the stored history before reading the page
+    with patch("app.app.history_version", return_value=("latest", 2)) as version:
+        yield version
+
+
 # -------------------------------
 # Tests
 # -------------------------------
-@patch("app.app.get_response")
-@patch("app.app.save_user_message")
-@patch("app.app.get_user_history")
+@patch("app.app.compact_history")
+@patch("app.app.get_conversation_summary", return_value=None)
+@patch("app.app.get_response_with_stats")
+@patch("app.app.save_turn")
+@patch("app.app.get_recent_history")
 def test_chat_endpoint(
-    mock_get_user_history,
-    mock_save_user_message,
+    mock_get_recent_history,
+    mock_save_turn,
     mock_get_response,
+    mock_get_summary,
+    mock_compact,
     mock_user,
     auth_header
 ):
-    mock_get_user_history.return_value = [
+    mock_get_recent_history.return_value = [
         {"role": "assistant", "content": "Hello, how can I help?"}
     ]
-    mock_get_response.return_value = "This is a test response."
+    mock_get_response.return_value = ("This is a test response.", {"ttft": 0.1})
 
     payload = {"prompt": "Tell me a joke"}
     response = client.post("/chat", json=payload, headers=auth_header)
@@ -63,16 +75,52 @@ def test_chat_endpoint(
     data = response.json()
     assert "response" in data
     assert data["response"] == "This is a test response."
-    mock_save_user_message.assert_called()
-    mock_get_user_history.assert_called_once()
+    mock_save_turn.assert_called_once()
+    mock_get_recent_history.assert_called_once()
+    mock_compact.assert_called_once_with("test_user")
 
 
-@patch("app.app.get_user_history")
-def test_get_history_endpoint(mock_get_user_history, mock_user, auth_header):
-    mock_get_user_history.return_value = [
-        {"role": "user", "content": "Hi"},
-        {"role": "assistant", "content": "Hello there!"}
+@patch("app.app.compact_history")
+@patch("app.app.get_conversation_summary")
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+@patch("app.app.save_turn")
+@patch("app.app.get_recent_history")
+def test_chat_endpoint_sends_summary_and_recent_turns(
+    mock_get_recent_history,
+    mock_save_turn,
+    mock_get_response,
+    mock_get_summary,
+    mock_compact,
+    auth_header
+):
+    mock_get_recent_history.return_value = [
+        {"role": "user", "content": "old turn", "timestamp": "2025-11-07T09:00:00"},
+        {"role": "user", "content": "recent turn", "timestamp": "2025-11-07T11:00:00"},
     ]
+    mock_get_summary.return_value = {
+        "role": "system",
+        "content": "User likes llamas.",
+        "watermark": datetime(2025, 11, 7, 10, 0, 0),
+    }
+
+    response = client.post("/chat", json={"prompt": "hi"}, headers=auth_header)
+
+    assert response.status_code == 200
+    sent_prompt = mock_get_response.call_args[0][0]
+    assert "User likes llamas." in sent_prompt
+    assert "recent turn" in sent_prompt
+    assert "old turn" not in sent_prompt
+    mock_get_recent_history.assert_called_once_with(
+        "test_user", 10, datetime(2025, 11, 7, 10, 0, 0), conversation_id=None
+    )
+
+
+@patch("app.app.get_history_page")
+def test_get_history_endpoint(mock_get_history_page, mock_user, auth_header):
+    mock_get_history_page.return_value = {"messages": [
+        {"role": "assistant", "content": "Hello there!"},
+        {"role": "user", "content": "Hi"},
+    ], "next_cursor": None}
 
     response = client.get("/history", headers=auth_header)
     assert response.status_code == 200
@@ -81,25 +129,27 @@ def test_get_history_endpoint(mock_get_user_history, mock_user, auth_header):
     assert len(data["messages"]) == 2
 
 
+@patch("app.app.purge_history")
 @patch("app.app.clear_history")
-def test_clear_history_endpoint(mock_clear_history, mock_user, auth_header):
+def test_clear_history_endpoint(mock_clear_history, mock_purge_history, mock_user, auth_header):
     response = client.delete("/history", headers=auth_header)
     assert response.status_code == 200
     data = response.json()
     assert data["message"] == "Chat history cleared successfully."
     mock_clear_history.assert_called_once()
+    mock_purge_history.assert_called_once_with("test_user", mock_clear_history.return_value)
 
-def test_encrypt_message_returns_encrypted_string():
-    """Ensure encrypt_message() returns a base64-encoded ciphertext"""
+def test_encrypt_message_returns_binary_ciphertext():
+    """Ensure encrypt_message() returns raw AES-GCM bytes tagged with the key id"""
     text = "hello world"
     encrypted = encrypt_message(text)
 
     # Check type and that encryption actually changes the text
-    assert isinstance(encrypted, str)
-    assert encrypted != text
+    assert isinstance(encrypted, bytes)
+    assert text.encode() not in encrypted
 
-    # Fernet tokens typically contain '=' or '-'
-    assert any(c in encrypted for c in ['=', '-', '_'])
+    # format version, key id length, key id
+    assert encrypted[:4] == b"\x01\x02k0"
 
 def test_decrypt_message_returns_original_text():
     """Ensure decrypt_message() restores original text"""
@@ -129,3 +179,110 @@ def test_invalid_token_does_not_raise_error():
     result = decrypt_message(invalid_token)
     # Should not raise an exception, should return same input
     assert result == invalid_token
+
+
+@patch("app.app.get_history_page")
+def test_history_endpoint_passes_page_params(mock_page, auth_header):
+    mock_page.return_value = {"messages": [], "next_cursor": None}
+
+    response = client.get("/history?limit=20&before=abc", headers=auth_header)
+
+    assert response.status_code == 200
+    assert response.json() == {"messages": [], "next_cursor": None}
+    mock_page.assert_called_once_with("test_user", 20, before="abc", after=None, conversation_id=None)
+
+
+@patch("app.app.get_history_page", side_effect=ValueError("Invalid cursor: abc"))
+def test_history_endpoint_rejects_bad_cursor(mock_page, auth_header):
+    response = client.get("/history?before=abc", headers=auth_header)
+    assert response.status_code == 400
+
+
+def test_history_endpoint_rejects_both_directions(auth_header):
+    response = client.get("/history?before=a&after=b", headers=auth_header)
+    assert response.status_code == 400
+
+
+@patch("app.app.get_history_page")
+def test_history_endpoint_answers_matching_etag_with_304(mock_page, auth_header):
+    mock_page.return_value = {"messages": [], "next_cursor": None, "sync_cursor": None}
+
+    first = client.get("/history", headers=auth_header)
+    again = client.get("/history", headers={**auth_header, "If-None-Match": first.headers["ETag"]})
+    other_page = client.get("/history?before=abc", headers={**auth_header, "If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200
+    assert first.headers["ETag"].startswith('"latest-2-')
+    assert again.status_code == 304
+    assert again.headers["ETag"] == first.headers["ETag"]
+    assert other_page.status_code == 200
+    assert mock_page.call_count == 2
+
+
+@patch("app.app.get_history_page")
+def test_history_endpoint_etag_changes_with_the_history(mock_page, history_version, auth_header):
+    mock_page.return_value = {"messages": [], "next_cursor": None, "sync_cursor": None}
+    etag = client.get("/history", headers=auth_header).headers["ETag"]
+
+    history_version.return_value = ("newer", 3)
+    response = client.get("/history", headers={**auth_header, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@patch("app.app.get_history_page")
+def test_history_endpoint_since_fetches_newer_messages(mock_page, auth_header):
+    mock_page.return_value = {"messages": [], "next_cursor": None, "sync_cursor": "cur"}
+
+    response = client.get("/history?since=cur", headers=auth_header)
+    both = client.get("/history?since=cur&after=cur", headers=auth_header)
+
+    assert response.status_code == 200
+    mock_page.assert_called_once_with("test_user", 50, before=None, after="cur", conversation_id=None)
+    assert both.status_code == 400
+
+
+@pytest.fixture
+def export_store():
+    from app.loadtest.memory_store import MemoryCollection, AsyncMemoryCollection
+
+    collection = MemoryCollection()
+    for i in range(5):
+        collection.insert_one({"username": "test_user", "role": "user", "content": encrypt_message(f"m{i}"),
+                               "timestamp": datetime(2025, 11, 7, 12, i)})
+    collection.insert_one({"username": "other", "role": "user", "content": encrypt_message("x"),
+                           "timestamp": datetime(2025, 11, 7, 12, 0)})
+    with patch("app.async_chat_history.async_chats", AsyncMemoryCollection(collection)), \
+            patch("app.app.HISTORY_EXPORT_BATCH_SIZE", 2):
+        yield collection
+
+
+def test_history_export_streams_ndjson_oldest_first(export_store, auth_header):
+    import json
+
+    response = client.get("/history/export", headers=auth_header)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["content"] for line in lines] == ["m0", "m1", "m2", "m3", "m4"]
+    assert all("id" in line for line in lines)
+
+
+def test_history_export_resumes_from_timestamp_inclusive(export_store, auth_header):
+    import json
+
+    response = client.get("/history/export?since=2025-11-07T12:03:00", headers=auth_header)
+
+    assert [json.loads(line)["content"] for line in response.text.splitlines()] == ["m3", "m4"]
+
+
+def test_history_export_gzip(export_store, auth_header):
+    import gzip
+
+    response = client.get("/history/export?gzip=true", headers=auth_header)
+
+    assert response.headers["content-type"] == "application/gzip"
+    assert "history-test_user.ndjson.gz" in response.headers["content-disposition"]
+    assert len(gzip.decompress(response.content).splitlines()) == 5
@@ -1,14 +1,19 @@
 # app/tests/test_chat_history_module.py
+import asyncio
 import pytest
 from datetime import datetime, timedelta
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import pytz
 
+from app.async_chat_history import (
+    save_user_messages,
+    get_history_page,
+    get_recent_history,
+    clear_history,
+    purge_history,
+)
 from app.chat_history import (
     format_message,
-    save_user_message,
-    get_user_history,
-    clear_history,
     encrypt_message,
     decrypt_message
 )
@@ -17,13 +22,31 @@ from app.chat_history import (
 # -------------------------------
 # Constants for testing
 # -------------------------------
+@pytest.fixture
+def store():
+    """chat_history in memory, for the sync (background job) and async (request path) layers"""
+    from app.loadtest.memory_store import memory_collections
+
+    with memory_collections("chats") as stores:
+        yield stores["chats"]
+
+
 @pytest.fixture
 def mock_chats():
-    """Mock MongoDB collection"""
-    with patch("app.chat_history.chats", autospec=True) as mock:
+    """Mock async MongoDB collection"""
+    with patch("app.async_chat_history.async_chats") as mock:
+        mock.insert_many = AsyncMock()
         yield mock
 
 
+def save_user_message(username, role, content, **fields):
+    asyncio.run(save_user_messages(username, [{"role": role, "content": content, **fields}]))
+
+
+def history(username):
+    return asyncio.run(get_history_page(username))["messages"][::-1]  # oldest first
+
+
 @pytest.fixture
 def mock_time(monkeypatch):
     """Freeze time to a known UTC value"""
@@ -61,65 +84,75 @@ def test_format_message_with_timestamp(mock_time):
     assert any(part in msg["content"] for part in ["2025", "Nov", "11", "07"])
 
 # -------------------------------
-# Tests for save_user_message()
+# Tests for save_user_messages()
 # -------------------------------
 def test_save_user_message_inserts(mock_chats, mock_time):
     save_user_message("test_user", "user", "Hello again!")
-    mock_chats.insert_one.assert_called_once()
-    args, kwargs = mock_chats.insert_one.call_args
-    doc = args[0]
+    mock_chats.insert_many.assert_called_once()
+    [doc] = mock_chats.insert_many.call_args[0][0]
     assert doc["username"] == "test_user"
     assert doc["role"] == "user"
     assert "timestamp" in doc
 
 
 # -------------------------------
-# Tests for get_user_history()
+# Tests for reading history
 # -------------------------------
-def test_get_user_history_returns_sorted(mock_chats, mock_time):
-    # Mock MongoDB find() → sort() chain
-    mock_chats.find.return_value.sort.return_value = [
-        {"role": "user", "content": "Hi", "timestamp": datetime(2025, 11, 7, 10, 0, 0)},
-        {"role": "assistant", "content": "Hello", "timestamp": datetime(2025, 11, 7, 10, 1, 0)},
-    ]
-    history = get_user_history("test_user")
+def test_history_returns_sorted(store, mock_time):
+    store.insert_one({"username": "test_user", "role": "assistant", "content": "Hello",
+                      "timestamp": datetime(2025, 11, 7, 10, 1, 0)})
+    store.insert_one({"username": "test_user", "role": "user", "content": "Hi",
+                      "timestamp": datetime(2025, 11, 7, 10, 0, 0)})
+    messages = history("test_user")
 
-    mock_chats.find.assert_called_once_with({"username": "test_user"})
-    assert len(history) == 2
-    assert history[0]["role"] == "user"
-    assert history[1]["role"] == "assistant"
-    assert "timestamp" in history[0]
-    assert isinstance(history[0]["timestamp"], str)
+    assert len(messages) == 2
+    assert messages[0]["role"] == "user"
+    assert messages[1]["role"] == "assistant"
+    assert "timestamp" in messages[0]
+    assert isinstance(messages[0]["timestamp"], str)
 
 
-def test_get_user_history_backward_compatibility(mock_chats, mock_time):
+def test_history_backward_compatibility(store, mock_time):
     """Ensure old Mongo documents with 'message' instead of 'content' still work"""
-    mock_chats.find.return_value.sort.return_value = [
-        {"role": "assistant", "message": "Legacy format", "timestamp": datetime(2025, 11, 7, 8, 0, 0)},
-    ]
-    history = get_user_history("legacy_user")
-    assert len(history) == 1
-    assert history[0]["content"] == "Legacy format"
+    store.insert_one({"username": "legacy_user", "role": "assistant", "message": "Legacy format",
+                      "timestamp": datetime(2025, 11, 7, 8, 0, 0)})
+    messages = history("legacy_user")
+    assert len(messages) == 1
+    assert messages[0]["content"] == "Legacy format"
 
 
 # -------------------------------
 # Tests for clear_history()
 # -------------------------------
-def test_clear_history_deletes(mock_chats):
-    clear_history("test_user")
-    mock_chats.delete_many.assert_called_once_with({"username": "test_user"})
+def test_clear_history_deletes_in_chunks(store, purge_markers, summary_store):
+    for i in range(5):
+        store.insert_one({"username": "test_user", "content": f"m{i}", "timestamp": datetime(2025, 1, 1, 0, i)})
+    summary_store.insert_one({"_id": "test_user", "content": "s", "watermark": datetime(2025, 1, 1)})
+    store.insert_one({"username": "other", "content": "x", "timestamp": datetime(2025, 1, 1)})
+
+    with patch.object(store, "delete_many", wraps=store.delete_many) as delete_many:
+        cutoff = asyncio.run(clear_history("test_user"))
+        assert asyncio.run(purge_history("test_user", cutoff, chunk_size=2, pause=0)) == 5
+
+    assert delete_many.call_count == 3  # chunks of 2 + 2 + 1
+    assert [d["username"] for d in store.find({})] == ["other"]
+    assert summary_store.count_documents({}) == 0
+    assert purge_markers.count_documents({}) == 0
+
+
+def test_cleared_history_is_hidden_before_it_is_purged(store, purge_markers):
+    store.insert_one({"username": "test_user", "role": "user", "content": "old", "timestamp": datetime(2024, 12, 31)})
+    store.insert_one({"username": "test_user", "role": "user", "content": "new", "timestamp": datetime(2025, 1, 2)})
+    purge_markers.insert_one({"username": "test_user", "before": datetime(2025, 1, 1)})
+
+    assert [m["content"] for m in history("test_user")] == ["new"]
+    assert store.count_documents({}) == 2
 
 
 
 # -------------------------------
 # Fixtures
 # -------------------------------
-@pytest.fixture
-def mock_chats():
-    with patch("app.chat_history.chats", autospec=True) as mock:
-        yield mock
-
-
 @pytest.fixture
 def fixed_time(monkeypatch):
     """Freeze datetime.utcnow()"""
@@ -158,12 +191,12 @@ def test_format_message_user_model_ignored(fixed_time):
 
 
 # -------------------------------
-# Tests for save_user_message() with model
+# Tests for save_user_messages() with model
 # -------------------------------
 def test_save_user_message_includes_model(mock_chats, fixed_time):
     save_user_message("alice", "assistant", "Hi", model="gemma3")
-    mock_chats.insert_one.assert_called_once()
-    doc = mock_chats.insert_one.call_args[0][0]
+    mock_chats.insert_many.assert_called_once()
+    [doc] = mock_chats.insert_many.call_args[0][0]
     assert doc["username"] == "alice"
     assert doc["role"] == "assistant"
     assert doc["model"] == "gemma3"
@@ -171,24 +204,24 @@ def test_save_user_message_includes_model(mock_chats, fixed_time):
 
 def test_save_user_message_without_model(mock_chats, fixed_time):
     save_user_message("bob", "assistant", "Hello")
-    doc = mock_chats.insert_one.call_args[0][0]
+    [doc] = mock_chats.insert_many.call_args[0][0]
     # 'model' key may be absent
     assert "model" not in doc or doc["model"] is None
 
 
 # -------------------------------
-# Tests for get_user_history() with model
+# Tests for reading history with model
 # -------------------------------
-def test_get_user_history_returns_model(mock_chats, fixed_time):
-    mock_chats.find.return_value.sort.return_value = [
-        {"role": "assistant", "content": encrypt_message("Hi"), "timestamp": datetime(2025, 11, 16, 19, 0), "model": "llama3.2"},
-        {"role": "user", "content": encrypt_message("Hello"), "timestamp": datetime(2025, 11, 16, 19, 1)},
-    ]
-    history = get_user_history("tester")
-    assert history[0]["model"] == "llama3.2"
-    assert history[1]["model"] is None
-    assert history[0]["content"] == "Hi"
-    assert history[1]["content"] == "Hello"
+def test_history_returns_model(store, fixed_time):
+    store.insert_one({"username": "tester", "role": "assistant", "content": encrypt_message("Hi"),
+                      "timestamp": datetime(2025, 11, 16, 19, 0), "model": "llama3.2"})
+    store.insert_one({"username": "tester", "role": "user", "content": encrypt_message("Hello"),
+                      "timestamp": datetime(2025, 11, 16, 19, 1)})
+    messages = history("tester")
+    assert messages[0]["model"] == "llama3.2"
+    assert messages[1]["model"] is None
+    assert messages[0]["content"] == "Hi"
+    assert messages[1]["content"] == "Hello"
 
 
 # -------------------------------
@@ -208,10 +241,197 @@ def test_decrypt_fallback_plaintext():
 
 
 # -------------------------------
-# Test clear_history() calls delete_many
+# Test clear_history() drops the summary
+# -------------------------------
+def test_clear_history_drops_summary_at_once(store, summary_store):
+    summary_store.insert_one({"_id": "user123", "content": "s", "watermark": datetime(2025, 1, 1)})
+    summary_store.insert_one({"_id": "other", "content": "s", "watermark": datetime(2025, 1, 1)})
+    asyncio.run(clear_history("user123"))
+    assert [d["_id"] for d in summary_store.find({})] == ["other"]
+
+
+# -------------------------------
+# Pinned conversation summary
+# -------------------------------
+def test_summary_expires_under_retention(summary_store):
+    from app.chat_history import save_conversation_summary, get_conversation_summary
+
+    watermark = datetime(2025, 11, 16, 19, 0)
+    save_conversation_summary("tester", "recap", watermark, expires_at=datetime.utcnow() + timedelta(days=1))
+    assert get_conversation_summary("tester")["content"] == "recap"
+
+    save_conversation_summary("tester", "recap", watermark, expires_at=datetime.utcnow() - timedelta(seconds=1))
+    assert get_conversation_summary("tester") is None  # past expires_at, before the TTL monitor runs
+
+    save_conversation_summary("tester", "recap", watermark)
+    assert "expires_at" not in summary_store.find_one({"_id": "tester"})
+
+
+def test_legacy_pinned_summary_moves_out_of_chat_history(store, summary_store):
+    from app.chat_history import move_legacy_summaries, get_conversation_summary
+
+    watermark = datetime(2025, 11, 16, 18, 0)
+    store.insert_one({"username": "tester", "role": "system", "content": encrypt_message("recap"),
+                      "pinned": True, "watermark": watermark, "timestamp": watermark})
+    store.insert_one({"username": "tester", "role": "user", "content": encrypt_message("Hello"),
+                      "timestamp": datetime(2025, 11, 16, 19, 1)})
+
+    assert move_legacy_summaries() == 1
+    assert [m["content"] for m in history("tester")] == ["Hello"]
+
+    assert get_conversation_summary("tester")["content"] == "recap"
+
+
+def test_save_and_get_conversation_summary(summary_store):
+    from app.chat_history import save_conversation_summary, get_conversation_summary
+
+    watermark = datetime(2025, 11, 16, 19, 0)
+    save_conversation_summary("tester", "Short recap", watermark, "llama3.2")
+    save_conversation_summary("tester", "Longer recap", watermark, "llama3.2")
+
+    [doc] = summary_store.find({})
+    assert doc["_id"] == "tester"  # one document per user, found by _id
+    assert doc["watermark"] == watermark
+    assert doc["content"] != "Longer recap"  # stored encrypted
+
+    summary = get_conversation_summary("tester")
+    assert summary["content"] == "Longer recap"
+    assert summary["watermark"] == watermark
+
+
+def test_get_conversation_summary_missing(summary_store):
+    from app.chat_history import get_conversation_summary
+
+    assert get_conversation_summary("nobody") is None
+
+
+def test_save_user_message_stores_stats_when_enabled(mock_chats, fixed_time):
+    with patch("app.chat_history.LLM_STORE_STATS", True):
+        save_user_message("alice", "assistant", "Hi", model="gemma3", stats={"ttft": 0.3})
+    [doc] = mock_chats.insert_many.call_args[0][0]
+    assert doc["stats"] == {"ttft": 0.3}
+
+
+def test_save_user_message_drops_stats_by_default(mock_chats, fixed_time):
+    save_user_message("alice", "assistant", "Hi", model="gemma3", stats={"ttft": 0.3})
+    [doc] = mock_chats.insert_many.call_args[0][0]
+    assert "stats" not in doc
+
+
+def test_save_user_message_flags_aborted(mock_chats, fixed_time):
+    save_user_message("alice", "assistant", "partial", aborted=True)
+    [doc] = mock_chats.insert_many.call_args[0][0]
+    assert doc["aborted"] is True
+
+
+def test_save_user_messages_uses_single_insert_many(mock_chats, fixed_time):
+    asyncio.run(save_user_messages("alice", [
+        {"role": "user", "content": "Q"},
+        {"role": "assistant", "content": "A", "model": "gemma3"},
+    ]))
+
+    mock_chats.insert_many.assert_called_once()
+    docs = mock_chats.insert_many.call_args[0][0]
+    assert [d["role"] for d in docs] == ["user", "assistant"]
+    assert docs[1]["model"] == "gemma3"
+    assert decrypt_message(docs[0]["content"]) == "Q"
+    assert mock_chats.insert_many.call_args[1]["ordered"] is True
+
+
+# -------------------------------
+# Cursor pagination
 # -------------------------------
-def test_clear_history_calls_delete(mock_chats):
-    clear_history("user123")
-    mock_chats.delete_many.assert_called_once_with({"username": "user123"})
+@pytest.fixture
+def memory_chats(store):
+    base = datetime(2025, 11, 7, 12, 0, 0)
+    for i in range(5):
+        store.insert_one({
+            "username": "alice", "role": "user", "content": encrypt_message(f"m{i}"),
+            "timestamp": base + timedelta(minutes=i // 2),  # pairs share a timestamp; _id breaks the tie
+        })
+    store.insert_one({"username": "bob", "role": "user", "content": encrypt_message("x"), "timestamp": base})
+    return store
+
+
+def page(*args, **kwargs):
+    return asyncio.run(get_history_page(*args, **kwargs))
+
+
+def test_history_pages_newest_first_with_cursors(memory_chats):
+    first = page("alice", limit=2)
+    second = page("alice", limit=2, before=first["next_cursor"])
+    third = page("alice", limit=2, before=second["next_cursor"])
+
+    contents = [[m["content"] for m in page["messages"]] for page in (first, second, third)]
+    assert contents == [["m4", "m3"], ["m2", "m1"], ["m0"]]
+    assert third["next_cursor"] is None
+    assert "id" in first["messages"][0]
+
+
+def test_history_page_after_cursor_returns_newer_messages(memory_chats):
+    from app.chat_history import encode_cursor
+
+    oldest = next(d for d in memory_chats.find({"username": "alice"}).sort([("timestamp", 1), ("_id", 1)]))
+    newer = page("alice", limit=3, after=encode_cursor(oldest["timestamp"], oldest["_id"]))
+
+    assert [m["content"] for m in newer["messages"]] == ["m3", "m2", "m1"]
+    assert newer["next_cursor"] is not None
+
+
+def test_decode_cursor_rejects_garbage():
+    from app.chat_history import decode_cursor
+
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_recent_history_reads_only_the_tail(memory_chats):
+    recent = asyncio.run(get_recent_history("alice", 3))
+
+    assert [m["content"] for m in recent] == ["m2", "m3", "m4"]
+
+
+def test_recent_history_queries_descending_with_limit_and_projection(mock_chats):
+    cursor = mock_chats.find.return_value.sort.return_value.limit.return_value
+    cursor.to_list = AsyncMock(return_value=[
+        {"role": "assistant", "content": encrypt_message("newer"), "timestamp": datetime(2025, 1, 1, 10, 1)},
+        {"role": "user", "content": encrypt_message("older"), "timestamp": datetime(2025, 1, 1, 10, 0)},
+    ])
+    since = datetime(2025, 1, 1, 9, 0)
+
+    recent = asyncio.run(get_recent_history("alice", 2, since=since))
+
+    query, projection = mock_chats.find.call_args[0]
+    assert query == {"username": "alice", "conversation_id": None, "timestamp": {"$gt": since}}
+    assert "content" in projection and "stats" not in projection
+    mock_chats.find.return_value.sort.assert_called_once_with([("timestamp", -1), ("_id", -1)])
+    mock_chats.find.return_value.sort.return_value.limit.assert_called_once_with(2)
+    assert [m["content"] for m in recent] == ["older", "newer"]
+
+
+def test_save_turn_writes_prompt_and_reply_in_one_ordered_insert(mock_chats, fixed_time):
+    from app.async_chat_history import save_turn
+
+    asyncio.run(save_turn("alice", "Q", "A", model="gemma3", aborted=True, prompt_role="system"))
+
+    mock_chats.insert_many.assert_called_once()
+    docs = mock_chats.insert_many.call_args[0][0]
+    assert [d["role"] for d in docs] == ["system", "assistant"]
+    assert docs[1]["model"] == "gemma3" and docs[1]["aborted"] is True
+    assert "model" not in docs[0]
+    assert mock_chats.insert_many.call_args[1]["ordered"] is True
+
+
+def test_decode_messages_keeps_order_and_flags():
+    from app.chat_history import decode_messages
+
+    docs = [
+        {"role": "user", "content": encrypt_message(f"m{i}"), "timestamp": datetime(2025, 1, 1) + timedelta(seconds=i),
+         **({"aborted": True} if i == 3 else {})}
+        for i in range(25)
+    ]
+
+    messages = decode_messages(docs)
 
-        
\ No newline at end of file
+    assert [m["content"] for m in messages] == [f"m{i}" for i in range(25)]
+    assert messages[3]["aborted"] is True and "aborted" not in messages[4]
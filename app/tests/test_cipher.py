@@ -0,0 +1,92 @@
+# app/tests/test_cipher.py
+import base64
+import os
+from datetime import datetime
+
+import pytest
+
+from app.cipher import build_cipher, parse_keys, benchmark, bulk_benchmark, message_cipher
+from app.chat_history import decrypt_message, decode_messages, _message_out
+from app.settings import fernet
+
+
+def _key():
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+
+def test_reads_legacy_fernet_tokens_and_plaintext():
+    cipher = build_cipher()
+
+    assert cipher.decrypt(fernet.encrypt(b"old message").decode()) == "old message"
+    assert cipher.decrypt("never encrypted") == "never encrypted"
+
+
+def test_rotation_keeps_older_key_ids_readable():
+    keys = f"k1:{_key()}"
+    before = build_cipher(keys=keys, active="k0").encrypt("written with k0")
+    rotated = build_cipher(keys=keys, active="k1")
+
+    after = rotated.encrypt("written with k1")
+
+    assert after[2:4] == b"k1"
+    assert rotated.decrypt(before) == "written with k0"
+    assert rotated.decrypt(after) == "written with k1"
+
+
+def test_fernet_writer_stays_available_for_rolling_upgrades():
+    cipher = build_cipher(name="fernet")
+
+    token = cipher.encrypt("hello")
+
+    assert isinstance(token, str)
+    assert fernet.decrypt(token.encode()) == b"hello"
+
+
+def test_unknown_key_id_is_not_returned_as_content():
+    blob = build_cipher(keys=f"k9:{_key()}", active="k9").encrypt("secret")
+
+    assert decrypt_message(blob) == ""
+
+
+def test_rejects_bad_configuration():
+    with pytest.raises(ValueError):
+        parse_keys("k1:not-a-key")
+    with pytest.raises(ValueError):
+        build_cipher(active="missing")
+    with pytest.raises(ValueError):
+        build_cipher(name="rot13")
+
+
+def test_benchmark_reports_both_ciphers():
+    results = benchmark(messages=50, size=100)
+
+    assert set(results) == {"fernet", "aesgcm"}
+    assert results["aesgcm"]["stored_bytes"] < results["fernet"]["stored_bytes"]
+
+
+def test_decrypt_many_reads_every_key_id():
+    keys = f"k1:{_key()}"
+    old = build_cipher(keys=keys, active="k0").encrypt("written with k0")
+    cipher = build_cipher(keys=keys, active="k1")
+
+    assert cipher.aesgcm.decrypt_many([old, cipher.encrypt("a"), cipher.encrypt("b")]) == ["written with k0", "a", "b"]
+    with pytest.raises(KeyError):
+        cipher.aesgcm.decrypt_many([build_cipher(keys=f"k9:{_key()}", active="k9").encrypt("x")])
+
+
+def test_bulk_decode_matches_the_row_path_and_falls_back_on_bad_rows():
+    docs = [{"role": "user", "content": message_cipher.encrypt(f"m{i}"), "timestamp": datetime(2025, 1, 1, 0, i)}
+            for i in range(3)]
+    docs[1]["aborted"] = True
+    unreadable = build_cipher(keys=f"k9:{_key()}", active="k9").encrypt("secret")
+
+    assert decode_messages(docs) == [_message_out(doc) for doc in docs]
+    assert [m["content"] for m in decode_messages(docs + [{"role": "user", "content": unreadable}])] == ["m0", "m1", "m2", ""]
+    assert [m["content"] for m in decode_messages(docs + [{"role": "user", "content": "legacy"}])][-1] == "legacy"
+
+
+def test_bulk_benchmark_times_the_loop_and_bulk_paths():
+    results = bulk_benchmark(messages=50, size=100, rounds=1)
+
+    assert set(results) == {"fernet", "aesgcm"}
+    assert set(results["aesgcm"]) == {"loop", "bulk"}
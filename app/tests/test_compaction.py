@@ -0,0 +1,115 @@
+# app/tests/test_compaction.py
+from datetime import datetime
+from unittest.mock import patch
+
+import app.compaction as compaction
+from app.compaction import compact_history, build_chat_context
+
+
+def _messages(n):
+    return [
+        {"role": "user", "content": f"msg {i}", "timestamp": datetime(2025, 11, 7, 10, i)}
+        for i in range(n)
+    ]
+
+
+# -------------------------------
+# compact_history()
+# -------------------------------
+@patch("app.compaction.save_conversation_summary")
+@patch("app.compaction.get_response")
+@patch("app.compaction.count_unsummarized", return_value=5)
+@patch("app.compaction.get_conversation_summary", return_value=None)
+def test_compact_history_below_threshold_is_noop(mock_summary, mock_count, mock_llm, mock_save):
+    assert compact_history("alice") is False
+    mock_llm.assert_not_called()
+    mock_save.assert_not_called()
+
+
+@patch("app.compaction.HISTORY_RECENT_TURNS", 10)
+@patch("app.compaction.HISTORY_COMPACT_THRESHOLD", 40)
+@patch("app.compaction.save_conversation_summary")
+@patch("app.compaction.get_response", return_value="Alice asked about llamas.")
+@patch("app.compaction.get_unsummarized_messages")
+@patch("app.compaction.count_unsummarized", return_value=45)
+@patch("app.compaction.get_conversation_summary", return_value=None)
+def test_compact_history_folds_older_turns(mock_summary, mock_count, mock_get, mock_llm, mock_save):
+    older = _messages(35)
+    mock_get.return_value = older
+
+    assert compact_history("alice", model="llama3.2") is True
+
+    # keeps the last HISTORY_RECENT_TURNS messages out of the summary
+    mock_get.assert_called_once_with("alice", since=None, limit=35)
+    assert "msg 34" in mock_llm.call_args[0][0]
+    mock_save.assert_called_once_with("alice", "Alice asked about llamas.", older[-1]["timestamp"], "llama3.2", None)
+
+
+@patch("app.compaction.HISTORY_RECENT_TURNS", 2)
+@patch("app.compaction.HISTORY_COMPACT_THRESHOLD", 3)
+@patch("app.compaction.save_conversation_summary")
+@patch("app.compaction.get_response", return_value="recap")
+@patch("app.compaction.get_unsummarized_messages")
+@patch("app.compaction.count_unsummarized", return_value=5)
+@patch("app.compaction.get_conversation_summary")
+def test_summary_expires_with_the_last_folded_message(mock_summary, mock_count, mock_get, mock_llm, mock_save):
+    older = _messages(3)
+    for i, message in enumerate(older):
+        message["expires_at"] = datetime(2026, 1, 1 + i)
+    mock_summary.return_value = {"content": "old", "watermark": datetime(2025, 11, 7, 9, 0),
+                                 "expires_at": datetime(2025, 12, 1)}
+    mock_get.return_value = older
+
+    assert compact_history("alice") is True
+    assert mock_save.call_args[0][4] == datetime(2026, 1, 3)
+
+    mock_summary.return_value["expires_at"] = None  # built from messages kept forever
+    compact_history("alice")
+    assert mock_save.call_args[0][4] is None
+
+
+@patch("app.compaction.HISTORY_RECENT_TURNS", 50)
+@patch("app.compaction.HISTORY_COMPACT_THRESHOLD", 40)
+@patch("app.compaction.get_response")
+@patch("app.compaction.get_unsummarized_messages")
+@patch("app.compaction.count_unsummarized", return_value=45)
+@patch("app.compaction.get_conversation_summary", return_value=None)
+def test_compact_history_keeps_recent_turns_above_threshold(mock_summary, mock_count, mock_get, mock_llm):
+    # recent turns >= pending: nothing may be folded (limit=0 would mean "all messages")
+    assert compact_history("alice") is False
+    mock_get.assert_not_called()
+    mock_llm.assert_not_called()
+
+
+@patch("app.compaction.HISTORY_COMPACT_THRESHOLD", 2)
+@patch("app.compaction.save_conversation_summary")
+@patch("app.compaction.get_response", return_value="updated")
+@patch("app.compaction.get_unsummarized_messages")
+@patch("app.compaction.count_unsummarized", return_value=30)
+@patch("app.compaction.get_conversation_summary")
+def test_compact_history_extends_previous_summary(mock_summary, mock_count, mock_get, mock_llm, mock_save):
+    watermark = datetime(2025, 11, 7, 9, 0)
+    mock_summary.return_value = {"content": "Earlier facts.", "watermark": watermark}
+    mock_get.return_value = _messages(3)
+
+    compact_history("bob")
+
+    mock_count.assert_called_once_with("bob", since=watermark)
+    assert "Earlier facts." in mock_llm.call_args[0][0]
+
+
+@patch("app.compaction.get_conversation_summary", side_effect=Exception("db down"))
+def test_compact_history_swallows_errors(mock_summary):
+    assert compact_history("carol") is False
+    assert "carol" not in compaction._running
+
+
+# -------------------------------
+# build_chat_context()
+# -------------------------------
+def test_build_chat_context_without_summary_uses_last_turns():
+    history = [{"role": "user", "content": f"m{i}"} for i in range(15)]
+    context = build_chat_context(history, None, limit=10)
+    assert "m4" not in context
+    assert context.splitlines()[0] == "user: m5"
+    assert context.splitlines()[-1] == "user: m14"
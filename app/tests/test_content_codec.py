@@ -0,0 +1,53 @@
+# app/tests/test_content_codec.py
+from functools import partial
+from unittest.mock import patch
+
+import pytest
+
+from app import chat_history
+from app.content_codec import compress_content, decompress_content, resolve_codec, savings_report
+
+LONG = "The contract renews automatically unless either party gives notice. " * 20
+
+
+def test_small_text_is_left_uncompressed():
+    data, codec = compress_content("hi", "zlib", min_bytes=512)
+
+    assert (data, codec) == (b"hi", None)
+
+
+def test_long_text_round_trips():
+    data, codec = compress_content(LONG, "zlib", min_bytes=512)
+
+    assert codec == "zlib"
+    assert len(data) < len(LONG)
+    assert decompress_content(data, codec) == LONG
+
+
+def test_text_that_would_grow_is_stored_as_is():
+    assert compress_content("abc", "zlib", min_bytes=1) == (b"abc", None)
+
+
+def test_resolve_codec():
+    assert resolve_codec("none") is None
+    assert resolve_codec("auto") in ("zlib", "zstd")
+    with pytest.raises(ValueError):
+        resolve_codec("lz4")
+
+
+def test_compressed_documents_are_flagged_and_read_transparently():
+    with patch("app.chat_history.compress_content", partial(compress_content, codec="zlib", min_bytes=512)):
+        long_doc = chat_history.build_message_doc("alice", "assistant", LONG)
+        short_doc = chat_history.build_message_doc("alice", "user", "short")
+
+    assert long_doc["compression"] == "zlib"
+    assert "compression" not in short_doc
+    assert chat_history._message_out(long_doc)["content"] == LONG
+    assert chat_history._message_out(short_doc)["content"] == "short"
+
+
+def test_savings_report_compares_against_uncompressed():
+    report = savings_report(codecs=["zlib"])
+
+    assert report["none"]["saved"] == 0
+    assert report["zlib"]["stored_bytes"] < report["none"]["stored_bytes"]
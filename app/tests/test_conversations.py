@@ -0,0 +1,165 @@
+# app/tests/test_conversations.py
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.app import app, get_current_user
+from app.async_chat_history import get_history_page, get_recent_history, pending_thread_purges
+from app.chat_history import count_unsummarized
+from app.conversations import delete_conversation, purge_conversation
+from app.history_cache import history_cache
+from app.loadtest.memory_store import MemoryCollection, AsyncMemoryCollection
+
+client = TestClient(app)
+AUTH = {"Authorization": "Bearer test_token"}
+
+
+@pytest.fixture(autouse=True)
+def fake_user():
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    yield
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def memory_chats():
+    collection = MemoryCollection()
+    with patch("app.chat_history.chats", collection), \
+            patch("app.async_chat_history.async_chats", AsyncMemoryCollection(collection)):
+        yield collection
+
+
+def _new(title=None):
+    response = client.post("/conversations", json={"title": title} if title else {}, headers=AUTH)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_thread_crud():
+    first = _new()
+    second = _new("Trip planning")
+
+    assert first["title"] == "New conversation"
+    assert first["message_count"] == 0
+    listed = client.get("/conversations", headers=AUTH).json()["conversations"]
+    assert {c["id"] for c in listed} == {first["id"], second["id"]}
+
+    renamed = client.patch(f"/conversations/{first['id']}", json={"title": "Taxes"}, headers=AUTH).json()
+    assert renamed["title"] == "Taxes"
+    assert client.get(f"/conversations/{first['id']}", headers=AUTH).json()["title"] == "Taxes"
+
+    assert client.delete(f"/conversations/{first['id']}", headers=AUTH).status_code == 200
+    assert client.get(f"/conversations/{first['id']}", headers=AUTH).status_code == 404
+
+
+def test_other_users_threads_are_not_found():
+    thread = _new()
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "bob"}
+
+    assert client.get(f"/conversations/{thread['id']}", headers=AUTH).status_code == 404
+    assert client.delete(f"/conversations/{thread['id']}", headers=AUTH).status_code == 404
+    assert client.get(f"/history?conversation_id={thread['id']}", headers=AUTH).status_code == 404
+    assert client.get("/conversations/not-an-id", headers=AUTH).status_code == 404
+
+
+@patch("app.app.compact_history")
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+def test_chat_context_and_history_are_scoped_to_the_thread(mock_llm, mock_compact, memory_chats):
+    taxes, trip = _new("Taxes")["id"], _new("Trip")["id"]
+
+    client.post("/chat", json={"prompt": "deductions?", "conversation_id": taxes}, headers=AUTH)
+    client.post("/chat", json={"prompt": "flights to Lisbon?", "conversation_id": trip}, headers=AUTH)
+
+    sent_prompt = mock_llm.call_args[0][0]
+    assert "flights to Lisbon?" in sent_prompt
+    assert "deductions?" not in sent_prompt
+    mock_compact.assert_not_called()
+
+    page = client.get(f"/history?conversation_id={trip}", headers=AUTH).json()
+    assert [m["content"] for m in page["messages"]] == ["ok", "flights to Lisbon?"]
+    assert len(client.get("/history", headers=AUTH).json()["messages"]) == 4  # unscoped stream has both
+
+    info = client.get(f"/conversations/{trip}", headers=AUTH).json()
+    assert info["message_count"] == 2
+    assert client.get("/conversations", headers=AUTH).json()["conversations"][0]["id"] == trip
+
+
+def test_chat_in_unknown_thread_is_rejected():
+    response = client.post("/chat", json={"prompt": "hi", "conversation_id": "64b000000000000000000000"}, headers=AUTH)
+
+    assert response.status_code == 404
+
+
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+def test_deleted_thread_messages_are_purged(mock_llm, memory_chats):
+    doomed, kept = _new()["id"], _new()["id"]
+    client.post("/chat", json={"prompt": "a", "conversation_id": doomed}, headers=AUTH)
+    client.post("/chat", json={"prompt": "b", "conversation_id": kept}, headers=AUTH)
+
+    client.delete(f"/conversations/{doomed}", headers=AUTH)
+    asyncio.run(purge_conversation("alice", doomed))  # finishes the background purge, if still running
+
+    assert {d["conversation_id"] for d in memory_chats.find({})} == {kept}
+    assert history_cache.get(("alice", kept), 1) is None  # invalidated with the rest of the user's entries
+
+
+def test_turn_finishing_after_its_thread_is_deleted_is_not_saved(memory_chats, purge_markers):
+    from app.app import save_exchange
+
+    thread = _new()["id"]
+    asyncio.run(delete_conversation("alice", thread))
+    asyncio.run(purge_conversation("alice", thread))
+
+    asyncio.run(save_exchange("alice", "late prompt", "late reply", conversation_id=thread))
+
+    assert memory_chats.count_documents({}) == 0
+
+
+def test_thread_deleted_during_the_save_is_purged_again(memory_chats, purge_markers):
+    from app.app import save_exchange
+    from app.async_chat_history import save_turn
+
+    thread = _new()["id"]
+
+    async def racing_save(*args, **kwargs):
+        await delete_conversation("alice", thread)
+        await purge_conversation("alice", thread)  # the background purge finishes before the turn lands
+        await save_turn(*args, **kwargs)
+
+    with patch("app.app.save_turn", racing_save):
+        asyncio.run(save_exchange("alice", "late prompt", "late reply", conversation_id=thread))
+
+    assert memory_chats.count_documents({}) == 0
+    assert purge_markers.count_documents({}) == 0
+    assert asyncio.run(get_history_page("alice"))["messages"] == []
+
+
+@patch("app.app.compact_history")
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+def test_unscoped_chat_does_not_see_thread_messages(mock_llm, mock_compact, memory_chats):
+    thread = _new()["id"]
+    client.post("/chat", json={"prompt": "secret thread topic", "conversation_id": thread}, headers=AUTH)
+
+    client.post("/chat", json={"prompt": "hello"}, headers=AUTH)
+
+    assert "secret thread topic" not in mock_llm.call_args[0][0]
+    assert [m["content"] for m in asyncio.run(get_recent_history("alice", 10))] == ["hello", "ok"]
+    assert count_unsummarized("alice") == 2  # compaction only folds the unscoped stream
+    assert len(client.get("/history", headers=AUTH).json()["messages"]) == 4  # "All messages" still has both
+
+
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+def test_deleted_thread_is_hidden_before_its_purge(mock_llm, memory_chats):
+    doomed = _new()["id"]
+    client.post("/chat", json={"prompt": "a", "conversation_id": doomed}, headers=AUTH)
+
+    asyncio.run(delete_conversation("alice", doomed))  # no purge yet
+
+    assert memory_chats.count_documents({"conversation_id": doomed}) == 2
+    assert asyncio.run(get_history_page("alice"))["messages"] == []
+    assert asyncio.run(pending_thread_purges()) == [("alice", doomed)]  # resumed at startup
+
+    asyncio.run(purge_conversation("alice", doomed))
+    assert asyncio.run(pending_thread_purges()) == []
@@ -0,0 +1,158 @@
+# app/tests/test_history_cache.py
+import asyncio
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from app import async_chat_history
+from app.history_cache import HotHistoryCache, history_cache
+from app.loadtest.memory_store import memory_collections
+
+BASE = datetime(2025, 1, 1)
+
+
+def _items(start, n):
+    return [(BASE + timedelta(minutes=i), i, {"role": "user", "content": f"m{i}"}) for i in range(start, start + n)]
+
+
+def _contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_miss_then_hit_after_prime():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=60)
+
+    assert cache.get("alice", 3) is None
+    cache.prime("alice", _items(0, 3), limit=3)
+
+    assert _contents(cache.get("alice", 3)) == ["m0", "m1", "m2"]
+    assert _contents(cache.get("alice", 2)) == ["m1", "m2"]
+    assert cache.get("alice", 4) is None  # older messages may exist beyond what was read
+
+
+def test_short_read_covers_everything_after_since():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=60)
+    cache.prime("alice", _items(0, 2), limit=10)
+
+    assert _contents(cache.get("alice", 10)) == ["m0", "m1"]
+    assert _contents(cache.get("alice", 10, since=BASE)) == ["m1"]
+
+
+def test_append_writes_through_and_trims_to_per_user():
+    cache = HotHistoryCache(max_users=10, per_user=3, idle_ttl=60)
+    cache.prime("alice", _items(0, 2), limit=10)
+
+    cache.append("alice", _items(2, 2))
+
+    assert _contents(cache.get("alice", 3)) == ["m1", "m2", "m3"]
+    assert cache.get("alice", 4) is None  # m0 was trimmed
+
+
+def test_prime_is_skipped_when_a_write_raced_the_read():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=60)
+    token = cache.read_token()
+    cache.append("alice", _items(5, 1))  # lands while the tail read is in flight
+
+    cache.prime("alice", _items(0, 2), limit=10, token=token)
+
+    assert cache.get("alice", 2) is None
+
+
+def test_invalidate_drops_user():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=60)
+    cache.prime("alice", _items(0, 2), limit=10)
+
+    cache.invalidate("alice")
+
+    assert cache.get("alice", 2) is None
+    assert cache.stats() == {"users": 0, "bytes": 0}
+
+
+def test_least_recently_used_user_is_evicted():
+    cache = HotHistoryCache(max_users=2, per_user=5, idle_ttl=60)
+    cache.prime("alice", _items(0, 1), limit=10)
+    cache.prime("bob", _items(0, 1), limit=10)
+    cache.get("alice", 1)
+
+    cache.prime("carol", _items(0, 1), limit=10)
+
+    assert cache.get("bob", 1) is None
+    assert cache.get("alice", 1) is not None
+    assert cache.stats()["users"] == 2
+
+
+def test_idle_entries_expire():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=0.05)
+    cache.prime("alice", _items(0, 1), limit=10)
+
+    time.sleep(0.1)
+
+    assert cache.get("alice", 1) is None
+    assert cache.stats()["users"] == 0
+
+
+def test_reports_memory_use():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=60)
+    cache.prime("alice", _items(0, 3), limit=10)
+    full = cache.stats()["bytes"]
+
+    assert full > 0
+    cache.prime("alice", _items(0, 1), limit=10)
+    assert 0 < cache.stats()["bytes"] < full
+
+
+def test_disabled_cache_never_hits():
+    cache = HotHistoryCache(max_users=0, per_user=5, idle_ttl=60)
+    cache.prime("alice", _items(0, 1), limit=10)
+
+    assert cache.get("alice", 1) is None
+
+
+@pytest.fixture
+def memory_chats():
+    with memory_collections("chats") as stores:
+        yield stores["chats"]
+
+
+def _save_turn(*args):
+    asyncio.run(async_chat_history.save_turn(*args))
+
+
+def _recent(username, limit):
+    return asyncio.run(async_chat_history.get_recent_history(username, limit))
+
+
+def test_steady_state_turns_skip_the_database(memory_chats):
+    _save_turn("alice", "Q1", "A1")
+    assert _contents(_recent("alice", 10)) == ["Q1", "A1"]  # primes
+
+    _save_turn("alice", "Q2", "A2")
+    with patch.object(memory_chats, "find", side_effect=AssertionError("cache miss")):
+        recent = _recent("alice", 10)
+
+    assert _contents(recent) == ["Q1", "A1", "Q2", "A2"]
+
+
+def test_clear_history_invalidates_cache(memory_chats):
+    _save_turn("alice", "Q1", "A1")
+    _recent("alice", 10)
+
+    asyncio.run(async_chat_history.clear_history("alice"))
+
+    assert history_cache.get("alice", 10) is None
+    assert _recent("alice", 10) == []
+
+
+def test_threads_are_cached_separately_and_invalidated_with_the_user():
+    cache = HotHistoryCache(max_users=10, per_user=5, idle_ttl=60)
+    cache.prime(("alice", "t1"), _items(0, 2), limit=10)
+    cache.prime("alice", _items(0, 4), limit=10)
+
+    assert _contents(cache.get(("alice", "t1"), 10)) == ["m0", "m1"]
+
+    cache.invalidate("alice")
+
+    assert cache.get(("alice", "t1"), 10) is None
+    assert cache.stats()["users"] == 0
@@ -0,0 +1,175 @@
+# app/tests/test_idempotency.py
+import asyncio
+import threading
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.app import app, get_current_user
+from app.idempotency import IdempotencyStore, IdempotencyConflict, idempotency_store
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def logged_in():
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    yield {"Authorization": "Bearer x"}
+    app.dependency_overrides.clear()
+    idempotency_store._entries.clear()
+
+
+# -------------------------------
+# Store
+# -------------------------------
+def test_duplicate_claim_waits_for_first_result():
+    store = IdempotencyStore(ttl=60)
+    future, owner = store.claim("generate:alice", "k1", "fp")
+    duplicate, dup_owner = store.claim("generate:alice", "k1", "fp")
+
+    assert owner is True and dup_owner is False
+    assert duplicate is future
+
+    threading.Timer(0.05, store.complete, ("generate:alice", "k1", {"response": "hi"})).start()
+    assert duplicate.result(timeout=1) == {"response": "hi"}
+
+
+def test_claim_with_different_body_conflicts():
+    store = IdempotencyStore(ttl=60)
+    store.claim("generate:alice", "k1", "fp")
+    with pytest.raises(IdempotencyConflict):
+        store.claim("generate:alice", "k1", "other")
+
+
+def test_keys_are_scoped_per_user():
+    store = IdempotencyStore(ttl=60)
+    store.claim("generate:alice", "k1", "fp")
+    _, owner = store.claim("generate:bob", "k1", "fp")
+    assert owner is True
+
+
+def test_completed_entries_expire():
+    store = IdempotencyStore(ttl=0)
+    store.claim("chat:alice", "k1")
+    store.complete("chat:alice", "k1", {"response": "hi"})
+
+    _, owner = store.claim("chat:alice", "k1")
+    assert owner is True
+
+
+def test_release_lets_the_next_request_run():
+    store = IdempotencyStore(ttl=60)
+    future, _ = store.claim("chat:alice", "k1")
+    store.release("chat:alice", "k1")
+
+    assert future.result(timeout=1) is None
+    _, owner = store.claim("chat:alice", "k1")
+    assert owner is True
+
+
+# -------------------------------
+# Endpoints
+# -------------------------------
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("once", {}))
+def test_generate_retry_reuses_first_result(mock_llm, mock_save, logged_in):
+    headers = {**logged_in, "Idempotency-Key": "retry-1"}
+    body = {"text": "hi", "model": "llama3.2"}
+
+    first = client.post("/generate", json=body, headers=headers)
+    second = client.post("/generate", json=body, headers=headers)
+
+    assert first.json() == second.json() == {"response": "once", "model": "llama3.2"}
+    mock_llm.assert_called_once()
+    mock_save.assert_called_once()  # one turn, not two
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("once", {}))
+def test_generate_key_reused_for_other_prompt_is_rejected(mock_llm, mock_save, logged_in):
+    headers = {**logged_in, "Idempotency-Key": "retry-2"}
+    client.post("/generate", json={"text": "hi", "model": "llama3.2"}, headers=headers)
+
+    resp = client.post("/generate", json={"text": "bye", "model": "llama3.2"}, headers=headers)
+
+    assert resp.status_code == 422
+    mock_llm.assert_called_once()
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("partial", {"aborted": True}))
+def test_aborted_generation_is_not_cached(mock_llm, mock_save, logged_in):
+    headers = {**logged_in, "Idempotency-Key": "retry-3"}
+    body = {"text": "hi", "model": "llama3.2"}
+
+    client.post("/generate", json=body, headers=headers)
+    client.post("/generate", json=body, headers=headers)
+
+    assert mock_llm.call_count == 2
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("once", {}))
+def test_keyed_generation_is_not_aborted_on_disconnect(mock_llm, mock_save, logged_in):
+    body = {"text": "hi", "model": "llama3.2"}
+
+    client.post("/generate", json=body, headers=logged_in)
+    assert mock_llm.call_args[1]["cancel"] is not None
+
+    client.post("/generate", json=body, headers={**logged_in, "Idempotency-Key": "keep-1"})
+    assert mock_llm.call_args[1]["cancel"] is None  # the retry attaches to this run instead of starting over
+
+
+def test_owner_finishes_when_its_request_is_cancelled(logged_in):
+    from app.app import run_idempotent
+
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"response": "done"}, True
+
+    async def scenario():
+        first = asyncio.ensure_future(run_idempotent("chat:alice", "hung-up", "fp", call))
+        await asyncio.sleep(0.01)
+        first.cancel()  # the client hung up
+        return await run_idempotent("chat:alice", "hung-up", "fp", call)
+
+    assert asyncio.run(scenario()) == {"response": "done"}
+    assert len(calls) == 1
+
+
+def test_streaming_generate_rejects_idempotency_key(logged_in):
+    headers = {**logged_in, "Idempotency-Key": "stream-1"}
+
+    resp = client.post("/generate", json={"text": "hi", "model": "llama3.2", "stream": True}, headers=headers)
+
+    assert resp.status_code == 400
+
+
+@patch("app.app.compact_history")
+@patch("app.app.get_conversation_summary", return_value=None)
+@patch("app.app.get_recent_history", return_value=[])
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("reply", {}))
+def test_chat_retry_reuses_first_reply(mock_llm, mock_save, mock_history, mock_summary, mock_compact, logged_in):
+    headers = {**logged_in, "Idempotency-Key": "chat-1"}
+
+    first = client.post("/chat", json={"prompt": "hi"}, headers=headers)
+    second = client.post("/chat", json={"prompt": "hi"}, headers=headers)
+
+    assert first.json() == second.json() == {"response": "reply"}
+    mock_llm.assert_called_once()
+    mock_save.assert_called_once()
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("fresh", {}))
+def test_requests_without_key_are_not_deduplicated(mock_llm, mock_save, logged_in):
+    body = {"text": "hi", "model": "llama3.2"}
+    client.post("/generate", json=body, headers=logged_in)
+    client.post("/generate", json=body, headers=logged_in)
+
+    assert mock_llm.call_count == 2
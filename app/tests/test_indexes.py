@@ -0,0 +1,107 @@
+# app/tests/test_indexes.py
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.indexes import (
+    ensure_indexes, check_history_plan, check_count_plan, plan_stages, IndexCheckError, HISTORY_INDEXES,
+)
+
+
+def _collection(index_keys):
+    collection = MagicMock()
+    collection.index_information.return_value = {
+        "_id_": {"key": [("_id", 1)]},
+        "username_timestamp_id": {"key": index_keys},
+        "username_conversation_timestamp_id": {"key": [("username", 1), ("conversation_id", 1), ("timestamp", 1), ("_id", 1)]},
+        "expires_at_ttl": {"key": [("expires_at", 1)], "expireAfterSeconds": 0},
+    }
+    return collection
+
+
+def test_ensure_indexes_creates_compound_and_ttl_indexes():
+    collection = _collection([("username", 1), ("timestamp", 1), ("_id", 1)])
+
+    assert ensure_indexes(collection) == ["username_timestamp_id", "username_conversation_timestamp_id", "expires_at_ttl"]
+    collection.create_index.assert_any_call(
+        [("username", 1), ("timestamp", 1), ("_id", 1)], name="username_timestamp_id"
+    )
+    collection.create_index.assert_any_call(
+        [("expires_at", 1)], name="expires_at_ttl", expireAfterSeconds=0,
+        partialFilterExpression={"expires_at": {"$exists": True}},
+    )
+
+
+def test_ensure_indexes_rejects_unexpected_keys():
+    collection = _collection([("timestamp", 1)])
+
+    with pytest.raises(IndexCheckError):
+        ensure_indexes(collection, HISTORY_INDEXES)
+
+
+def test_plan_stages_unwraps_slot_based_plans():
+    plan = {"queryPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "username_timestamp_id"}}}
+    assert plan_stages(plan) == ["FETCH", "IXSCAN"]
+
+
+def _explain(plan):
+    return {"queryPlanner": {"winningPlan": plan}}
+
+
+def _find_explains(mock_chats, *plans):
+    cursor = mock_chats.find.return_value.sort.return_value.limit.return_value
+    cursor.explain.side_effect = [_explain(plan) for plan in plans]
+
+
+@patch("app.indexes.chats")
+def test_history_plan_checks_the_tail_and_page_queries(mock_chats):
+    _find_explains(mock_chats, *[{"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}] * 4)
+
+    assert check_history_plan() == ["FETCH", "IXSCAN"]
+    queries = [call[0][0] for call in mock_chats.find.call_args_list]
+    sorts = [call[0][0] for call in mock_chats.find.return_value.sort.call_args_list]
+    assert queries[0] == {"username": "__index_check__", "conversation_id": None}  # the unscoped /chat tail
+    assert queries[1] == {"username": "__index_check__", "conversation_id": "__index_check__"}
+    assert queries[2]["conversation_id"] == {"$nin": ["__index_check__"]} and "$or" in queries[2]
+    assert sorts == [[("timestamp", -1), ("_id", -1)]] * 4
+
+
+@patch("app.indexes.chats")
+def test_history_plan_fails_on_collection_scan(mock_chats):
+    _find_explains(mock_chats, {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}})
+    with pytest.raises(IndexCheckError, match="recent history is not an index scan"):
+        check_history_plan()
+
+
+@patch("app.indexes.chats")
+def test_history_plan_fails_on_in_memory_page_sort(mock_chats):
+    index_scan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+    _find_explains(mock_chats, index_scan, index_scan,
+                   {"stage": "SORT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}})
+    with pytest.raises(IndexCheckError, match="history page sorts in memory"):
+        check_history_plan()
+
+
+@patch("app.indexes.chats")
+def test_count_plan_accepts_count_scan(mock_chats):
+    mock_chats.database.command.return_value = _explain({"stage": "COUNT", "inputStage": {"stage": "COUNT_SCAN"}})
+
+    assert check_count_plan() == ["COUNT", "COUNT_SCAN"]
+    queries = [call[0][1]["query"] for call in mock_chats.database.command.call_args_list]
+    assert {"username": "__index_check__", "conversation_id": "__index_check__"} in queries
+
+
+@patch("app.indexes.chats")
+def test_count_plan_fails_when_documents_are_fetched(mock_chats):
+    mock_chats.database.command.return_value = _explain(
+        {"stage": "COUNT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+    )
+    with pytest.raises(IndexCheckError, match="not a COUNT_SCAN"):
+        check_count_plan()
+
+
+def test_summaries_expire_through_a_ttl_index():
+    from app.indexes import SUMMARY_INDEXES
+
+    [ttl] = SUMMARY_INDEXES
+    assert ttl["keys"] == [("expires_at", 1)] and ttl["expireAfterSeconds"] == 0
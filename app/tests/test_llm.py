@@ -1,4 +1,9 @@
+import asyncio
+import json
+import threading
+import time
 import pytest
+import requests
 from unittest.mock import patch, MagicMock
 import app.llm  # Adjust the import path if needed
 from app.settings import MODEL
@@ -55,4 +60,220 @@ def test_get_response_raises_exception(mock_post):
     with pytest.raises(Exception) as excinfo:
         app.llm.get_response(prompt)
     
-    assert "Network error" in str(excinfo.value)
\ No newline at end of file
+    assert "Network error" in str(excinfo.value)
+
+@patch("app.llm.requests.post")
+@patch("app.llm.OLLAMA_API_URL", "http://localhost:11434")
+def test_get_response_with_stats_converts_ollama_counters(mock_post):
+    mock_response = MagicMock()
+    mock_response.json.return_value = {
+        "response": "Hi",
+        "total_duration": 3_000_000_000,
+        "load_duration": 500_000_000,
+        "prompt_eval_count": 12,
+        "prompt_eval_duration": 250_000_000,
+        "eval_count": 40,
+        "eval_duration": 2_000_000_000,
+    }
+    mock_post.return_value = mock_response
+
+    text, stats = app.llm.get_response_with_stats("Say hi", "llama3.2")
+
+    assert text == "Hi"
+    assert stats["total_duration"] == 3.0
+    assert stats["load_duration"] == 0.5
+    assert stats["prompt_eval_count"] == 12
+    assert stats["tokens_per_second"] == 20.0
+    assert stats["ttft"] is None  # non-streaming: headers only arrive with the whole answer
+    assert stats["e2e"] >= 0
+
+
+@patch("app.llm.requests.post")
+@patch("app.llm.OLLAMA_API_URL", "http://localhost:11434")
+def test_get_response_with_stats_records_metrics(mock_post):
+    from app.metrics import LLM_TOKENS_PER_SECOND
+
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"response": "ok", "eval_count": 10, "eval_duration": 1_000_000_000}
+    mock_post.return_value = mock_response
+
+    before = LLM_TOKENS_PER_SECOND.quantile(0.5, model="metrics-test-model")
+    app.llm.get_response_with_stats("x", "metrics-test-model")
+
+    assert before is None
+    assert LLM_TOKENS_PER_SECOND.quantile(0.5, model="metrics-test-model") == 10.0
+
+
+@patch("app.llm.requests.post")
+@patch("app.llm.OLLAMA_API_URL", "http://localhost:11434")
+def test_get_response_passes_deadline_as_timeout(mock_post):
+    mock_post.return_value.json.return_value = {"response": "ok"}
+
+    app.llm.get_response("hello", "llama3.2", timeout=7)
+
+    connect_timeout, read_timeout = mock_post.call_args[1]["timeout"]
+    assert 6.9 < read_timeout <= 7  # deadline minus time spent queued for a slot
+
+
+# -------------------------------
+# Hedged requests
+# -------------------------------
+
+
+class FakeStream:
+    """Streaming Ollama response that waits `delay` seconds (or until closed) before emitting"""
+
+    def __init__(self, text, delay=0.0):
+        self.text = text
+        self.delay = delay
+        self.closed = threading.Event()
+
+    def iter_lines(self):
+        if self.closed.wait(self.delay):
+            raise requests.exceptions.ConnectionError("connection closed")
+        yield json.dumps({"response": self.text, "done": False}).encode()
+        yield json.dumps({"response": "", "done": True, "eval_count": 5, "eval_duration": 500_000_000}).encode()
+
+    def close(self):
+        self.closed.set()
+
+
+def _hedged(**overrides):
+    settings = {
+        "app.llm.LLM_HEDGE_ENABLED": True,
+        "app.llm.OLLAMA_BACKENDS": ["http://primary", "http://secondary"],
+        "app.llm.LLM_HEDGE_DELAY": 0.05,
+        "app.llm.LLM_HEDGE_MIN_SAMPLES": 10_000,
+    }
+    settings.update(overrides)
+    patches = [patch(target, value) for target, value in settings.items()]
+    for p in patches:
+        p.start()
+    return patches
+
+
+def test_hedged_request_uses_second_backend_when_primary_is_slow():
+    streams = {"http://primary": FakeStream("slow", delay=5), "http://secondary": FakeStream("fast")}
+    patches = _hedged()
+    try:
+        with patch("app.llm.requests.post", side_effect=lambda url, **kw: streams[url]):
+            text, stats = app.llm.get_response_with_stats("hi", "hedge-model", timeout=3)
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert text == "fast"
+    assert stats["backend"] == "http://secondary"
+    assert stats["eval_count"] == 5
+    assert streams["http://primary"].closed.is_set()  # loser cancelled
+
+
+def test_hedged_request_skips_duplicate_when_primary_is_fast():
+    streams = {"http://primary": FakeStream("fast")}
+    patches = _hedged(**{"app.llm.LLM_HEDGE_DELAY": 1.0})
+    try:
+        with patch("app.llm.requests.post", side_effect=lambda url, **kw: streams[url]) as mock_post:
+            text, stats = app.llm.get_response_with_stats("hi", "hedge-model", timeout=3)
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert text == "fast"
+    assert mock_post.call_count == 1
+
+
+def test_hedged_request_raises_timeout_past_deadline():
+    streams = {"http://primary": FakeStream("slow", delay=5), "http://secondary": FakeStream("slow", delay=5)}
+    patches = _hedged()
+    try:
+        with patch("app.llm.requests.post", side_effect=lambda url, **kw: streams[url]):
+            with pytest.raises(requests.exceptions.Timeout):
+                app.llm.get_response_with_stats("hi", "hedge-model", timeout=0.2)
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert all(stream.closed.is_set() for stream in streams.values())
+
+
+# -------------------------------
+# Cancellation on client disconnect
+# -------------------------------
+
+
+class SlowStream(FakeStream):
+    """Emits one token, then blocks until the connection is closed"""
+
+    def iter_lines(self):
+        yield json.dumps({"response": "partial", "done": False}).encode()
+        self.closed.wait(5)
+        raise requests.exceptions.ConnectionError("connection closed")
+
+
+@patch("app.llm.OLLAMA_API_URL", "http://localhost:11434")
+def test_cancel_token_aborts_streaming_generation():
+    stream = SlowStream("")
+    cancel = app.llm.CancelToken()
+
+    with patch("app.llm.requests.post", return_value=stream):
+        threading.Timer(0.1, cancel.cancel).start()
+        started = time.monotonic()
+        text, stats = app.llm.get_response_with_stats("hi", "llama3.2", cancel=cancel)
+
+    assert time.monotonic() - started < 2
+    assert text == "partial"
+    assert stats["aborted"] is True
+    assert stream.closed.is_set()
+
+
+class DripStream(FakeStream):
+    """Emits a token every `delay` seconds for `count` tokens, so no single gap hits a read timeout"""
+
+    def __init__(self, count, delay):
+        super().__init__("", delay)
+        self.count = count
+
+    def iter_lines(self):
+        for i in range(self.count):
+            if self.closed.wait(self.delay):
+                raise requests.exceptions.ConnectionError("connection closed")
+            yield json.dumps({"response": f"t{i} ", "done": False}).encode()
+        yield json.dumps({"response": "", "done": True}).encode()
+
+
+@patch("app.llm.OLLAMA_API_URL", "http://localhost:11434")
+def test_streaming_call_enforces_a_total_deadline():
+    stream = DripStream(count=40, delay=0.05)
+
+    with patch("app.llm.requests.post", return_value=stream):
+        started = time.monotonic()
+        with pytest.raises(requests.exceptions.Timeout):
+            app.llm.get_response_with_stats("hi", "llama3.2", timeout=0.3, cancel=app.llm.CancelToken())
+
+    assert time.monotonic() - started < 1
+    assert stream.closed.is_set()
+
+
+@patch("app.llm.LLM_DISCONNECT_POLL", 0.01)
+def test_cancel_on_disconnect_cancels_when_client_leaves():
+    from app.metrics import LLM_CANCELLED
+
+    seen = {}
+
+    def call(cancel):
+        seen["token"] = cancel
+        for _ in range(200):
+            if cancel.cancelled:
+                return "partial", {"aborted": True}
+            time.sleep(0.01)
+        return "full", {}
+
+    async def is_disconnected():
+        return True
+
+    before = LLM_CANCELLED.value(model="m", endpoint="chat")
+    text, stats = asyncio.run(app.llm.cancel_on_disconnect(call, is_disconnected, "m", "chat"))
+
+    assert text == "partial"
+    assert seen["token"].cancelled
+    assert LLM_CANCELLED.value(model="m", endpoint="chat") == before + 1
@@ -0,0 +1,121 @@
+# app/tests/test_loadtest.py
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+import requests
+
+from app.async_chat_history import save_user_messages, get_history_page, clear_history
+from app.keycloak_utils import verify_token
+from app.llm import get_response_with_stats, CancelToken
+from app.loadtest.fake_keycloak import FakeKeycloak
+from app.loadtest.fake_ollama import FakeOllama, FakeOllamaConfig
+from app.loadtest.memory_store import memory_collections
+from app.loadtest.run import LoadReport, percentile, parse_mix
+
+FAST = FakeOllamaConfig(latency=0, tokens_per_second=0, tokens=5)
+
+
+# -------------------------------
+# Fake Ollama
+# -------------------------------
+def test_fake_ollama_serves_generate_with_eval_counters():
+    with FakeOllama(FAST) as ollama, patch("app.llm.OLLAMA_API_URL", f"{ollama.url}/api/generate"):
+        text, stats = get_response_with_stats("hi", "llama3.2", priority="batch")
+
+    assert text == "lorem ipsum dolor sit amet "
+    assert stats["eval_count"] == 5
+    assert stats["tokens_per_second"] > 0
+
+
+def test_fake_ollama_streams_and_sees_client_abort():
+    slow = FakeOllamaConfig(latency=0, tokens_per_second=20, tokens=200)
+    with FakeOllama(slow) as ollama, patch("app.llm.OLLAMA_API_URL", f"{ollama.url}/api/generate"):
+        cancel = CancelToken()
+        threading.Timer(0.3, cancel.cancel).start()
+        text, stats = get_response_with_stats("hi", "llama3.2", cancel=cancel)
+
+        for _ in range(50):
+            if ollama.counts["aborted"]:
+                break
+            time.sleep(0.05)
+
+    assert stats["aborted"] is True
+    assert 0 < len(text.split()) < 200
+    assert ollama.counts["aborted"] == 1
+
+
+def test_fake_ollama_chat_and_embeddings():
+    with FakeOllama(FakeOllamaConfig(latency=0, tokens_per_second=0, tokens=2, embedding_dims=8)) as ollama:
+        chat = requests.post(f"{ollama.url}/api/chat", json={
+            "model": "m", "messages": [{"role": "user", "content": "hi"}], "stream": False,
+        }).json()
+        first = requests.post(f"{ollama.url}/api/embeddings", json={"model": "m", "prompt": "hi"}).json()
+        again = requests.post(f"{ollama.url}/api/embeddings", json={"model": "m", "prompt": "hi"}).json()
+
+    assert chat["message"] == {"role": "assistant", "content": "lorem ipsum "}
+    assert chat["done"] is True
+    assert len(first["embedding"]) == 8
+    assert first == again
+
+
+# -------------------------------
+# Fake Keycloak
+# -------------------------------
+def test_fake_keycloak_tokens_pass_real_verification():
+    with FakeKeycloak() as keycloak, patch("app.keycloak_utils.ISSUER", keycloak.issuer):
+        token = requests.post(
+            f"{keycloak.issuer}/protocol/openid-connect/token",
+            data={"grant_type": "password", "username": "alice", "password": "x"},
+        ).json()["access_token"]
+        claims = verify_token(token)
+
+    assert claims["preferred_username"] == "alice"
+
+
+# -------------------------------
+# Mongo stand-in
+# -------------------------------
+def test_memory_collection_round_trips_chat_history():
+    async def history(username):
+        return (await get_history_page(username))["messages"][::-1]
+
+    with memory_collections("chats"):
+        asyncio.run(save_user_messages("alice", [{"role": "user", "content": "Q1"}]))
+        asyncio.run(save_user_messages("alice", [{"role": "assistant", "content": "A1", "model": "m"}]))
+        asyncio.run(save_user_messages("bob", [{"role": "user", "content": "other"}]))
+
+        messages = asyncio.run(history("alice"))
+        asyncio.run(clear_history("alice"))
+        assert asyncio.run(history("alice")) == []
+
+    assert [(m["role"], m["content"]) for m in messages] == [("user", "Q1"), ("assistant", "A1")]
+
+
+# -------------------------------
+# Report
+# -------------------------------
+def test_percentiles_use_nearest_rank():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 95) == 95
+    assert percentile(samples, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_report_summary_counts_errors_and_throughput():
+    report = LoadReport()
+    report.record("/chat", 0.1)
+    report.record("/chat", 0.3, ok=False)
+    report.finished = report.started + 2
+
+    row = report.summary()["/chat"]
+    assert row["requests"] == 2
+    assert row["errors"] == 1
+    assert row["rps"] == 1.0
+    assert "/chat" in report.render()
+
+
+def test_parse_mix():
+    assert parse_mix("chat=3,history=1") == {"chat": 3.0, "history": 1.0}
@@ -0,0 +1,49 @@
+# app/tests/test_metrics.py
+from fastapi.testclient import TestClient
+
+from app.app import app
+from app.metrics import Histogram, Counter, observe_llm_call, render_metrics
+
+client = TestClient(app)
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = Histogram("test_latency_seconds", "test", buckets=(1, 5))
+    hist.observe(0.5, model="a")
+    hist.observe(3, model="a")
+    hist.observe(10, model="a")
+
+    lines = hist.render()
+    assert 'test_latency_seconds_bucket{model="a",le="1"} 1' in lines
+    assert 'test_latency_seconds_bucket{model="a",le="5"} 2' in lines
+    assert 'test_latency_seconds_bucket{model="a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{model="a"} 3' in lines
+
+
+def test_histogram_quantile_uses_recent_window():
+    hist = Histogram("test_quantile_seconds", "test", window=10)
+    for value in range(1, 101):
+        hist.observe(value, model="m")
+
+    # only the last 10 samples (91..100) are kept
+    assert hist.quantile(0.0, model="m") == 91
+    assert hist.quantile(0.95, model="m") == 100
+    assert hist.quantile(0.5, min_samples=50, model="m") is None
+
+
+def test_counter_inc_and_value():
+    counter = Counter("test_events_total", "test")
+    counter.inc(model="a")
+    counter.inc(2, model="a")
+    assert counter.value(model="a") == 3
+    assert counter.value(model="b") == 0
+
+
+def test_metrics_endpoint_exposes_llm_histograms():
+    observe_llm_call("endpoint-model", {"ttft": 0.2, "e2e": 1.5, "tokens_per_second": 42.0})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'llm_tokens_per_second_count{model="endpoint-model"} 1' in response.text
+    assert "# TYPE llm_e2e_seconds histogram" in render_metrics()
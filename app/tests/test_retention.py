@@ -0,0 +1,38 @@
+# app/tests/test_retention.py
+from datetime import datetime, timedelta
+
+from app.chat_history import build_message_doc
+from app.retention import retention_days, message_expiry
+
+ROLES = {"auditor": 365, "trial": 7}
+USERS = {"alice": 0}
+
+
+def _user(name, *roles):
+    return {"preferred_username": name, "realm_access": {"roles": list(roles)}}
+
+
+def test_user_override_wins_over_roles():
+    assert retention_days(_user("alice", "trial"), default=30, roles=ROLES, users=USERS) == 0
+
+
+def test_first_configured_role_applies():
+    assert retention_days(_user("bob", "trial", "auditor"), default=30, roles=ROLES, users=USERS) == 365
+
+
+def test_default_applies_without_overrides():
+    assert retention_days(_user("carol"), default=30, roles=ROLES, users=USERS) == 30
+
+
+def test_expiry_is_none_when_kept_forever():
+    now = datetime(2025, 1, 1)
+
+    assert message_expiry(_user("carol"), now, default=0, roles={}, users={}) is None
+    assert message_expiry(_user("carol"), now, default=30, roles={}, users={}) == now + timedelta(days=30)
+
+
+def test_expiry_is_stored_on_the_document():
+    expires_at = datetime(2025, 2, 1)
+
+    assert build_message_doc("alice", "user", "hi", expires_at=expires_at)["expires_at"] == expires_at
+    assert "expires_at" not in build_message_doc("alice", "user", "hi")
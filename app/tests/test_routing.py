@@ -0,0 +1,92 @@
+# app/tests/test_routing.py
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+from app.app import app
+from app.routing import route_model, estimate_tokens
+
+client = TestClient(app)
+
+ROUTER = {
+    "app.routing.ROUTER_SMALL_MODEL": "small",
+    "app.routing.ROUTER_LARGE_MODEL": "large",
+    "app.routing.ROUTER_TOKEN_THRESHOLD": 100,
+    "app.routing.ROUTER_COMPLEX_MARKERS": ["```", "step by step"],
+    "app.routing.ROUTER_USER_MODELS": {"pinned_user": "pinned-model"},
+}
+
+
+def _route(text, user=None, has_file=None):
+    patches = [patch(target, value) for target, value in ROUTER.items()]
+    for p in patches:
+        p.start()
+    try:
+        return route_model(text, user, has_file)
+    finally:
+        for p in patches:
+            p.stop()
+
+
+def test_short_prompt_goes_to_small_model():
+    model, route = _route("What's the capital of France?")
+    assert model == "small"
+    assert route["reason"] == "short_prompt"
+    assert route["requested"] == "auto"
+
+
+def test_long_prompt_goes_to_large_model():
+    model, route = _route("word " * 200)
+    assert model == "large"
+    assert route["reason"] == "long_prompt"
+    assert route["estimated_tokens"] == estimate_tokens("word " * 200)
+
+
+def test_attachment_goes_to_large_model():
+    model, route = _route("Summarise\n\n📄 [Attached File: a.pdf]\n\nshort")
+    assert (model, route["reason"]) == ("large", "attachment")
+
+
+def test_complexity_marker_goes_to_large_model():
+    model, route = _route("Explain step by step")
+    assert (model, route["reason"]) == ("large", "complex_prompt")
+
+
+def test_user_override_from_settings_and_claim():
+    assert _route("hi", {"preferred_username": "pinned_user"})[0] == "pinned-model"
+    assert _route("hi", {"preferred_username": "x", "llm_model": "claimed"})[0] == "claimed"
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+@patch("app.app.route_model", return_value=("small", {"requested": "auto", "reason": "short_prompt"}))
+def test_generate_auto_routes_and_records_decision(mock_route, mock_llm, mock_save):
+    from app.app import get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        resp = client.post("/generate", json={"text": "hi", "model": "auto"}, headers={"Authorization": "Bearer x"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert resp.status_code == 200
+    assert resp.json()["model"] == "small"
+    assert mock_llm.call_args[0][1] == "small"
+    assistant_call = mock_save.call_args
+    assert assistant_call[0][3] == "small"
+    assert assistant_call[1]["route"]["reason"] == "short_prompt"
+
+
+@patch("app.app.save_turn")
+@patch("app.app.get_response_with_stats", return_value=("ok", {}))
+@patch("app.app.route_model")
+def test_generate_explicit_model_skips_router(mock_route, mock_llm, mock_save):
+    from app.app import get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        client.post("/generate", json={"text": "hi", "model": "gemma3"}, headers={"Authorization": "Bearer x"})
+    finally:
+        app.dependency_overrides.clear()
+
+    mock_route.assert_not_called()
+    assert mock_llm.call_args[0][1] == "gemma3"
@@ -0,0 +1,141 @@
+# app/tests/test_scheduler.py
+import threading
+import time
+
+import pytest
+import requests
+
+from app.llm import CancelToken
+from app.scheduler import LLMScheduler, QueueCancelled, resolve_priority
+
+
+def _hold_slot(scheduler, model, release, priority="interactive"):
+    def run():
+        with scheduler.slot(model, priority):
+            release.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _queue(scheduler, model, priority, order):
+    def run():
+        with scheduler.slot(model, priority):
+            order.append(priority)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_queued(scheduler, model, count):
+    for _ in range(200):
+        if scheduler.snapshot().get(model, {}).get("queued") == count:
+            return
+        time.sleep(0.005)
+    raise AssertionError("waiters never queued")
+
+
+def test_interactive_requests_jump_ahead_of_background():
+    scheduler = LLMScheduler(max_concurrency=1, aging_seconds=60)
+    release = threading.Event()
+    holder = _hold_slot(scheduler, "m", release)
+    _wait_queued(scheduler, "m", 0)
+
+    order = []
+    threads = [_queue(scheduler, "m", "background", order)]
+    _wait_queued(scheduler, "m", 1)
+    threads.append(_queue(scheduler, "m", "batch", order))
+    _wait_queued(scheduler, "m", 2)
+    threads.append(_queue(scheduler, "m", "interactive", order))
+    _wait_queued(scheduler, "m", 3)
+
+    release.set()
+    for thread in [holder, *threads]:
+        thread.join(5)
+
+    assert order == ["interactive", "batch", "background"]
+
+
+def test_aging_promotes_long_waiting_background_work():
+    scheduler = LLMScheduler(max_concurrency=1, aging_seconds=0.05)
+    release = threading.Event()
+    holder = _hold_slot(scheduler, "m", release)
+    _wait_queued(scheduler, "m", 0)
+
+    order = []
+    threads = [_queue(scheduler, "m", "background", order)]
+    _wait_queued(scheduler, "m", 1)
+    time.sleep(0.2)  # background has aged past the interactive class
+    threads.append(_queue(scheduler, "m", "interactive", order))
+    _wait_queued(scheduler, "m", 2)
+
+    release.set()
+    for thread in [holder, *threads]:
+        thread.join(5)
+
+    assert order == ["background", "interactive"]
+
+
+def test_slot_times_out_when_model_is_saturated():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    holder = _hold_slot(scheduler, "m", release)
+    _wait_queued(scheduler, "m", 0)
+    try:
+        with pytest.raises(requests.exceptions.Timeout):
+            with scheduler.slot("m", timeout=0.05):
+                pass
+        assert scheduler.snapshot()["m"]["queued"] == 0
+    finally:
+        release.set()
+        holder.join(5)
+
+
+def test_slot_wait_is_cancellable():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    holder = _hold_slot(scheduler, "m", release)
+    _wait_queued(scheduler, "m", 0)
+    cancel = CancelToken()
+    threading.Timer(0.05, cancel.cancel).start()
+    try:
+        with pytest.raises(QueueCancelled):
+            with scheduler.slot("m", cancel=cancel):
+                pass
+    finally:
+        release.set()
+        holder.join(5)
+
+
+def test_models_have_independent_limits():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    holder = _hold_slot(scheduler, "big", release)
+    _wait_queued(scheduler, "big", 0)
+    try:
+        with scheduler.slot("small", timeout=0.5) as waited:
+            assert waited < 0.5
+    finally:
+        release.set()
+        holder.join(5)
+
+
+# -------------------------------
+# resolve_priority()
+# -------------------------------
+def test_resolve_priority_defaults_to_declared_class():
+    assert resolve_priority({"preferred_username": "a"}, "batch", role_overrides={}) == "batch"
+
+
+def test_resolve_priority_user_claim_wins():
+    user = {"llm_priority": "background", "realm_access": {"roles": ["premium"]}}
+    assert resolve_priority(user, "interactive", role_overrides={"premium": "interactive"}) == "background"
+
+
+def test_resolve_priority_role_override():
+    user = {"realm_access": {"roles": ["basic_user", "bulk_user"]}}
+    assert resolve_priority(user, "interactive", role_overrides={"bulk_user": "batch"}) == "batch"
+
+
+def test_resolve_priority_ignores_unknown_class():
+    assert resolve_priority({"llm_priority": "urgent"}, "interactive", role_overrides={}) == "interactive"
@@ -0,0 +1,128 @@
+# app/tests/test_search.py
+import asyncio
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import chat_history, search
+from app.app import app, get_current_user
+from app.async_chat_history import search_history, save_turn, clear_history, purge_history
+from app.loadtest.memory_store import MemoryCollection, AsyncMemoryCollection
+
+client = TestClient(app)
+AUTH = {"Authorization": "Bearer test_token"}
+
+
+@pytest.fixture
+def memory_chats():
+    collection = MemoryCollection()
+    with patch("app.chat_history.chats", collection), \
+            patch("app.async_chat_history.async_chats", AsyncMemoryCollection(collection)):
+        yield collection
+
+
+def _save_turn(*args):
+    asyncio.run(save_turn(*args))
+
+
+def test_normalize_terms_folds_case_and_accents():
+    assert search.normalize_terms("The Café is OPEN, the cafe!") == ["cafe", "open"]
+
+
+def test_digests_are_keyed_per_user():
+    alice = search.blind_terms("alice", ["llama"])
+    bob = search.blind_terms("bob", ["llama"])
+
+    assert alice == search.blind_terms("alice", ["llama"])
+    assert alice != bob
+    assert len(alice[0]) == search.DIGEST_SIZE
+
+
+def test_index_stores_no_plaintext(memory_chats, search_index):
+    _save_turn("alice", "Where do llamas live?", "In the Andes.")
+
+    entries = list(search_index.find({}))
+    assert len(entries) == 2
+    assert {e["_id"] for e in entries} == {d["_id"] for d in memory_chats.find({})}
+    assert b"llama" not in b"".join(b"".join(e["terms"]) for e in entries)
+
+
+def test_write_behind_queues_index_entries_off_the_request_path(memory_chats, search_index):
+    import threading
+    from app.write_buffer import WriteBehindBuffer
+
+    release = threading.Event()
+    messages = WriteBehindBuffer(memory_chats.insert_many, interval=0)
+    entries = WriteBehindBuffer(lambda docs: (release.wait(2), search_index.insert_many(docs)), interval=0)
+    with patch("app.chat_history.WRITE_BEHIND_ENABLED", True), patch("app.chat_history.write_buffer", messages), \
+            patch("app.chat_history.search_buffer", entries):
+        asyncio.run(save_turn("alice", "Where do llamas live?", "In the Andes."))
+        assert search_index.count_documents({}) == 0  # the turn returned before the index write
+        assert len(entries.pending("alice")) == 2
+        release.set()
+        results = asyncio.run(search_history("alice", "llamas"))  # waits for the user's queued entries
+
+    assert [r["content"] for r in results] == ["Where do llamas live?"]
+    messages.close()
+    entries.close()
+
+
+def test_search_ranks_by_matched_words(memory_chats):
+    _save_turn("alice", "llamas eat grass", "They also like hay")
+    _save_turn("alice", "do llamas spit", "Only at other llamas, when they eat")
+    _save_turn("bob", "llamas eat grass", "yes")
+
+    results = asyncio.run(search_history("alice", "Llamas EAT", limit=10))
+
+    assert [r["content"] for r in results[:2]] == ["Only at other llamas, when they eat", "llamas eat grass"]
+    assert [r["score"] for r in results] == [1.0, 1.0, 0.5]
+    assert results[2]["content"] == "do llamas spit"
+
+
+def test_search_decrypts_only_the_returned_messages(memory_chats):
+    for i in range(5):
+        _save_turn("alice", f"llama question {i}", f"answer {i}")
+
+    with patch("app.async_chat_history.decode_messages", wraps=chat_history.decode_messages) as decode:
+        results = asyncio.run(search_history("alice", "llama", limit=2))
+
+    assert [r["content"] for r in results] == ["llama question 4", "llama question 3"]
+    assert len(decode.call_args[0][0]) == 2
+
+
+def test_cleared_messages_are_not_found(memory_chats, search_index):
+    _save_turn("alice", "secret llama plans", "ok")
+
+    cutoff = asyncio.run(clear_history("alice"))
+    assert asyncio.run(search_history("alice", "llama")) == []
+
+    asyncio.run(purge_history("alice", cutoff, pause=0))
+    assert search_index.count_documents({}) == 0
+
+
+def test_search_endpoint(memory_chats):
+    app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "alice"}
+    try:
+        _save_turn("alice", "book a flight to Lisbon", "done")
+        response = client.get("/history/search?q=lisbon", headers=AUTH)
+        empty = client.get("/history/search?q=the", headers=AUTH)
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert [r["content"] for r in response.json()["results"]] == ["book a flight to Lisbon"]
+    assert empty.json() == {"results": []}
+
+
+def test_backfill_indexes_existing_messages(memory_chats):
+    memory_chats.insert_one({"username": "alice", "role": "user", "content": "legacy llama note",
+                             "timestamp": datetime(2024, 1, 1)})
+    target = MagicMock()
+
+    with patch("app.search.chats", memory_chats), patch("app.search.search_terms", target):
+        assert search.backfill("alice") == 1
+
+    (operations,), _ = target.bulk_write.call_args
+    assert operations[0]._doc["terms"] == search.blind_terms("alice", ["legacy", "llama", "note"])
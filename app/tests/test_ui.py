@@ -1,6 +1,7 @@
 import gradio as gr
 import pytest
 import app.ui as ui
+from app.chat_history import decode_cursor
 from unittest.mock import patch, MagicMock
 
 # ----------------------------------------------------------
@@ -145,3 +146,118 @@ def test_resend_click():
     """on_resend_click exists and returns string"""
     msg = ui.on_resend_click("john")
     assert isinstance(msg, str)
+
+
+# ----------------------------------------------------------
+# History paging
+# ----------------------------------------------------------
+
+def test_load_older_prepends_page():
+    page = {
+        "messages": [
+            {"role": "assistant", "content": "older reply", "timestamp": "2025-11-07T10:00:01"},
+            {"role": "user", "content": "older question", "timestamp": "2025-11-07T10:00:00"},
+        ],
+        "next_cursor": None,
+    }
+    current = [{"role": "user", "content": "latest"}]
+    with patch("app.ui.requests.get", return_value=MagicMock(status_code=200, json=lambda: page)) as mock_get:
+        history, cursor, button = ui.on_load_older_click("fake-token", current, "cursor-1")
+
+    assert mock_get.call_args[1]["params"] == {"before": "cursor-1"}
+    assert [m["content"].split("\n")[0] for m in history] == ["older question", "older reply", "latest"]
+    assert cursor is None
+    assert button["visible"] is False
+
+
+def test_thread_history_is_requested_with_conversation_id():
+    ui._history_copies.clear()
+    page = {"messages": [], "next_cursor": None}
+    with patch("app.ui.requests.get", return_value=MagicMock(status_code=200, json=lambda: page, headers={})) as mock_get:
+        ui.load_latest_history("fake-token", "thread-1")
+
+    assert mock_get.call_args[1]["params"] == {"conversation_id": "thread-1"}
+
+
+def _history_response(status_code, page=None, etag=None, count=0):
+    return MagicMock(status_code=status_code, json=lambda: page,
+                     headers={"ETag": etag, "X-History-Count": str(count)})
+
+
+def test_history_local_copy_is_revalidated_and_topped_up():
+    ui._history_copies.clear()
+    first = {"messages": [{"role": "user", "content": "hi", "timestamp": "2025-11-07T10:00:00"}],
+             "next_cursor": None, "sync_cursor": "c1"}
+    delta = {"messages": [{"role": "assistant", "content": "hello", "timestamp": "2025-11-07T10:00:01"}],
+             "next_cursor": None, "sync_cursor": "c2"}
+    responses = [_history_response(200, first, '"a"', 1), _history_response(304),
+                 _history_response(200, delta, '"b"', 2)]
+    with patch("app.ui.requests.get", side_effect=responses) as mock_get:
+        ui.get_history_from_backend("john", "token-1")
+        unchanged = ui.get_history_from_backend("john", "token-2")  # next login, new token
+        topped_up = ui.get_history_from_backend("john", "token-3")
+
+    assert [m["content"].split("\n")[0] for m in unchanged] == ["hi"]
+    assert mock_get.call_args_list[1][1]["headers"]["If-None-Match"] == '"a"'
+    assert mock_get.call_args_list[2][1]["params"] == {"since": "c1"}
+    assert [m["content"].split("\n")[0] for m in topped_up] == ["hi", "hello"]
+
+
+def test_history_local_copy_reloads_after_removals():
+    ui._history_copies.clear()
+    page = {"messages": [{"role": "user", "content": "hi", "timestamp": "2025-11-07T10:00:00"}],
+            "next_cursor": None, "sync_cursor": "c1"}
+    empty = {"messages": [], "next_cursor": None, "sync_cursor": None}
+    responses = [_history_response(200, page, '"a"', 1), _history_response(200, empty, '"b"', 0),
+                 _history_response(200, empty, '"b"', 0)]
+    with patch("app.ui.requests.get", side_effect=responses) as mock_get:
+        ui.get_history_from_backend("john", "token")
+        history = ui.get_history_from_backend("john", "token")  # cleared elsewhere: count dropped
+
+    assert history == []
+    assert mock_get.call_count == 3
+    assert "If-None-Match" not in mock_get.call_args[1]["headers"]
+
+
+@patch("app.ui.HISTORY_PAGE_SIZE", 2)
+def test_topped_up_copy_is_trimmed_to_one_page():
+    ui._history_copies.clear()
+    first = {"messages": [{"id": "65a000000000000000000002", "role": "user", "content": "b",
+                           "timestamp": "2025-11-07T10:00:01"},
+                          {"id": "65a000000000000000000001", "role": "user", "content": "a",
+                           "timestamp": "2025-11-07T10:00:00"}],
+             "next_cursor": None, "sync_cursor": "c1"}
+    delta = {"messages": [{"id": "65a000000000000000000003", "role": "user", "content": "c",
+                           "timestamp": "2025-11-07T10:00:02"}],
+             "next_cursor": None, "sync_cursor": "c2"}
+    responses = [_history_response(200, first, '"a"', 2), _history_response(200, delta, '"b"', 3)]
+    with patch("app.ui.requests.get", side_effect=responses):
+        ui.get_history_from_backend("john", "token")
+        history, cursor = ui.sync_latest_history("token", username="john")
+
+    copy = ui._history_copies[("john", "")]
+    assert [m["content"] for m in copy["messages"]] == ["c", "b"]
+    assert [m["content"].split("\n")[0] for m in history] == ["b", "c"]
+    assert str(decode_cursor(cursor)[1]) == "65a000000000000000000002"  # "Load older" continues below the kept page
+
+
+@patch("app.ui.HISTORY_COPIES_MAX", 2)
+def test_local_copies_are_bounded_and_dropped_on_logout():
+    ui._history_copies.clear()
+    page = {"messages": [], "next_cursor": None, "sync_cursor": None}
+    with patch("app.ui.requests.get", return_value=_history_response(200, page, '"a"', 0)):
+        for user in ("ann", "bob", "cid"):
+            ui.get_history_from_backend(user, "token")
+
+    assert list(ui._history_copies) == [("bob", ""), ("cid", "")]  # least recently used went first
+    with patch("app.ui._token_user", return_value="cid"):
+        ui.logout_action("token")
+    assert list(ui._history_copies) == [("bob", "")]
+
+
+def test_send_in_thread_goes_through_chat():
+    with patch("app.ui.requests.post", return_value=MagicMock(status_code=200, json=lambda: {"response": "ok"})) as mock_post:
+        ui.send_message_or_pdf("Hello", [], "fake-token", "llama3.2", None, "thread-1")
+
+    assert mock_post.call_args[0][0].endswith("/chat")
+    assert mock_post.call_args[1]["json"] == {"prompt": "Hello", "model": "llama3.2", "conversation_id": "thread-1"}
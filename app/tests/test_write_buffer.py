@@ -0,0 +1,204 @@
+# app/tests/test_write_buffer.py
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from pymongo.errors import AutoReconnect, BulkWriteError, DocumentTooLarge
+
+from app.write_buffer import WriteBehindBuffer
+from app.metrics import HISTORY_WRITE_BEHIND_DROPPED
+
+
+def _docs(n, username="alice"):
+    base = datetime(2025, 1, 1)
+    return [{"_id": i, "username": username, "timestamp": base + timedelta(seconds=i)} for i in range(n)]
+
+
+def test_flushes_when_batch_size_is_reached():
+    writer = MagicMock()
+    buffer = WriteBehindBuffer(writer, max_size=100, batch_size=3, interval=60)
+
+    assert buffer.offer(_docs(3))
+    assert buffer.flush(timeout=2)
+
+    writer.assert_called_once()
+    assert [d["_id"] for d in writer.call_args[0][0]] == [0, 1, 2]
+    buffer.close()
+
+
+def test_flushes_after_interval():
+    written = threading.Event()
+    buffer = WriteBehindBuffer(lambda docs: written.set(), max_size=100, batch_size=100, interval=0.05)
+
+    buffer.offer(_docs(1))
+
+    assert written.wait(1)
+    buffer.close()
+
+
+def test_full_buffer_rejects_so_caller_writes_directly():
+    buffer = WriteBehindBuffer(MagicMock(), max_size=2, batch_size=100, interval=60)
+
+    assert buffer.offer(_docs(2)) is True
+    assert buffer.offer(_docs(1)) is False
+    buffer.close()
+
+
+def test_pending_documents_stay_visible_until_acknowledged():
+    release = threading.Event()
+    buffer = WriteBehindBuffer(lambda docs: release.wait(2), max_size=100, batch_size=1, interval=60)
+
+    buffer.offer(_docs(1, "alice") + _docs(1, "bob"))
+    time.sleep(0.05)  # first document is now in flight
+
+    assert [d["username"] for d in buffer.pending()] == ["alice", "bob"]
+    assert [d["username"] for d in buffer.pending("bob")] == ["bob"]
+    release.set()
+    assert buffer.flush(timeout=2)
+    assert buffer.pending() == []
+    buffer.close()
+
+
+def test_close_drains_queue():
+    writer = MagicMock()
+    buffer = WriteBehindBuffer(writer, max_size=100, batch_size=100, interval=60)
+    buffer.offer(_docs(5))
+
+    buffer.close(timeout=2)
+
+    assert sum(len(call[0][0]) for call in writer.call_args_list) == 5
+    assert buffer.offer(_docs(1)) is False
+
+
+@patch("app.write_buffer.RETRY_BACKOFF", 0.001)
+def test_batch_stored_before_a_lost_acknowledgement_is_not_rewritten_one_by_one():
+    calls = []
+
+    def writer(docs):
+        calls.append(len(docs))
+        if len(calls) == 1:
+            raise AutoReconnect("connection closed")  # stored, but the reply was lost
+        raise BulkWriteError({"nInserted": 0, "writeErrors": [
+            {"index": i, "code": 11000, "errmsg": "duplicate key"} for i in range(len(docs))]})
+
+    buffer = WriteBehindBuffer(writer, max_size=1000, batch_size=200, interval=60)
+    buffer.offer(_docs(200))
+
+    assert buffer.flush(timeout=3)
+    assert calls == [200, 200]
+    buffer.close()
+
+
+def test_rejected_documents_are_dropped_not_retried():
+    calls = []
+
+    def writer(docs):
+        calls.append([d["_id"] for d in docs])
+        raise BulkWriteError({"nInserted": 1, "writeErrors": [
+            {"index": 1, "code": 11000, "errmsg": "duplicate key"},
+            {"index": 2, "code": 121, "errmsg": "Document failed validation"}]})
+
+    dropped = HISTORY_WRITE_BEHIND_DROPPED.value(buffer="chat_history")
+    buffer = WriteBehindBuffer(writer, max_size=100, batch_size=3, interval=60)
+    buffer.offer(_docs(3))
+
+    assert buffer.flush(timeout=3)
+    assert calls == [[0, 1, 2]]
+    assert HISTORY_WRITE_BEHIND_DROPPED.value(buffer="chat_history") - dropped == 1
+    buffer.close()
+
+
+def test_non_retryable_error_drops_the_batch():
+    calls = []
+
+    def writer(docs):
+        calls.append(len(docs))
+        raise DocumentTooLarge("document too large")
+
+    dropped = HISTORY_WRITE_BEHIND_DROPPED.value(buffer="chat_history")
+    buffer = WriteBehindBuffer(writer, max_size=100, batch_size=2, interval=60)
+    buffer.offer(_docs(2))
+
+    assert buffer.flush(timeout=3)
+    assert calls == [2]
+    assert HISTORY_WRITE_BEHIND_DROPPED.value(buffer="chat_history") - dropped == 2
+    buffer.close()
+
+
+@patch("app.write_buffer.RETRY_BACKOFF", 0.001)
+def test_failed_batch_is_retried_until_stored():
+    calls = []
+
+    def writer(docs):
+        calls.append([d["_id"] for d in docs])
+        if len(calls) <= 6:  # a failover outlasting the old three attempts
+            raise AutoReconnect("no primary")
+
+    buffer = WriteBehindBuffer(writer, max_size=100, batch_size=4, interval=60)
+    buffer.offer(_docs(2))
+
+    assert buffer.flush(timeout=3)
+    assert calls[-1] == [0, 1]
+    assert len(calls) == 7
+    buffer.close()
+
+
+@patch("app.write_buffer.RETRY_BACKOFF", 0.01)
+def test_unwritable_batch_stays_pending_and_applies_backpressure():
+    def writer(docs):
+        raise AutoReconnect("no primary")
+
+    buffer = WriteBehindBuffer(writer, max_size=3, batch_size=2, interval=0)
+    buffer.offer(_docs(2))
+    time.sleep(0.1)
+
+    assert [d["_id"] for d in buffer.pending()] == [0, 1]  # still readable, not dropped
+    assert buffer.offer(_docs(2)) is False  # callers write synchronously instead
+    buffer.close(timeout=0.05)
+
+
+@patch("app.write_buffer.RETRY_BACKOFF", 0.01)
+def test_close_timeout_stops_the_retry_loop():
+    calls = []
+
+    def writer(docs):
+        calls.append(len(docs))
+        raise AutoReconnect("no primary")
+
+    dropped = HISTORY_WRITE_BEHIND_DROPPED.value(buffer="chat_history")
+    buffer = WriteBehindBuffer(writer, max_size=100, batch_size=2, interval=0)
+    buffer.offer(_docs(2))
+    time.sleep(0.05)
+
+    buffer.close(timeout=0.05)
+    buffer._thread.join(1)
+
+    assert not buffer._thread.is_alive()
+    assert HISTORY_WRITE_BEHIND_DROPPED.value(buffer="chat_history") - dropped == 2
+    attempts = len(calls)
+    time.sleep(0.1)
+    assert len(calls) == attempts
+
+
+def test_recent_history_sees_buffered_turn_before_flush():
+    import asyncio
+    from app import async_chat_history
+    from app.loadtest.memory_store import memory_collections
+
+    release = threading.Event()
+    with memory_collections("chats") as stores:
+        collection = stores["chats"]
+        buffer = WriteBehindBuffer(lambda docs: (release.wait(2), collection.insert_many(docs)),
+                                   batch_size=100, interval=0)
+        with patch("app.chat_history.WRITE_BEHIND_ENABLED", True), patch("app.chat_history.write_buffer", buffer):
+            asyncio.run(async_chat_history.save_turn("alice", "Q", "A"))
+            recent = asyncio.run(async_chat_history.get_recent_history("alice", 10))
+            assert collection.count_documents({}) == 0
+            release.set()
+            cutoff = asyncio.run(async_chat_history.clear_history("alice"))  # waits for the flush
+            asyncio.run(async_chat_history.purge_history("alice", cutoff, pause=0))
+
+    assert [m["content"] for m in recent] == ["Q", "A"]
+    assert collection.count_documents({}) == 0
+    buffer.close()
@@ -1,9 +1,13 @@
 import gradio as gr
 import os
+import json
+import base64
 import requests
+from collections import OrderedDict
+from datetime import datetime
 from .keycloak_client import keycloak_login
-from .settings import API_URL, SIGNUP_URL, BASE_URL
-from .chat_history import format_message
+from .settings import API_URL, SIGNUP_URL, BASE_URL, HISTORY_PAGE_SIZE
+from .chat_history import format_message, encode_cursor
 from .utils.file_utils import extract_text_from_file, extract_file_content
 
 # -------------------------------
@@ -12,7 +16,7 @@ from .utils.file_utils import extract_text_from_file, extract_file_content
 models_env = os.getenv("AVAILABLE_MODELS", "")
 AVAILABLE_MODELS = [m.strip() for m in models_env.split(",") if m.strip()]
 
-def send_message_or_pdf(message, history, token, model, uploaded_file=None):
+def send_message_or_pdf(message, history, token, model, uploaded_file=None, conversation_id=None):
     history = history or []
     if not token:
         history.append({"role": "assistant", "content": "⚠️ You must log in first!"})
@@ -40,7 +44,12 @@ def send_message_or_pdf(message, history, token, model, uploaded_file=None):
     headers = {"Authorization": f"Bearer {token}"}
 
     try:
-        res = requests.post(API_URL, json={"text": message_to_backend, "model": model}, headers=headers)
+        if conversation_id:
+            # Threads go through /chat, which builds the context from the thread's own turns
+            payload = {"prompt": message_to_backend, "model": model, "conversation_id": conversation_id}
+            res = requests.post(f"{BASE_URL}/chat", json=payload, headers=headers)
+        else:
+            res = requests.post(API_URL, json={"text": message_to_backend, "model": model}, headers=headers)
         if res.status_code == 200:
             response = res.json().get("response", "")
             display_msg = message if not pdf_note else f"{message}\n\n{pdf_note}"
@@ -63,39 +72,187 @@ def send_message_or_pdf(message, history, token, model, uploaded_file=None):
 # -------------------------------
 # Auth & Utility Functions
 # -------------------------------
+def fetch_history_page(token, before=None, conversation_id=None):
+    """
+    One /history page as (chatbot messages oldest-first, cursor for the next older page).
+    The backend returns newest-first pages, so they are reversed for display.
+    """
+    if not token:
+        return [], None
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"before": before} if before else {}
+    if conversation_id:
+        params["conversation_id"] = conversation_id
+    try:
+        res = requests.get(f"{BASE_URL}/history", headers=headers, params=params)
+        if res.status_code != 200:
+            return [], None
+        data = res.json()
+        messages = [
+            format_message(
+                m["role"],
+                m["content"],
+                m.get("timestamp"),
+                m.get("model")  # <-- pass model here
+            )
+            for m in reversed(data.get("messages", []))
+        ]
+        return messages, data.get("next_cursor")
+    except Exception as e:
+        return [], None
+
+
+# Local copy of the latest /history page per (user, thread), least recently used first:
+# {"etag", "count", "messages" (newest first, at most one page), "next_cursor", "sync_cursor"}
+_history_copies = OrderedDict()
+HISTORY_COPIES_MAX = 64  # (user, thread) copies kept in this process; a user's go on logout
+
+
+def _token_user(token):
+    """preferred_username claim of the access token; only used to key the local copy"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return claims.get("preferred_username") or claims.get("sub") or token
+    except Exception:
+        return token
+
+
+def _format_page(messages):
+    return [format_message(m["role"], m["content"], m.get("timestamp"), m.get("model")) for m in reversed(messages)]
+
+
+def sync_latest_history(token, conversation_id=None, username=None):
+    """
+    The latest /history page as (chatbot messages oldest-first, cursor for the next older page),
+    kept as a local copy. The copy is revalidated with If-None-Match (304 = unchanged) and
+    topped up with `since=<sync_cursor>`. It is fetched again in full when messages were
+    removed (X-History-Count disagrees) or more arrived than one page holds.
+    """
+    if not token:
+        return [], None
+    key = (username or _token_user(token), conversation_id or "")
+    copy = _history_copies.get(key)
+    if copy:
+        _history_copies.move_to_end(key)
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"conversation_id": conversation_id} if conversation_id else {}
+    delta = bool(copy and copy["sync_cursor"])
+    if copy:
+        headers["If-None-Match"] = copy["etag"]
+    if delta:
+        params["since"] = copy["sync_cursor"]
+    try:
+        res = requests.get(f"{BASE_URL}/history", headers=headers, params=params)
+    except Exception:
+        return (_format_page(copy["messages"]), copy["next_cursor"]) if copy else ([], None)
+    if res.status_code == 304 and copy:
+        return _format_page(copy["messages"]), copy["next_cursor"]
+    if res.status_code != 200:
+        return [], None
+
+    data = res.json()
+    count = int(res.headers.get("X-History-Count", -1))
+    if delta:
+        if data.get("next_cursor") or copy["count"] + len(data["messages"]) != count:
+            _history_copies.pop(key, None)
+            return sync_latest_history(token, conversation_id, username)
+        data = {**data, **_trim_page(data["messages"] + copy["messages"], copy["next_cursor"])}
+    _history_copies[key] = {
+        "etag": res.headers.get("ETag"),
+        "count": count,
+        "messages": data["messages"],
+        "next_cursor": data.get("next_cursor"),
+        "sync_cursor": data.get("sync_cursor"),
+    }
+    _history_copies.move_to_end(key)
+    while len(_history_copies) > HISTORY_COPIES_MAX:
+        _history_copies.popitem(last=False)
+    return _format_page(data["messages"]), data.get("next_cursor")
+
+
+def _trim_page(messages, next_cursor):
+    """Keep a topped-up copy to one page (newest first); older messages are reached via the new cursor"""
+    if len(messages) <= HISTORY_PAGE_SIZE:
+        return {"messages": messages, "next_cursor": next_cursor}
+    messages = messages[:HISTORY_PAGE_SIZE]
+    oldest = messages[-1]
+    cursor = encode_cursor(datetime.fromisoformat(oldest["timestamp"]), oldest["id"])
+    return {"messages": messages, "next_cursor": cursor}
+
+
+def forget_history(username):
+    """Drop every local copy of this user's history (on logout)"""
+    for key in [key for key in _history_copies if key[0] == username]:
+        del _history_copies[key]
+
+
 def get_history_from_backend(username, token):
     if not token or not username:
         return []
+    messages, _ = sync_latest_history(token, username=username)
+    return messages
+
+
+def load_latest_history(token, conversation_id=None):
+    # Latest page only; older pages are fetched with the "Load older messages" button
+    messages, cursor = sync_latest_history(token, conversation_id)
+    return messages, cursor, gr.update(visible=bool(cursor))
+
+
+def on_load_older_click(token, history, cursor, conversation_id=None):
+    if not cursor:
+        return history, None, gr.update(visible=False)
+    older, next_cursor = fetch_history_page(token, before=cursor, conversation_id=conversation_id)
+    return older + (history or []), next_cursor, gr.update(visible=bool(next_cursor))
+
+
+# -------------------------------
+# Conversation threads
+# -------------------------------
+ALL_MESSAGES = ("All messages", "")
+
+
+def fetch_conversations(token):
+    """Thread picker choices as (title, id), most recently active first"""
+    if not token:
+        return [ALL_MESSAGES]
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        res = requests.get(f"{BASE_URL}/history", headers=headers)
-        if res.status_code == 200:
-            data = res.json()
-            messages = data.get("messages", [])
-            return [
-                format_message(
-                    m["role"],
-                    m["content"],
-                    m.get("timestamp"),
-                    m.get("model")  # <-- pass model here
-                )
-                for m in messages
-            ]
-        else:
-            return []
-    except Exception as e:
-        return []
+        res = requests.get(f"{BASE_URL}/conversations", headers=headers)
+        if res.status_code != 200:
+            return [ALL_MESSAGES]
+        return [ALL_MESSAGES] + [(c["title"], c["id"]) for c in res.json().get("conversations", [])]
+    except Exception:
+        return [ALL_MESSAGES]
+
+
+def load_conversation_choices(token, selected=""):
+    return gr.update(choices=fetch_conversations(token), value=selected)
+
+
+def on_new_conversation_click(token):
+    # Selecting the new thread triggers conversation_selector.change, which loads its (empty) history
+    if not token:
+        return gr.update()
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        res = requests.post(f"{BASE_URL}/conversations", json={}, headers=headers)
+        if res.status_code != 200:
+            return gr.update()
+        return load_conversation_choices(token, res.json()["id"])
+    except Exception:
+        return gr.update()
 
 
 def on_login_click(username, password):
     token, error = keycloak_login(username, password)
     if token:
-        history = get_history_from_backend(username, token)
         return (
             gr.update(visible=False),
             gr.update(visible=True),
             token,
-            history,
+            [],  # filled by load_latest_history once logged in
             f"✅ Login successful! Welcome, {username}.",
             gr.update(visible=True),
             gr.update(visible=False),
@@ -113,7 +270,9 @@ def on_login_click(username, password):
         )
 
 
-def logout_action():
+def logout_action(token=None):
+    if token:
+        forget_history(_token_user(token))
     return (
         gr.update(visible=True),
         gr.update(visible=False),
@@ -192,6 +351,7 @@ with gr.Blocks() as demo:
         logout_btn = gr.Button("Logout", visible=False, elem_classes=["small-logout"],)
 
     token_state = gr.State(None)
+    history_cursor_state = gr.State(None)
 
     # ------- Auth Section -------
     with gr.Group(visible=True) as auth_section:
@@ -217,12 +377,22 @@ with gr.Blocks() as demo:
 
         # ------- Model Selector -------
         model_selector = gr.Dropdown(
-            choices=AVAILABLE_MODELS,
+            choices=["auto", *AVAILABLE_MODELS],  # "auto" lets the backend pick by prompt size
             value="llama3.2",
             label="Select LLM Model",
             elem_classes=["compact-dropdown"],
         )
 
+        with gr.Row():
+            conversation_selector = gr.Dropdown(
+                choices=[ALL_MESSAGES],
+                value="",
+                label="Conversation",
+                elem_classes=["compact-dropdown"],
+            )
+            new_conversation_btn = gr.Button("New conversation", size="sm")
+
+        load_older_btn = gr.Button("Load older messages", visible=False, size="sm")
         chatbot = gr.Chatbot(type="messages")
 
         msg = gr.Textbox(label="Message")
@@ -245,6 +415,32 @@ with gr.Blocks() as demo:
         fn=on_login_click,
         inputs=[username_login, password_login],
         outputs=[auth_section, chat_section, token_state, chatbot, login_status, logout_btn, resend_btn],
+    ).then(
+        fn=load_latest_history,
+        inputs=[token_state],
+        outputs=[chatbot, history_cursor_state, load_older_btn],
+    ).then(
+        fn=load_conversation_choices,
+        inputs=[token_state],
+        outputs=[conversation_selector],
+    )
+
+    load_older_btn.click(
+        fn=on_load_older_click,
+        inputs=[token_state, chatbot, history_cursor_state, conversation_selector],
+        outputs=[chatbot, history_cursor_state, load_older_btn],
+    )
+
+    conversation_selector.change(
+        fn=load_latest_history,
+        inputs=[token_state, conversation_selector],
+        outputs=[chatbot, history_cursor_state, load_older_btn],
+    )
+
+    new_conversation_btn.click(
+        fn=on_new_conversation_click,
+        inputs=[token_state],
+        outputs=[conversation_selector],
     )
 
     signup_btn.click(
@@ -255,7 +451,7 @@ with gr.Blocks() as demo:
 
     send_btn.click(
         fn=send_message_or_pdf,
-        inputs=[msg, chatbot, token_state, model_selector, file_input],
+        inputs=[msg, chatbot, token_state, model_selector, file_input, conversation_selector],
         # inputs=[msg, chatbot, token_state, model_selector, file_input],
         outputs=[msg, chatbot, file_input],  # Clear file input after send
     )
@@ -268,6 +464,7 @@ with gr.Blocks() as demo:
 
     logout_btn.click(
         fn=logout_action,
+        inputs=[token_state],
         outputs=[auth_section, chat_section, token_state, chatbot, login_status, logout_btn],
     )
 
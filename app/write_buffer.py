@@ -0,0 +1,166 @@
+# write_buffer.py
+import threading
+import time
+from collections import deque
+from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout
+from .settings import WRITE_BEHIND_MAX_QUEUE, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL
+from .metrics import HISTORY_WRITE_BEHIND_FLUSHED, HISTORY_WRITE_BEHIND_FALLBACKS, HISTORY_WRITE_BEHIND_DROPPED
+
+RETRY_BACKOFF = 0.1  # seconds before the first retry of a failed batch, doubling per attempt
+RETRY_BACKOFF_MAX = 5.0
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process queue of chat documents written by a background thread with
+    unordered insert_many calls, once `batch_size` documents are waiting or `interval`
+    seconds after the oldest one arrived. offer() returns False when the queue is full
+    so the caller writes synchronously instead (backpressure). Queued and in-flight
+    documents stay visible through pending() until the insert is acknowledged. A batch that
+    fails transiently is retried with capped exponential backoff until it is stored, while
+    new writes fill the queue and then fall back to the synchronous path; documents MongoDB
+    rejects outright are dropped and counted.
+    """
+
+    def __init__(self, writer, max_size: int = WRITE_BEHIND_MAX_QUEUE, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 interval: float = WRITE_BEHIND_FLUSH_INTERVAL, name: str = "chat_history"):
+        self.writer = writer  # callable(docs) performing the actual insert_many
+        self.name = name  # collection written, the `buffer` label of the write-behind metrics
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = deque()
+        self._inflight = []
+        self._oldest = None
+        self._flush_requested = False
+        self._closed = False
+        self._abandoned = False  # set when close() gave up waiting; the writer thread stops retrying
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def offer(self, docs: list) -> bool:
+        """Queue documents for writing; False if the buffer is closed or would overflow"""
+        with self._cond:
+            if self._closed or len(self._queue) + len(self._inflight) + len(docs) > self.max_size:
+                HISTORY_WRITE_BEHIND_FALLBACKS.inc(buffer=self.name)
+                return False
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.extend(docs)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name=f"{self.name}-write-behind")
+                self._thread.start()
+            self._cond.notify_all()
+            return True
+
+    def pending(self, username: str = None) -> list:
+        """Documents not yet acknowledged by MongoDB (optionally for one user), in write order"""
+        with self._cond:
+            docs = self._inflight + list(self._queue)
+        return [d for d in docs if username is None or d.get("username") == username]
+
+    def flush(self, username: str = None, timeout: float = 30.0) -> bool:
+        """Write everything queued now and wait until `username`'s (or all) documents are stored"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._has_pending(username):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 30.0):
+        """Stop accepting documents and drain the queue (called on shutdown)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                self._abandoned = True
+                unwritten = len(self.pending())
+                HISTORY_WRITE_BEHIND_DROPPED.inc(unwritten, buffer=self.name)
+                print(f"❌ Write-behind buffer ({self.name}) closed with {unwritten} documents not yet written")
+
+    def _has_pending(self, username: str = None) -> bool:
+        docs = self._inflight + list(self._queue)
+        return any(username is None or d.get("username") == username for d in docs)
+
+    def _due(self) -> bool:
+        if not self._queue:
+            return False
+        return (
+            self._closed
+            or self._flush_requested
+            or len(self._queue) >= self.batch_size
+            or time.monotonic() - self._oldest >= self.interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closed and not self._queue:
+                        return
+                    wait = None
+                    if self._queue:
+                        wait = max(self.interval - (time.monotonic() - self._oldest), 0)
+                    self._cond.wait(wait)
+                if self._abandoned:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._inflight = batch
+                self._oldest = time.monotonic() if self._queue else None
+                if not self._queue:
+                    self._flush_requested = False
+            self._write(batch)
+            with self._cond:
+                self._inflight = []
+                self._cond.notify_all()
+
+    def _write(self, batch: list):
+        """
+        Write `batch`, retrying connection errors (e.g. across a replica set failover) until
+        MongoDB acknowledges it. Client-side _ids make retries idempotent: a duplicate key means
+        an earlier attempt whose acknowledgement was lost already stored that document.
+        """
+        attempt = 0
+        while not self._abandoned:
+            attempt += 1
+            try:
+                self.writer(batch)
+                HISTORY_WRITE_BEHIND_FLUSHED.inc(len(batch), buffer=self.name)
+                return
+            except (AutoReconnect, NetworkTimeout) as e:
+                print(f"⚠️ Write-behind flush failed (attempt {attempt}), retrying: {e}")
+            except BulkWriteError as e:
+                # Unordered insert: every document without a write error (or with a duplicate
+                # key) is stored; any other write error will not go away on retry
+                rejected = {
+                    err["index"] for err in e.details.get("writeErrors", [])
+                    if err.get("code") != DUPLICATE_KEY
+                }
+                if rejected:
+                    self._drop([batch[i] for i in sorted(rejected)], e)
+                batch = [doc for i, doc in enumerate(batch) if i not in rejected]
+                if not batch or not e.details.get("writeConcernErrors"):
+                    HISTORY_WRITE_BEHIND_FLUSHED.inc(len(batch), buffer=self.name)
+                    return
+                # Stored but not yet replicated as requested: write them again until confirmed
+                with self._cond:
+                    self._inflight = batch
+                print(f"⚠️ Write-behind flush not confirmed (attempt {attempt}), retrying: {e}")
+            except Exception as e:
+                # Validation failures, DocumentTooLarge, auth errors ... fail the same way every time
+                self._drop(batch, e)
+                return
+            time.sleep(min(RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX))
+
+    def _drop(self, docs: list, error: Exception):
+        HISTORY_WRITE_BEHIND_DROPPED.inc(len(docs), buffer=self.name)
+        print(f"❌ Write-behind buffer ({self.name}) dropped {len(docs)} documents MongoDB rejected: {error}")